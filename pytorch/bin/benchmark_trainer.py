@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import sys
+import time
+import types
+import argparse
+import tempfile
+import torch
+
+sys.path.insert(0, 'subtools/pytorch')
+
+import libs.support.utils as utils
+import libs.support.kaldi_common as kaldi_common
+import libs.training.optim as optim
+from libs.training.trainer import SimpleTrainer
+
+"""Measure the time of training steps of SimpleTrainer in some modes, such as float32 vs mixed-precision (amp)
+and synchronous vs sync_free. Every mode trains a new model with the same seed on the same random batches, which
+are put on the device in advance (like device_prefetch), so only the steps are timed.
+e.g.
+    python3 subtools/pytorch/bin/benchmark_trainer.py --modes=fp32,amp --input-size=128-30-200 \
+            subtools/pytorch/model/snowdar-xvector.py
+    python3 subtools/pytorch/bin/benchmark_trainer.py --modes=fp32,sync_free --input-size=128-80-200 \
+            --model-class=ResNetXvector subtools/pytorch/model/resnet-xvector.py
+"""
+
+# Parse
+parser = argparse.ArgumentParser(
+        description="Benchmark the training steps of SimpleTrainer.")
+
+parser.add_argument("--modes", type=str, default="fp32,amp",
+                    help="The modes to compare, separated by ','. A mode is fp32, amp, sync_free or amp+sync_free.")
+
+parser.add_argument("--input-size", type=str, default="128-30-200",
+                    help="The size of a batch, batch-feat_dim-frames.")
+
+parser.add_argument("--num-batches", type=int, default=10,
+                    help="The num of different random batches which are trained in turn.")
+
+parser.add_argument("--warmup-iters", type=int, default=10,
+                    help="The iters which are not timed.")
+
+parser.add_argument("--iters", type=int, default=100,
+                    help="The timed iters.")
+
+parser.add_argument("--report-interval-iters", type=int, default=100,
+                    help="The sync points of sync_free mode, see SimpleTrainer.is_sync_point().")
+
+parser.add_argument("--num-targets", type=int, default=1211,
+                    help="The num of speakers.")
+
+parser.add_argument("--model-class", type=str, default="Xvector",
+                    help="The class of model in model_blueprint.")
+
+parser.add_argument("--model-params", type=str, default="",
+                    help="The extra params to create model, such as \"training=True, extracted_embedding='near'\".")
+
+parser.add_argument("--use-gpu", type=str, action=kaldi_common.StrToBoolAction,
+                    default=True, choices=["true", "false"],
+                    help="Use GPU or not.")
+
+parser.add_argument("--gpu-id", type=str, default="",
+                    help="If NULL, then it will be auto-specified.")
+
+parser.add_argument("--seed", type=int, default=1024,
+                    help="The seed of model initialization and batches.")
+
+parser.add_argument("model_blueprint", metavar="model-blueprint", type=str,
+                    help="The model.py, such as subtools/pytorch/model/snowdar-xvector.py.")
+
+args = parser.parse_args()
+
+# Start
+batch_size, feat_dim, frames = [ int(x) for x in args.input_size.split('-') ]
+num_iters = args.warmup_iters + args.iters
+model_creation = "{0}({1}, {2}{3})".format(args.model_class, feat_dim, args.num_targets,
+                                          ", " + args.model_params if args.model_params != "" else "")
+
+def benchmark(mode):
+    options = mode.split('+')
+    if not set(options) <= {"fp32", "amp", "sync_free"}:
+        raise ValueError("Do not support {0} mode. Select from [fp32, amp, sync_free, amp+sync_free].".format(mode))
+    sync_free = "sync_free" in options
+
+    utils.set_all_seed(args.seed)
+    model = utils.create_model_from_py(args.model_blueprint, model_creation)
+    optimizer = optim.get_optimizer(model, {"name":"adamW", "learn_rate":0.001, "weight_decay":3e-1})
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        utils.create_model_dir(model_dir, args.model_blueprint)
+        data = types.SimpleNamespace(num_batch_train=num_iters, valid_loader=None)
+        trainer = SimpleTrainer(({"data":data, "model":model, "optimizer":optimizer},
+                                 {"model_dir":model_dir, "model_blueprint":args.model_blueprint, "use_gpu":args.use_gpu,
+                                  "gpu_id":args.gpu_id, "use_amp":"amp" in options, "sync_free":sync_free,
+                                  "report_interval_iters":args.report_interval_iters}))
+        trainer.init_training()
+    model = trainer.elements["model"]
+    device = utils.get_device(model)
+
+    generator = torch.Generator().manual_seed(args.seed)
+    batches = [ (torch.randn(batch_size, feat_dim, frames, generator=generator).to(device),
+                 torch.randint(0, args.num_targets, (batch_size,), generator=generator).to(device))
+                for i in range(args.num_batches) ]
+
+    losses = []
+    for this_iter in range(num_iters):
+        if this_iter == args.warmup_iters:
+            if device.type == "cuda": torch.cuda.synchronize(device)
+            start_time = time.time()
+        trainer.training_point = (0, this_iter, num_iters)
+        loss, acc = trainer.train_one_batch(batches[this_iter % args.num_batches], sync=not sync_free)
+        if sync_free:
+            trainer.pending_records.append((trainer.training_point, trainer.get_current_lr(), loss, acc,
+                                            trainer.grad_norm))
+            if trainer.is_sync_point(trainer.training_point):
+                losses.extend([ record[2] for record in trainer.materialize_records() ])
+        else:
+            losses.append(loss)
+    if device.type == "cuda": torch.cuda.synchronize(device)
+
+    return (time.time() - start_time) / args.iters, losses[-1], trainer.use_amp
+
+results = []
+for mode in args.modes.split(','):
+    step_time, last_loss, use_amp = benchmark(mode)
+    results.append((mode, step_time, last_loss, use_amp))
+
+base_time = results[0][1]
+print("\n{0:<16}{1:>12}{2:>12}{3:>10}{4:>14}".format("mode", "step (ms)", "egs/s", "speedup", "last loss"))
+for mode, step_time, last_loss, use_amp in results:
+    # The amp falls back to float32 if it is not CUDA, see SimpleTrainer.init_training().
+    if "amp" in mode and not use_amp: mode += "(fp32)"
+    print("{0:<16}{1:>12.2f}{2:>12.1f}{3:>10.2f}{4:>14.6f}".format(mode, step_time * 1000, batch_size / step_time,
+                                                                  base_time / step_time, last_loss))
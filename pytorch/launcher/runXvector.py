@@ -52,11 +52,13 @@ parser.add_argument("--stage", type=int, default=3,
 parser.add_argument("--endstage", type=int, default=4,
                     help="The endstage to control the endstart of training epoch (default 4).")
 
-parser.add_argument("--train-stage", type=int, default=-1,
+parser.add_argument("--train-stage", type=str, default="-1",
                     help="The stage to control the start of training epoch (default -1).\n"
                          "    -1 -> creating model_dir.\n"
                          "     0 -> model initialization (e.g. transfer learning).\n"
-                         "    >0 -> recovering training.")
+                         "    >0 -> recovering training.\n"
+                         "    epoch.iter -> recovering training from the checkpoint epoch.iter.checkpoint\n"
+                         "                  (see checkpoint_interval_iters), e.g. 4.1000.")
 
 parser.add_argument("--force-clear", type=str, action=kaldi_common.StrToBoolAction,
                     default=False, choices=["true", "false"],
@@ -83,7 +85,8 @@ args = parser.parse_args()
 ## Control options
 stage = max(0, args.stage)
 endstage = min(4, args.endstage)
-train_stage = max(-1, args.train_stage)
+train_stage, train_iter = utils.split_train_stage(args.train_stage)
+train_stage = max(-1, train_stage)
 ##--------------------------------------------------##
 ## Preprocess options
 force_clear=args.force_clear
@@ -109,8 +112,13 @@ gpu_id = args.gpu_id # If NULL, then it will be auto-specified.
 run_lr_finder = args.run_lr_finder
 
 egs_params = {
-    "aug":None, # None or specaugment
-    "aug_params":{"frequency":0.2, "frame":0.2}
+    "egs_type":"chunk", # chunk or shard. Use shard after writing shards of egs by stage 3 of preprocess_to_egs.sh.
+    "aug":None, # None, specaugment, cutout, random_erasing or batch_* of them (applied to a batch on device by trainer)
+    "aug_params":{"frequency":0.2, "frame":0.2},
+    "use_mmap":False, # If true, read chunks from memory-mapped ark files.
+    "pipe_cache_dir":"", # If not empty, cache the output of piped feats (e.g. apply-cmvn-sliding ... |) here.
+    "cache_size":0, # MB. If > 0, load the egs of trainset into shared memory once (small datasets only).
+    "valid_cache_size":0 # MB. The same for valid set, which is read in every epoch.
 }
 
 loader_params = {
@@ -121,6 +129,11 @@ loader_params = {
     "num_workers":2,
     "pin_memory":False, 
     "drop_last":True,
+    "use_batch_sampler":False, # If true, read a batch by one grouped kaldi_io.read_mats_batch calling.
+    "max_batch_frames":0, # If > 0, batch the variable-length chunks (max_chunk of preprocess_to_egs.sh) by buckets and total frames.
+    "num_spks_per_batch":0, # If > 0, every batch has num_spks_per_batch speakers x (batch_size // num_spks_per_batch) chunks, for margin losses.
+    "persistent_workers":False, # Keep the workers alive across epochs rather than forking them for every epoch.
+    "prefetch_factor":2 # The num of batches loaded in advance by every worker.
 }
 
 # Difine model_params by model_blueprint w.r.t your model's __init__(model_params).
@@ -159,6 +172,12 @@ report_interval_iters = 100 # About validation computation and loss reporting. I
                             # then compute report_interval_iters by report_times_every_epoch.
 stop_early = False
 suffix = "params" # Used in saved model file.
+device_prefetch = False # Copy the next batch to GPU on a side stream while computing this one, and log copy_ms and stall_ms.
+use_amp = False # Mixed-precision training by autocast and GradScaler (CUDA only). The margin loss and stats pooling are kept in float32.
+accumulation_steps = 1 # Accumulate the grads of N batches for one optimizer step, i.e. the effective batch size is N x batch_size.
+checkpoint_interval_iters = 0 # If > 0, save the full training states to model_dir/epoch.iter.checkpoint every N iters (keep the last 2).
+async_validation = False # Validate a weight snapshot in background (side CUDA stream) rather than stopping training. It costs a copy of model.
+sync_free = False # Do not sync GPU (loss.item() etc.) in every iter but only the report iters, where the nan is also checked.
 ##--------------------------------------------------##
 ## Other options
 exist_model=""  # Use it in transfer learning.
@@ -200,6 +219,14 @@ if stage <= 3 <= endstage:
     logger.info("Load egs to bunch.")
     # The dict [info] contains feat_dim and num_targets.
     bunch, info = egs.BaseBunch.get_bunch_from_egsdir(egs_dir, egs_params, loader_params)
+    # Or sample new chunks for every epoch from the datadir without egs (egs_params could have chunk_size etc.):
+    # bunch, info = egs.BaseBunch.get_bunch_from_datadir(traindata + "_nosil", egs_params, loader_params)
+    # Or augment clean wavs on the fly and extract features on GPU (the wav.scp of traindata without segments), e.g.
+    # egs_params.update({"egs_type":"wav", "feature_params":{"feature_type":"fbank", "num_mel_bins":80},
+    #                    "wav_aug_params":{"rir_scp":"data/rirs/wav.scp", "noise_scp":"data/musan_16000/musan_noise/wav.scp",
+    #                                      "music_scp":"data/musan_16000/musan_music/wav.scp", 
+    #                                      "babble_scp":"data/musan_16000/musan_speech/wav.scp"}})
+    # bunch, info = egs.BaseBunch.get_bunch_from_datadir(traindata, egs_params, loader_params)
 
     logger.info("Create model from model blueprint.")
     # Another way: import the model.py in this python directly, but it is not friendly to the shell script of extracting and
@@ -220,9 +247,11 @@ if stage <= 3 <= endstage:
     # Package(Elements:dict, Params:dict}. It is a key parameter's package to trainer and model_dir/config/.
     package = ({"data":bunch, "model":model, "optimizer":optimizer, "lr_scheduler":lr_scheduler},
             {"model_dir":model_dir, "model_blueprint":model_blueprint, "exist_model":exist_model, 
-            "start_epoch":train_stage, "epochs":epochs, "use_gpu":use_gpu, "gpu_id":gpu_id, 
+            "start_epoch":train_stage, "start_iter":train_iter, "epochs":epochs, "use_gpu":use_gpu, "gpu_id":gpu_id, 
             "benchmark":benchmark, "suffix":suffix, "report_times_every_epoch":report_times_every_epoch,
-            "report_interval_iters":report_interval_iters, "record_file":"train.csv"})
+            "report_interval_iters":report_interval_iters, "record_file":"train.csv", "device_prefetch":device_prefetch,
+            "use_amp":use_amp, "accumulation_steps":accumulation_steps, "checkpoint_interval_iters":checkpoint_interval_iters,
+            "async_validation":async_validation, "sync_free":sync_free})
 
     trainer = trainer.SimpleTrainer(package)
 
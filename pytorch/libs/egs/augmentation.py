@@ -10,10 +10,14 @@
 # for batch when we want to make different egs have different augmentation. It is really not simple
 # comparing with torch.nn.Dropout and it is very efficient that augmenting featues before gathered-in-batch.
 
+import math
 import torch
 import numpy as np 
 
 import libs.support.utils as utils
+import libs.support.wav_io as wav_io
+
+from .samplers import get_rank_and_world_size
 
 ### Augmentation
 class SpecAugment():
@@ -43,8 +47,6 @@ class SpecAugment():
         self.random_rows = random_rows
         self.random_cols = random_cols
 
-        self.init = False
-
     def __call__(self, inputs):
         """
         @inputs: a 2-dimensional tensor (a batch), including [frenquency, time]
@@ -57,16 +59,15 @@ class SpecAugment():
             else:
                 raise TypeError("Expected np.ndarray or torch.Tensor, but got {}".format(type(inputs).__name__))
 
-            if not self.init:
-                input_size = inputs.shape
-                assert len(input_size) == 2
-                if self.p_f > 0.:
-                    self.num_f = input_size[0] # Total channels.
-                    self.F = int(self.num_f * self.p_f) # Max channels to drop.
-                if self.p_t > 0.:
-                    self.num_t = input_size[1] # Total frames. It requires all egs with the same frames.
-                    self.T = int(self.num_t * self.p_t) # Max frames to drop.
-                self.init = True
+            # The masks are computed w.r.t the size of every sample, so the egs could have different frames.
+            input_size = inputs.shape
+            assert len(input_size) == 2
+            if self.p_f > 0.:
+                self.num_f = input_size[0] # Total channels.
+                self.F = int(self.num_f * self.p_f) # Max channels to drop.
+            if self.p_t > 0.:
+                self.num_t = input_size[1] # Total frames.
+                self.T = int(self.num_t * self.p_t) # Max frames to drop.
 
             if self.p_f > 0.:
                 if self.random_rows:
@@ -74,16 +75,22 @@ class SpecAugment():
                 else:
                     multi = self.rows
 
+                # Scale the inputs once by the product of inverted factors of all masks, in place.
+                inverted_factor = 1.
                 for i in range(multi):
                     f = np.random.randint(0, self.F + 1)
                     f_0 = np.random.randint(0, self.num_f - f + 1)
 
-                    inverted_factor = self.num_f / (self.num_f - f)
+                    inverted_factor *= self.num_f / (self.num_f - f)
                     if numpy_tensor:
                         inputs[f_0:f_0+f,:].fill(0.)
-                        inputs = torch.from_numpy(inputs).mul_(inverted_factor).numpy()
                     else:
                         inputs[f_0:f_0+f,:].fill_(0.)
+
+                if inverted_factor != 1.:
+                    if numpy_tensor:
+                        inputs *= inverted_factor
+                    else:
                         inputs.mul_(inverted_factor)
 
 
@@ -105,7 +112,50 @@ class SpecAugment():
         return inputs
 
 
-# To do.
+class BatchSpecAugment():
+    """The batch version of SpecAugment which masks a [batch, frenquency, time] tensor on its device (such as GPU
+    after transferring) by a few vectorized operations, rather than masking every sample in DataLoader workers.
+    Every sample gets its independent random masks and the masks are the same as SpecAugment in distribution.
+    """
+    def __init__(self, frequency=0.2, frame=0.2, rows=1, cols=1, random_rows=False, random_cols=False):
+        assert 0. <= frequency < 1.
+        assert 0. <= frame < 1. # a.k.a time axis.
+
+        self.p_f = frequency
+        self.p_t = frame
+
+        # Multi-mask.
+        self.rows = rows # Mask rows times for frequency.
+        self.cols = cols # Mask cols times for frame.
+
+        self.random_rows = random_rows
+        self.random_cols = random_cols
+
+    def __call__(self, inputs):
+        """
+        @inputs: a 3-dimensional tensor (a batch), including [batch, frenquency, time]
+        """
+        if not isinstance(inputs, torch.Tensor):
+            raise TypeError("Expected torch.Tensor, but got {}".format(type(inputs).__name__))
+        assert len(inputs.shape) == 3
+
+        batch_size, num_f, num_t = inputs.shape
+        device = inputs.device
+
+        if self.p_f > 0. and self.rows > 0:
+            masks, widths = get_batch_range_masks(batch_size, num_f, int(num_f * self.p_f), self.rows, self.random_rows, device)
+            masks = masks.any(dim=0)
+            # The product of inverted factors of all masks like SpecAugment.
+            inverted_factor = (num_f / (num_f - widths).float()).prod(dim=0)
+            inputs = inputs.masked_fill(masks.unsqueeze(2), 0.) * inverted_factor.view(batch_size, 1, 1).to(inputs.dtype)
+
+        if self.p_t > 0. and self.cols > 0:
+            masks, _ = get_batch_range_masks(batch_size, num_t, int(num_t * self.p_t), self.cols, self.random_cols, device)
+            inputs = inputs.masked_fill(masks.any(dim=0).unsqueeze(1), 0.)
+
+        return inputs
+
+
 class Cutout():
     """Cutout for CNN training like CV. 
     It is different to SpecAugment for it does not mask whole time or frequency axis instead of a rectangle area.
@@ -116,38 +166,343 @@ class Cutout():
 
            [2] Zhong, Z., Zheng, L., Kang, G., Li, S., & Yang, Y. (2017). Random erasing data augmentation. 
                arXiv preprint arXiv:1708.04896.
+
+    Every hole is a rectangle with random height in [0, frequency * num_f] and width in [0, frame * num_t].
+    Random erasing is the cutout with p < 1 and random_fill=True, i.e. a sample is erased with probability p and
+    the holes are filled by uniform random values in [min, max] of the sample rather than zeros.
+    It works for a [frenquency, time] sample (np.ndarray or torch.Tensor) in egs and for a [batch, frenquency, time] 
+    torch.Tensor on device by vectorized masks, where every sample gets its independent holes.
+    """
+    def __init__(self, frequency=0.2, frame=0.2, holes=1, random_holes=False, p=1., random_fill=False):
+        assert 0. <= frequency <= 1.
+        assert 0. <= frame <= 1.
+        assert 0. <= p <= 1.
+
+        self.p_f = frequency
+        self.p_t = frame
+
+        self.holes = holes
+        self.random_holes = random_holes
+
+        self.p = p
+        self.random_fill = random_fill
+
+    def __call__(self, inputs):
+        """
+        @inputs: a 2-dimensional tensor (a sample), including [frenquency, time] or
+                 a 3-dimensional torch.Tensor (a batch), including [batch, frenquency, time]
+        """
+        if not isinstance(inputs, (np.ndarray, torch.Tensor)):
+            raise TypeError("Expected np.ndarray or torch.Tensor, but got {}".format(type(inputs).__name__))
+
+        if self.p_f <= 0. or self.p_t <= 0. or self.holes <= 0 or self.p <= 0.:
+            return inputs
+
+        if len(inputs.shape) == 3 and isinstance(inputs, torch.Tensor):
+            return self.__batch_cutout(inputs)
+        elif len(inputs.shape) == 2:
+            return self.__cutout(inputs)
+        else:
+            raise ValueError("Expected a [frenquency, time] sample or a [batch, frenquency, time] torch.Tensor, "
+                             "but got shape {}.".format(tuple(inputs.shape)))
+
+    def __cutout(self, inputs):
+        """Cut out a sample in place.
+        """
+        if self.p < 1. and np.random.rand() >= self.p:
+            return inputs
+
+        num_f, num_t = inputs.shape
+        F = int(num_f * self.p_f) # Max channels of a hole.
+        T = int(num_t * self.p_t) # Max frames of a hole.
+
+        multi = np.random.randint(1, self.holes+1) if self.random_holes else self.holes
+
+        if self.random_fill:
+            low, high = float(inputs.min()), float(inputs.max())
+
+        for i in range(multi):
+            f = np.random.randint(0, F + 1)
+            t = np.random.randint(0, T + 1)
+            f_0 = np.random.randint(0, num_f - f + 1)
+            t_0 = np.random.randint(0, num_t - t + 1)
+
+            if self.random_fill:
+                inputs[f_0:f_0+f, t_0:t_0+t] = np.random.uniform(low, high, size=(f, t)) if \
+                    isinstance(inputs, np.ndarray) else \
+                    torch.empty(f, t, device=inputs.device, dtype=inputs.dtype).uniform_(low, high)
+            elif isinstance(inputs, np.ndarray):
+                inputs[f_0:f_0+f, t_0:t_0+t].fill(0.)
+            else:
+                inputs[f_0:f_0+f, t_0:t_0+t].fill_(0.)
+
+        return inputs
+
+    def __batch_cutout(self, inputs):
+        batch_size, num_f, num_t = inputs.shape
+        device = inputs.device
+
+        # The number of holes of every sample is drawn once and shared by both axes, so a hole is either used on
+        # both axes or on neither.
+        multi = get_batch_times(batch_size, self.holes, self.random_holes, device)
+
+        # [holes, batch, size]
+        masks_f, _ = get_batch_range_masks(batch_size, num_f, int(num_f * self.p_f), self.holes, self.random_holes, 
+                                           device, multi=multi)
+        masks_t, _ = get_batch_range_masks(batch_size, num_t, int(num_t * self.p_t), self.holes, self.random_holes, 
+                                           device, multi=multi)
+        # The empty masks of unused holes (by random_holes) keep their rectangles empty.
+        masks = (masks_f.unsqueeze(3) & masks_t.unsqueeze(2)).any(dim=0)
+
+        if self.p < 1.:
+            masks &= (torch.rand(batch_size, device=device) < self.p).view(batch_size, 1, 1)
+
+        if self.random_fill:
+            low = inputs.detach().amin(dim=(1, 2), keepdim=True)
+            high = inputs.detach().amax(dim=(1, 2), keepdim=True)
+            values = low + torch.rand_like(inputs) * (high - low)
+            return torch.where(masks, values, inputs)
+        else:
+            return inputs.masked_fill(masks, 0.)
+
+
+class BatchWavAugment():
+    """Segment augmentation of a [batch, samples] waveform tensor before extracting acoustics, which replaces the 
+    offline copies of augmentDataByNoise.sh (kaldi/egs/sre16/v2/run.sh), so the augmentation type and its noise
+    are drawn again for every chunk in every epoch.
+    Every sample is kept clean or augmented by one of reverb (convolve with a RIR), noise, music or babble (add
+    a random segment at a random SNR) w.r.t the weights. The noises are read by wav_io.MmapWavReader from the
+    cached wav_io.WavIndex of their wav.scp, such as the data/musan_16000/musan_noise made by augmentDataByNoise.sh.
+    """
+    aug_types = ["clean", "reverb", "noise", "music", "babble"]
+
+    def __init__(self, rir_scp="", noise_scp="", music_scp="", babble_scp="", weights={}, noise_snr=[0, 15], 
+                 music_snr=[5, 15], babble_snr=[13, 20], babble_speakers=[3, 7], max_rir_length=1.0, 
+                 sample_rate=16000, max_open=64, seed=None):
+        """
+        @weights: the relative probabilities of aug_types, default 1 for clean and the types whose scp is given.
+        @noise_snr, music_snr, babble_snr: [low, high] dB, the SNR is drawn uniformly.
+        @babble_speakers: [low, high], the number of speech segments which are summed for babble.
+        @max_rir_length: the RIRs are cut to max_rir_length seconds after their direct path.
+        """
+        self.sample_rate = sample_rate
+        self.snrs = {"noise":noise_snr, "music":music_snr, "babble":babble_snr}
+        self.babble_speakers = babble_speakers
+        self.max_rir_length = int(max_rir_length * sample_rate)
+
+        scps = {"reverb":rir_scp, "noise":noise_scp, "music":music_scp, "babble":babble_scp}
+        self.wav_indexes = { aug_type:wav_io.load_wav_index(scp, sample_rate=sample_rate) 
+                             for aug_type, scp in scps.items() if scp != "" }
+        self.reader = wav_io.MmapWavReader(max_open)
+
+        self.weights = np.array([ weights.get(aug_type, 1.) if aug_type == "clean" or aug_type in self.wav_indexes 
+                                  else 0. for aug_type in self.aug_types ], dtype=np.float64)
+        if self.weights.sum() <= 0:
+            raise ValueError("Expected the sum of weights of available aug types > 0, but got {0}.".format(self.weights))
+        self.weights /= self.weights.sum()
+
+        # Draw the noises by a separate random state, which is seeded by (seed + rank), so the ranks of Horovod/DDP
+        # augment their batches differently.
+        self.rank, _ = get_rank_and_world_size()
+        self.random_state = np.random.RandomState((0 if seed is None else seed) + self.rank)
+
+    def split_random_state(self):
+        """The trainer saves the random state of rank 0 only and every rank loads it when resuming, so the other 
+        ranks derive their random states from it by their ranks to keep the noises of ranks different.
+        """
+        if self.rank > 0:
+            self.random_state = np.random.RandomState([self.random_state.randint(2**31), self.rank])
+
+    def read_noises(self, aug_type, num, length):
+        """Read num random [length] segments (wrapped around if it is short) of aug_type wavs.
+        """
+        wav_index = self.wav_indexes[aug_type]
+        indexes = self.random_state.randint(0, len(wav_index), size=num)
+        starts = self.random_state.randint(0, np.maximum(np.asarray(wav_index.num_samples)[indexes] - length, 0) + 1)
+        return torch.from_numpy(self.reader.read_batch(wav_index, indexes, starts, length))
+
+    def add_noises(self, inputs, noises, snrs):
+        """Scale the [n, samples] noises to the SNRs (dB) w.r.t the power of inputs and add them.
+        """
+        power = inputs.pow(2).mean(dim=1, keepdim=True)
+        noise_power = noises.pow(2).mean(dim=1, keepdim=True).clamp(min=1e-5)
+        scale = torch.sqrt(power / (noise_power * torch.pow(10., snrs.view(-1, 1) / 10.)))
+        return inputs + noises * scale
+
+    def reverberate(self, inputs, rirs):
+        """Convolve the inputs with the [n, rir_length] RIRs by FFT. The outputs are aligned to the direct path
+        (the peak of RIR) and scaled to the power of inputs like wav-reverberate --shift-output --normalize-output.
+        """
+        length = inputs.shape[1]
+        rir_length = rirs.shape[1]
+        n = 2 ** math.ceil(math.log2(length + rir_length - 1))
+
+        outputs = torch.fft.irfft(torch.fft.rfft(inputs, n=n) * torch.fft.rfft(rirs, n=n), n=n)[:, :length]
+
+        power = inputs.pow(2).mean(dim=1, keepdim=True)
+        outputs_power = outputs.pow(2).mean(dim=1, keepdim=True).clamp(min=1e-5)
+        return outputs * torch.sqrt(power / outputs_power)
+
+    def read_rirs(self, num):
+        """Read num random RIRs which start at their peak (direct path) and are padded to the same length.
+        """
+        wav_index = self.wav_indexes["reverb"]
+        indexes = self.random_state.randint(0, len(wav_index), size=num)
+        rirs = [ np.asarray(self.reader.get_samples(wav_index, index), dtype=np.float32) for index in indexes ]
+        rirs = [ rir[np.argmax(np.abs(rir)):][:self.max_rir_length] for rir in rirs ]
+
+        out = np.zeros((num, max([ len(rir) for rir in rirs ])), dtype=np.float32)
+        for i, rir in enumerate(rirs):
+            out[i, :len(rir)] = rir / max(np.sqrt(np.sum(rir ** 2)), 1e-5)
+        return torch.from_numpy(out)
+
+    def __call__(self, inputs):
+        """
+        @inputs: a [batch, samples] waveform tensor in the scale of 16-bit samples.
+        """
+        if not isinstance(inputs, torch.Tensor):
+            raise TypeError("Expected torch.Tensor, but got {}".format(type(inputs).__name__))
+        assert len(inputs.shape) == 2
+
+        batch_size, length = inputs.shape
+        device = inputs.device
+        inputs = inputs.float()
+
+        types = self.random_state.choice(len(self.aug_types), size=batch_size, p=self.weights)
+        outputs = inputs.clone()
+
+        for type_id, aug_type in enumerate(self.aug_types):
+            selected = np.flatnonzero(types == type_id)
+            if aug_type == "clean" or len(selected) == 0:
+                continue
+
+            selected_tensor = torch.from_numpy(selected).to(device)
+            samples = inputs.index_select(0, selected_tensor)
+
+            if aug_type == "reverb":
+                augmented = self.reverberate(samples, self.read_rirs(len(selected)).to(device))
+            else:
+                if aug_type == "babble":
+                    low, high = self.babble_speakers
+                    num_speakers = self.random_state.randint(low, high + 1, size=len(selected))
+                    noises = self.read_noises(aug_type, len(selected) * high, length).view(len(selected), high, length)
+                    # Use the first num_speakers segments of every sample.
+                    used = torch.arange(high).unsqueeze(0) < torch.from_numpy(num_speakers).unsqueeze(1)
+                    noises = (noises * used.unsqueeze(2).float()).sum(dim=1)
+                else:
+                    noises = self.read_noises(aug_type, len(selected), length)
+                low, high = self.snrs[aug_type]
+                snrs = torch.from_numpy(self.random_state.uniform(low, high, size=len(selected)).astype(np.float32))
+                augmented = self.add_noises(samples, noises.to(device, non_blocking=True), snrs.to(device))
+
+            outputs.index_copy_(0, selected_tensor, augmented)
+
+        return outputs
+
+
+### Function
+def get_batch_times(batch_size, times, random_times, device):
+    """Return the [batch] numbers of ranges of samples, randint(1, times + 1) with random_times or times.
+    """
+    if random_times:
+        return torch.randint(1, times + 1, (batch_size,), device=device)
+    else:
+        return torch.full((batch_size,), times, dtype=torch.long, device=device)
+
+
+def get_batch_range_masks(batch_size, size, max_width, times, random_times, device, multi=None):
+    """Draw times random ranges (masks) along an axis for every sample of a batch at once.
+    Return ([times, batch, size] bool masks, [times, batch] widths) and the width of a range is in [0, max_width].
+    With random_times, every sample uses randint(1, times + 1) ranges and the others are empty.
+    @multi: the [batch] numbers of used ranges given by get_batch_times(), e.g. to share them by two axes.
     """
-    def __init__(self):
-        raise NotImplementedError
+    if multi is None:
+        multi = get_batch_times(batch_size, times, random_times, device)
+
+    # [times, batch]
+    widths = (torch.rand(times, batch_size, device=device) * (max_width + 1)).long()
+    widths = widths * (torch.arange(times, device=device).unsqueeze(1) < multi.unsqueeze(0)).long()
+    starts = (torch.rand(times, batch_size, device=device) * (size - widths + 1).float()).long()
+
+    positions = torch.arange(size, device=device).view(1, 1, size)
+    masks = (positions >= starts.unsqueeze(2)) & (positions < (starts + widths).unsqueeze(2))
+
+    return masks, widths
 
-    def __call__(self):
-        pass
 
 ### Wrapper
+# They are applied to a batch on device by trainer rather than to samples in egs.
+batch_augmentations = ["batch_specaugment", "batch_cutout", "batch_random_erasing"]
+
 def get_augmentation(aug=None, aug_params={}):
     default_aug_params = {
         "frequency":0.2,
-        "frame":0.,
+        "frame":None, # The default is 0. for specaugment and 0.2 for cutout and random_erasing.
         "rows":1, 
         "cols":0,
         "random_rows":False, 
-        "random_cols":False
+        "random_cols":False,
+        # For cutout and random_erasing, frequency and frame are the max height and width ratios of a hole.
+        "holes":1,
+        "random_holes":False,
+        "p":0.5, # The probability to erase a sample for random_erasing (cutout always uses 1.).
+        "random_fill":True # Fill the holes by random values or zeros for random_erasing.
     }
 
     aug_params = utils.assign_params_dict(default_aug_params, aug_params)
 
+    # A hole of cutout with 0 frames masks nothing, so the cutout has its own default.
+    if aug_params["frame"] is None:
+        aug_params["frame"] = 0.2 if aug in ["cutout", "batch_cutout", "random_erasing", "batch_random_erasing"] else 0.
+
     if aug is None or aug == "" or aug == False:
         return None
     elif aug == "specaugment":
         return SpecAugment(frequency=aug_params["frequency"], frame=aug_params["frame"], 
                                 rows=aug_params["rows"], cols=aug_params["cols"],
                                 random_rows=aug_params["random_rows"], random_cols=aug_params["random_cols"])
-    elif aug == "cutout":
-        raise NotImplementedError
+    elif aug == "batch_specaugment":
+        return BatchSpecAugment(frequency=aug_params["frequency"], frame=aug_params["frame"], 
+                                rows=aug_params["rows"], cols=aug_params["cols"],
+                                random_rows=aug_params["random_rows"], random_cols=aug_params["random_cols"])
+    elif aug == "cutout" or aug == "batch_cutout":
+        return Cutout(frequency=aug_params["frequency"], frame=aug_params["frame"], 
+                      holes=aug_params["holes"], random_holes=aug_params["random_holes"])
+    elif aug == "random_erasing" or aug == "batch_random_erasing":
+        return Cutout(frequency=aug_params["frequency"], frame=aug_params["frame"], 
+                      holes=aug_params["holes"], random_holes=aug_params["random_holes"],
+                      p=aug_params["p"], random_fill=aug_params["random_fill"])
     else:
         raise TypeError("Do not support {} augmentation.".format(aug))
 
 
+def get_wav_augmentation(wav_aug_params={}):
+    """Return BatchWavAugment or None if there is no scp of noises.
+    """
+    default_wav_aug_params = {
+        "rir_scp":"",
+        "noise_scp":"",
+        "music_scp":"",
+        "babble_scp":"",
+        "weights":{},
+        "noise_snr":[0, 15],
+        "music_snr":[5, 15],
+        "babble_snr":[13, 20],
+        "babble_speakers":[3, 7],
+        "max_rir_length":1.0,
+        "sample_rate":16000,
+        "max_open":64,
+        "seed":None
+    }
+
+    wav_aug_params = utils.assign_params_dict(default_wav_aug_params, wav_aug_params)
+
+    if all([ wav_aug_params[key] == "" for key in ["rir_scp", "noise_scp", "music_scp", "babble_scp"] ]):
+        return None
+
+    return BatchWavAugment(**wav_aug_params)
+
+
 # Test.
 if __name__ == "__main__":
     print("Test aug frenquency only with numpy array...")
@@ -163,6 +518,28 @@ if __name__ == "__main__":
     print("Test aug frenquency and time with torch tensor...")
     tensor = torch.randn(8,8)
     aug_all =SpecAugment(frequency=0.5, frame=0.5, rows=2, cols=2)
-    print(aug_all(tensor))
+    print(aug_all(tensor),"\n")
+
+    print("Test cutout with numpy array and random erasing with batch tensor...")
+    print(Cutout(frequency=0.5, frame=0.5, holes=2)(np.random.randn(8,8)))
+    print(Cutout(frequency=0.5, frame=0.5, p=0.5, random_fill=True)(torch.randn(2,8,8)),"\n")
+
+    print("Benchmark the throughput of [80, 200] samples in batch of 128...")
+    import time
+    batch = torch.randn(128, 80, 200)
+    samples = [ x.numpy() for x in batch ]
+    augs = [("per-sample specaugment", SpecAugment(frequency=0.2, frame=0.2, rows=2, cols=2), False),
+            ("per-sample cutout", Cutout(frequency=0.2, frame=0.2, holes=2), False),
+            ("batch specaugment", BatchSpecAugment(frequency=0.2, frame=0.2, rows=2, cols=2), True),
+            ("batch cutout", Cutout(frequency=0.2, frame=0.2, holes=2), True),
+            ("batch random erasing", Cutout(frequency=0.2, frame=0.2, holes=2, p=0.5, random_fill=True), True)]
+    for name, aug, batched in augs:
+        start_time = time.time()
+        for i in range(10):
+            if batched:
+                aug(batch)
+            else:
+                for x in samples: aug(x)
+        print("{0}: {1:.0f} samples/s".format(name, 10 * len(batch) / (time.time() - start_time)))
 
     print("Test done.")
\ No newline at end of file
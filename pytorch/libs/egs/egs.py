@@ -3,18 +3,30 @@
 # Copyright xmuspeech (Author: Snowdar 2019-05-29 2020-02-05)
 
 import os
+import time
 import logging
-import pandas as pd
+import itertools
 
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset
 from torch.utils.data import DataLoader
+from torch.utils.data import BatchSampler, RandomSampler, SequentialSampler
+from torch.utils.data.dataloader import default_collate
 import torch.distributed as dist
 
 import libs.support.utils as utils
 import libs.support.kaldi_io as kaldi_io
+import libs.support.wav_io as wav_io
 from libs.support.prefetch_generator import BackgroundGenerator
 
+from .egs_index import load_egs_index, OnlineEgsIndex
+from .samplers import SeededSampler, OnlineChunkSampler, BucketBatchSampler, SpeakerBatchSampler
+from .samplers import get_rank_and_world_size
+from .kaldi_dataset import KaldiDataset
+from .samples import ChunkSamples
+from .egs_shards import get_shards_dir, load_shards_list, get_affine_path, get_lengths_path, dequantize_egs
+from .features import get_batch_features
+
 # There are specaugment and cutout etc..
 from .augmentation import *
 
@@ -30,7 +42,8 @@ class ChunkEgs(Dataset):
     The acoustic feature based egs are not [frames, feature-dim] matrix format any more and it should be seen as 
     a [feature-dim, frames] tensor after transposing.
     """
-    def __init__(self, egs_csv, io_status=True, aug=None, aug_params={}):
+    def __init__(self, egs_csv, io_status=True, aug=None, aug_params={}, use_mmap=False, mmap_max_open=64,
+                 use_index=True, pipe_cache_dir="", egs_index=None, cache_size=0):
         """
         @egs_csv:
             utt-id:str  chunk_feats_path:offset:str chunk-start:int  chunk-end:int  [label]xn
@@ -38,53 +51,372 @@ class ChunkEgs(Dataset):
         Other option
         @io_status: if false, do not read data from disk and return zero, which is useful for saving i/o resource 
         when kipping seed index.
+        @use_mmap: if true, read chunks by kaldi_io.MmapArkReader, which keeps at most mmap_max_open mapped ark files
+        for every worker, rather than opening the ark file for every chunk.
+        @use_index: if true, memory-map the pre-parsed egs index (see egs_index.py) which is saved next to egs_csv
+        rather than loading egs_csv by pandas.
+        @pipe_cache_dir: if not empty, the output of piped rxfiles (such as 'apply-cmvn-sliding ... |') will be
+        materialized to this directory once by kaldi_io.PipeCache and reused in the next epochs.
+        @egs_index: use the given index (such as OnlineEgsIndex) rather than loading it from egs_csv.
+        @cache_size: if > 0, load the egs once into a contiguous tensor in shared memory (/dev/shm) which is seen by
+        the forked workers without copying, until cache_size MB is used. The other egs are still read from disk.
         """
         self.io_status = io_status
 
+        # The feature-dim of egs is known after reading the first batch in get_batch() or building the cache.
+        self.feat_dim = None
+
+        # Count the bytes copied by this dataset in every worker.
+        self.num_copied_bytes = 0
+        self.num_copied_samples = 0
+
+        # The reader is created here but the ark files are mapped lazily in every worker.
+        self.mmap_reader = kaldi_io.MmapArkReader(mmap_max_open) if use_mmap else None
+        self.pipe_cache = kaldi_io.PipeCache(pipe_cache_dir) if pipe_cache_dir != "" else None
+
         # Augmentation.
         self.aug = get_augmentation(aug, aug_params)
 
-        assert egs_csv != "" and egs_csv is not None
-        self.data_frame = pd.read_csv(egs_csv, sep=" ").values
+        if egs_index is not None:
+            self.egs_index = egs_index
+        else:
+            assert egs_csv != "" and egs_csv is not None
+            self.egs_index = load_egs_index(egs_csv, chunk=True, use_index=use_index)
         # For multi-label.
-        self.num_target_types = self.data_frame.shape[1] - 4 # Except utt-id, path, chunk-start and chunk-end.
+        self.num_target_types = self.egs_index.num_target_types
+
+        self.num_cached = 0
+        if cache_size > 0:
+            self.build_cache(cache_size)
 
     def set_io_status(self, io_status):
         self.io_status = io_status
 
+    def build_cache(self, cache_size, block_size=1024):
+        """Load the first egs (in index order) which could be held by cache_size MB into self.cache, a 1-dim float32
+        tensor in shared memory, where the egs are contiguous [feature-dim, frames] samples one by one.
+        """
+        lengths = self.get_lengths()
+        first_chunk = self.egs_index.get_chunk(0)
+        self.feat_dim = kaldi_io.read_mat_at(*self.get_ark(0), chunk=first_chunk).shape[1]
+
+        sizes = np.cumsum(lengths * self.feat_dim)
+        self.num_cached = int(np.searchsorted(sizes, int(cache_size * 1024 * 1024) // 4, side='right'))
+        self.cache_offsets = np.concatenate([[0], sizes[:self.num_cached]]).astype(np.int64)
+        self.cache = torch.empty(int(self.cache_offsets[-1]), dtype=torch.float32).share_memory_()
+
+        cache = self.cache.numpy()
+        for begin in range(0, self.num_cached, block_size):
+            end = min(begin + block_size, self.num_cached)
+            requests = [ self.get_ark(index) + tuple(self.egs_index.get_chunk(index)) for index in range(begin, end) ]
+            block = cache[self.cache_offsets[begin]:self.cache_offsets[end]]
+
+            if np.all(lengths[begin:end] == lengths[begin]):
+                # The egs of a block are read by one kaldi_io.read_mats_batch calling.
+                kaldi_io.read_mats_batch(requests, out=block.reshape(end - begin, self.feat_dim, lengths[begin]), 
+                                         transpose=True)
+            else:
+                for index, request in zip(range(begin, end), requests):
+                    self.get_cached(index)[...] = kaldi_io.read_mat_at(request[0], request[1], chunk=request[2:]).T
+
+        logger.info("Cache {0}/{1} egs ({2:.1f} MB) in shared memory.".format(self.num_cached, len(self),
+                     self.cache.numel() * 4 / 1024 / 1024))
+
+    def get_cached(self, index):
+        """Return the cached [feature-dim, frames] egs (a view of self.cache) or None if it is not cached.
+        """
+        if not isinstance(index, (int, np.integer)) or index >= self.num_cached:
+            return None
+        begin, end = self.cache_offsets[index], self.cache_offsets[index + 1]
+        return self.cache.numpy()[begin:end].reshape(self.feat_dim, -1)
+
+    def get_ark(self, index):
+        ark_path, offset = self.egs_index.get_ark(index)
+
+        if self.pipe_cache is not None and offset < 0 and ark_path.endswith('|'):
+            return self.pipe_cache.get(ark_path)
+
+        return ark_path, offset
+
     def __getitem__(self, index):
+        if isinstance(index, list):
+            # A list of indexes comes from the batch sampler of BaseBunch.
+            return self.get_batch(index)
+
         if not self.io_status :
             return 0., 0.
 
-        chunk = [int(self.data_frame[index][2]), int(self.data_frame[index][3])]
-
-        egs = kaldi_io.read_mat(self.data_frame[index][1], chunk=chunk)
+        target = self.egs_index.get_target(index)
+        cached = self.get_cached(index)
 
-        if self.num_target_types == 1:
-            target = self.data_frame[index][4]
+        if cached is not None:
+            # Copy it from the cache, so the augmentation could work in place.
+            sample = cached.copy()
         else:
-            target = self.data_frame[index][4:]
+            ark_path, offset = self.get_ark(index)
+            chunk = self.egs_index.get_chunk(index)
+
+            if self.mmap_reader is not None:
+                egs = self.mmap_reader.read_mat_at(ark_path, offset, chunk=chunk)
+            else:
+                egs = kaldi_io.read_mat_at(ark_path, offset, chunk=chunk)
 
-        # Note, egs read from kaldi_io is read-only and 
-        # use egs = np.require(egs, requirements=['O', 'W']) to make it writeable.
-        # It avoids the problem "ValueError: assignment destination is read-only".
-        # Note that, do not use inputs.flags.writeable = True when the version of numpy >= 1.17.
-        egs = np.require(egs, requirements=['O', 'W'])
+            # Note, egs read from kaldi_io is read-only (and it is a view of the map with use_mmap).
+            # Copy it once to a writeable and contiguous [feature-dim, frames] sample rather than copying it by
+            # np.require(egs, requirements=['O', 'W']) and returning a non-contiguous egs.T, so that the augmentation
+            # could work in place and egs_collate() just stacks the samples by another copy.
+            sample = np.empty((egs.shape[1], egs.shape[0]), dtype=np.float32)
+            sample[...] = egs.T
+        self.count_copy(sample.nbytes)
 
         if self.aug is not None:
-            return self.aug(egs.T), target
+            return self.aug(sample), target
         else:
-            return egs.T, target
+            return sample, target
+
+    def get_batch(self, indexes):
+        """Read a batch of chunks by one kaldi_io.read_mats_batch calling, which groups the reads by ark file and 
+        offset, and return ([batch, feature-dim, frames], [batch]) which has been collated.
+        """
+        if not self.io_status :
+            return 0., 0.
+
+        chunks = [ self.egs_index.get_chunk(index) for index in indexes ]
+        num_frames = min([ end - start + 1 for start, end in chunks ])
+
+        requests = []
+        disk_rows = []
+        cached_rows = []
+        for row, (index, (start, end)) in enumerate(zip(indexes, chunks)):
+            offset = 0
+            if end - start + 1 > num_frames:
+                # Crop the variable-length chunks (see BucketBatchSampler) to the same length without padding.
+                offset = np.random.randint(0, end - start + 2 - num_frames)
+            cached = self.get_cached(index)
+            if cached is not None:
+                cached_rows.append((row, cached[:, offset:offset + num_frames]))
+            else:
+                disk_rows.append(row)
+                requests.append(self.get_ark(index) + (start + offset, start + offset + num_frames - 1))
+
+        if self.feat_dim is not None:
+            # Read the chunks straight into a batch tensor which is in shared memory in workers, so it is
+            # sent to the main process without another copy.
+            batch = new_batch_tensor((len(indexes), self.feat_dim, num_frames), torch.float32)
+            if len(cached_rows) == 0:
+                kaldi_io.read_mats_batch(requests, out=batch.numpy(), transpose=True)
+            else:
+                egs = batch.numpy()
+                for row, cached in cached_rows:
+                    egs[row] = cached
+                if len(disk_rows) > 0:
+                    egs[disk_rows] = kaldi_io.read_mats_batch(requests, transpose=True)
+        else:
+            batch = torch.from_numpy(kaldi_io.read_mats_batch(requests, transpose=True))
+            self.feat_dim = batch.shape[1]
+        self.count_copy(batch.numel() * batch.element_size(), len(indexes))
+
+        targets = torch.from_numpy(np.array([ self.egs_index.get_target(index) for index in indexes ], dtype=np.int64))
+
+        if self.aug is not None:
+            egs = batch.numpy()
+            for i in range(len(egs)):
+                sample = egs[i]
+                aug_sample = self.aug(sample)
+                # Most augmentation works in place.
+                if aug_sample is not sample:
+                    sample[...] = aug_sample
+
+        return batch, targets
+
+    def get_lengths(self):
+        """The number of frames of every chunk, for BucketBatchSampler.
+        """
+        return np.asarray(self.egs_index.ends) - np.asarray(self.egs_index.starts) + 1
+
+    def get_labels(self):
+        """The (first) label of every chunk from the egs index, for SpeakerBatchSampler.
+        """
+        labels = np.asarray(self.egs_index.labels)
+        return labels if len(labels.shape) == 1 else labels[:, 0]
+
+    def count_copy(self, num_bytes, num_samples=1, log_interval=100000):
+        last_num_samples = self.num_copied_samples
+        self.num_copied_bytes += num_bytes
+        self.num_copied_samples += num_samples
+
+        if self.num_copied_samples // log_interval > last_num_samples // log_interval:
+            logger.debug("ChunkEgs of process {0} copied {1:.1f} bytes/sample in {2} samples.".format(
+                          os.getpid(), self.get_copied_bytes_per_sample(), self.num_copied_samples))
+
+    def get_copied_bytes_per_sample(self):
+        """The bytes copied by ChunkEgs per sample (excluding the one copy of collating in the per-sample path),
+        which is egs.nbytes for both per-sample and batch path now.
+        """
+        return self.num_copied_bytes / self.num_copied_samples if self.num_copied_samples > 0 else 0.
 
     def __len__(self):
-        return len(self.data_frame)
+        return len(self.egs_index)
+
+
+
+class OnlineChunkEgs(ChunkEgs):
+    """Sample chunks online from a kaldi datadir without egs csv. The chunks are drawn by the sampler from 
+    get_sampler() (see samplers.OnlineChunkSampler) for every epoch, so the chunk_size, num_chunks_per_spk and scale
+    could be changed without preprocessing again. The chunks are fixed if fixed_chunk_num > 0, such as valid set.
+    """
+    def __init__(self, dataset, chunk_size=200, num_chunks_per_spk=-1, scale=1.5, seed=1024, fixed_chunk_num=0,
+                 io_status=True, aug=None, aug_params={}, use_mmap=False, mmap_max_open=64, pipe_cache_dir="",
+                 cache_size=0):
+        """
+        @dataset: a kaldi datadir or KaldiDataset with feats.scp, utt2num_frames and utt2spk (utt2spk_int).
+        @fixed_chunk_num: if > 0, fix fixed_chunk_num random chunks for every utt by seed (like every_utt of 
+                          ChunkSamples) and they are indexed by int.
+        @cache_size: it is only used for the fixed chunks, see ChunkEgs.
+
+        Other options are the same as ChunkEgs.
+        """
+        if isinstance(dataset, str):
+            dataset = KaldiDataset.load_data_dir(dataset)
+        if "utt2spk_int" not in dataset.loaded_attr:
+            dataset.generate("utt2spk_int")
+
+        self.chunk_size = chunk_size
+        self.num_chunks_per_spk = num_chunks_per_spk
+        self.scale = scale
+        self.seed = seed
+
+        # Only the arrays of utts are kept rather than the dicts of dataset.
+        egs_index = OnlineEgsIndex.from_dataset(dataset, chunk_size)
+
+        if fixed_chunk_num > 0:
+            samples = ChunkSamples(dataset, chunk_size, chunk_type="every_utt", chunk_num_selection=fixed_chunk_num, 
+                                   seed=seed)
+            utt2index = { utt:index for index, utt in enumerate(dataset.feats_scp.keys()) }
+            utt_indexes = np.array([ utt2index[utt] for utt in samples.utts ], dtype=np.int64)
+            egs_index.set_chunks(np.stack([utt_indexes[samples.chunk_samples["utt_index"]], 
+                                           samples.chunk_samples["start"]], axis=1))
+
+        if cache_size > 0 and fixed_chunk_num <= 0:
+            logger.warning("The chunks of OnlineChunkEgs change in every epoch, so do not cache them.")
+            cache_size = 0
+
+        super(OnlineChunkEgs, self).__init__(None, io_status=io_status, aug=aug, aug_params=aug_params, 
+                                             use_mmap=use_mmap, mmap_max_open=mmap_max_open, 
+                                             pipe_cache_dir=pipe_cache_dir, egs_index=egs_index, 
+                                             cache_size=cache_size)
+
+    def get_lengths(self):
+        return np.full(len(self), self.chunk_size, dtype=np.int64)
+
+    def get_labels(self):
+        if self.egs_index.chunks is None:
+            raise TypeError("The chunks of OnlineChunkEgs are drawn by its own sampler, so they could not be batched "
+                            "by speakers.")
+        return np.asarray(self.egs_index.labels)[self.egs_index.chunks[:, 0]]
+
+    def get_sampler(self, shuffle=True):
+        return OnlineChunkSampler(self.egs_index.num_frames, self.egs_index.labels, self.chunk_size, 
+                                  num_chunks_per_spk=self.num_chunks_per_spk, scale=self.scale, 
+                                  shuffle=shuffle, seed=self.seed)
+
+
+
+class WavChunkEgs(Dataset):
+    """Sample chunks of clean waveforms online from a kaldi datadir with wav.scp, which are augmented and converted
+    to features by trainer on device (see augmentation.BatchWavAugment and features.BatchFeatures) rather than
+    reading the features of offline augmented copies. The chunks are drawn by the sampler from get_sampler() like
+    OnlineChunkEgs, and a batch of chunks is read from the memory-mapped wavs by wav_io.MmapWavReader.
+    """
+    def __init__(self, dataset, wav_index, chunk_size=200, num_chunks_per_spk=-1, scale=1.5, seed=1024, 
+                 fixed_chunk_num=0, io_status=True, feature_params={}, mmap_max_open=64):
+        """
+        @dataset: a KaldiDataset with wav.scp and utt2spk (utt2spk_int).
+        @wav_index: the wav_io.WavIndex of the wav.scp of dataset (or of the datadir which dataset is split from).
+        @chunk_size: the number of frames of chunk w.r.t the features of feature_params.
+        @fixed_chunk_num: if > 0, fix fixed_chunk_num random chunks for every utt by seed, such as valid set.
+        """
+        if "utt2spk_int" not in dataset.loaded_attr:
+            dataset.generate("utt2spk_int")
+
+        self.io_status = io_status
+        self.num_chunks_per_spk = num_chunks_per_spk
+        self.scale = scale
+        self.seed = seed
+
+        # The features are only used to get the number of samples of chunk here.
+        self.chunk_samples = get_batch_features(feature_params).get_num_samples(chunk_size)
+
+        self.wav_index = wav_index
+        self.reader = wav_io.MmapWavReader(mmap_max_open)
+
+        name2index = wav_index.get_name2index()
+        utts = list(dataset.utt2spk.keys())
+        missing = [ utt for utt in utts if utt not in name2index ]
+        if len(missing) > 0:
+            raise ValueError("There are {0} utts which are not in wav index, such as {1}. Note, the segments of "
+                             "wav.scp are not supported.".format(len(missing), missing[:5]))
+
+        self.wav_ids = np.array([ name2index[utt] for utt in utts ], dtype=np.int64)
+        self.num_samples = np.asarray(wav_index.num_samples)[self.wav_ids]
+        self.labels = np.array([ dataset.utt2spk_int[utt] for utt in utts ], dtype=np.int64)
+        self.num_target_types = 1
+
+        self.chunks = None
+        if fixed_chunk_num > 0:
+            random_state = np.random.RandomState(seed)
+            utt_indexes = np.repeat(np.flatnonzero(self.num_samples >= self.chunk_samples), fixed_chunk_num)
+            starts = random_state.randint(0, self.num_samples[utt_indexes] - self.chunk_samples + 1)
+            self.chunks = np.stack([utt_indexes, starts], axis=1)
+
+    def set_io_status(self, io_status):
+        self.io_status = io_status
+
+    def get_utt_start(self, index):
+        if self.chunks is not None and not isinstance(index, tuple):
+            return self.chunks[index]
+        return index
+
+    def __getitem__(self, index):
+        if isinstance(index, list):
+            # A list of indexes comes from the batch sampler of BaseBunch.
+            return self.get_batch(index)
+
+        if not self.io_status :
+            return 0., 0.
+
+        utt_index, start = self.get_utt_start(index)
+        sample = self.reader.read_batch(self.wav_index, [self.wav_ids[utt_index]], [start], self.chunk_samples)[0]
+
+        return sample, int(self.labels[utt_index])
+
+    def get_batch(self, indexes):
+        """Read a batch of chunks and return ([batch, samples], [batch]) which has been collated.
+        """
+        if not self.io_status :
+            return 0., 0.
+
+        utt_starts = np.array([ self.get_utt_start(index) for index in indexes ], dtype=np.int64).reshape(-1, 2)
+        batch = new_batch_tensor((len(indexes), self.chunk_samples), torch.float32)
+        self.reader.read_batch(self.wav_index, self.wav_ids[utt_starts[:, 0]], utt_starts[:, 1], self.chunk_samples,
+                               out=batch.numpy())
+
+        return batch, torch.from_numpy(self.labels[utt_starts[:, 0]])
+
+    def get_sampler(self, shuffle=True):
+        return OnlineChunkSampler(self.num_samples, self.labels, self.chunk_samples, 
+                                  num_chunks_per_spk=self.num_chunks_per_spk, scale=self.scale, 
+                                  shuffle=shuffle, seed=self.seed)
+
+    def __len__(self):
+        return len(self.chunks) if self.chunks is not None else len(self.num_samples)
 
 
 
 class VectorEgs(Dataset):
     """It is used for vector of Kaldi format rather than feats matrix.
     """
-    def __init__(self, egs_csv, io_status=True, aug=None, aug_params={}):
+    def __init__(self, egs_csv, io_status=True, aug=None, aug_params={}, use_index=True, cache_size=0):
         """
         @egs_csv:
             utt-id:str  chunk_feats_path:offset:str  [label]xn
@@ -92,6 +424,9 @@ class VectorEgs(Dataset):
         Other option
         @io_status: if false, do not read data from disk and return zero, which is useful for saving i/o resource 
         when kipping seed index.
+        @use_index: if true, memory-map the pre-parsed egs index which is saved next to egs_csv.
+        @cache_size: if > 0, load the vectors into a [num_cached, dim] tensor in shared memory until cache_size MB
+        is used, like ChunkEgs.
         """
         self.io_status = io_status
 
@@ -99,23 +434,39 @@ class VectorEgs(Dataset):
         self.aug = get_augmentation(aug, aug_params)
 
         assert egs_csv != "" and egs_csv is not None
-        self.data_frame = pd.read_csv(egs_csv, sep=" ").values
+        self.egs_index = load_egs_index(egs_csv, chunk=False, use_index=use_index)
         # For multi-label.
-        self.num_target_types = self.data_frame.shape[1] - 2 # Except utt-id and path.
+        self.num_target_types = self.egs_index.num_target_types
+
+        self.num_cached = 0
+        if cache_size > 0:
+            self.build_cache(cache_size)
 
     def set_io_status(self, io_status):
         self.io_status = io_status
 
+    def build_cache(self, cache_size):
+        dim = len(kaldi_io.read_vec_flt_at(*self.egs_index.get_ark(0)))
+        self.num_cached = min(len(self), int(cache_size * 1024 * 1024) // (dim * 4))
+        self.cache = torch.empty((self.num_cached, dim), dtype=torch.float32).share_memory_()
+
+        cache = self.cache.numpy()
+        for index in range(self.num_cached):
+            cache[index] = kaldi_io.read_vec_flt_at(*self.egs_index.get_ark(index))
+
+        logger.info("Cache {0}/{1} vector egs ({2:.1f} MB) in shared memory.".format(self.num_cached, len(self),
+                     self.cache.numel() * 4 / 1024 / 1024))
+
     def __getitem__(self, index):
         if not self.io_status :
             return 0., 0.
 
-        egs = np.require(kaldi_io.read_vec_flt(self.data_frame[index][1]), requirements=['O', 'W'])
-
-        if self.num_target_types == 1:
-            target = self.data_frame[index][2]
+        if index < self.num_cached:
+            egs = self.cache.numpy()[index].copy()
         else:
-            target = self.data_frame[index][2:]
+            egs = np.require(kaldi_io.read_vec_flt_at(*self.egs_index.get_ark(index)), requirements=['O', 'W'])
+
+        target = self.egs_index.get_target(index)
 
         if self.aug is not None:
             # Note, egs from kaldi_io is read-only and 
@@ -124,8 +475,171 @@ class VectorEgs(Dataset):
         else:
             return egs.T, target
 
+    def get_labels(self):
+        labels = np.asarray(self.egs_index.labels)
+        return labels if len(labels.shape) == 1 else labels[:, 0]
+
     def __len__(self):
-        return len(self.data_frame)
+        return len(self.egs_index)
+
+
+
+class ShardEgs(IterableDataset):
+    """Stream the sharded chunk egs (see egs_shards.py) sequentially. The shards are shuffled by (seed, epoch) and
+    assigned to the ranks of Horovod/DDP and then to the DataLoader workers, and the egs are shuffled again by a 
+    buffer of buffer_size egs in every worker.
+    Every rank yields the same number of egs, num_egs // world_size, for synchronized training. So the shards
+    are read circularly if the assigned ones are not enough and some egs are dropped if they are too many.
+    """
+    def __init__(self, shards_dir, io_status=True, aug=None, aug_params={}, shuffle=True, buffer_size=10000, seed=1024,
+                 dequantize_on_gpu=False):
+        """
+        @shards_dir: the dir of shards, such as exp/egs/train.egs.shards.
+
+        Other option
+        @io_status: if false, do not read data from disk and return zero.
+        @buffer_size: the size of shuffle buffer in every worker. 
+        @dequantize_on_gpu: if true, the float16 egs are collated as float16 and converted to float32 by trainer
+                            after transferring to GPU. The int8 egs are always dequantized in workers.
+        """
+        self.io_status = io_status
+        self.dequantize_on_gpu = dequantize_on_gpu
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        # The (epoch, start batches) is in shared memory, so set_epoch() in main process is seen by the persistent
+        # workers. The batch_size is used to resume an epoch and it is set by BaseBunch.
+        self.epoch_state = torch.zeros(2, dtype=torch.int64).share_memory_()
+        self.batch_size = 1
+
+        # Augmentation.
+        self.aug = get_augmentation(aug, aug_params)
+
+        assert shards_dir != "" and shards_dir is not None
+        self.shards = load_shards_list(shards_dir)
+        self.num_egs = sum([ num_egs for _, _, num_egs in self.shards ])
+
+        # Get them here rather than in workers.
+        self.rank, self.world_size = get_rank_and_world_size()
+
+        if len(self.shards) < self.world_size:
+            logger.warning("There are {0} shards for {1} ranks, so some ranks will read the shards of "
+                           "others.".format(len(self.shards), self.world_size))
+
+        labels = np.load(self.shards[0][1], mmap_mode='r')
+        self.num_target_types = 1 if len(labels.shape) == 1 else labels.shape[1]
+
+    def set_io_status(self, io_status):
+        self.io_status = io_status
+
+    def set_epoch(self, epoch, start=0):
+        """It should be called before every epoch (see BaseBunch.set_epoch) to get a different shuffle.
+        @start: skip the first start batches of this rank in the epoch to resume it.
+        """
+        self.epoch_state[0] = epoch
+        self.epoch_state[1] = start
+
+    def get_worker_num_egs(self, worker_id, num_workers):
+        """The DataLoader batches the egs of every worker alone, so the egs of this rank are split into batches
+        first and the workers take the batches in turn (worker_id, worker_id + num_workers, ...). Then only the
+        last batch of the rank could be partial, and len(DataLoader) of len(self) egs equals the number of 
+        batches which are yielded for both drop_last=True and False.
+        """
+        num_batches = (len(self) + self.batch_size - 1) // self.batch_size
+        num_worker_batches = len(range(worker_id, num_batches, num_workers))
+        num_egs = num_worker_batches * self.batch_size
+        if num_batches > 0 and (num_batches - 1) % num_workers == worker_id:
+            # The last batch.
+            num_egs -= num_batches * self.batch_size - len(self)
+        return num_egs
+
+    def __len__(self):
+        # The num of egs of this rank.
+        return self.num_egs // self.world_size
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+
+        epoch, start = int(self.epoch_state[0]), int(self.epoch_state[1])
+        # The DataLoader fetches the batches from workers in turn from the worker 0. When resuming from the start-th 
+        # batch, which was given by the worker (start % num_workers), let the worker 0 play that worker and so on.
+        worker_id = (worker_id + start) % num_workers
+
+        num_egs = self.get_worker_num_egs(worker_id, num_workers)
+
+        if self.shuffle:
+            order = np.random.RandomState(self.seed + epoch).permutation(len(self.shards))
+        else:
+            order = np.arange(len(self.shards))
+
+        # Shard-level assignment: rank first and then worker.
+        shard_ids = order[self.rank::self.world_size][worker_id::num_workers]
+        if len(shard_ids) == 0:
+            shard_ids = np.roll(order, -(self.rank * num_workers + worker_id))
+
+        random_state = np.random.RandomState(self.seed + epoch * 100003 + self.rank * num_workers + worker_id)
+        egs_stream = self.__read_shards(shard_ids, num_egs, random_state)
+
+        if self.shuffle and self.buffer_size > 1:
+            egs_stream = self.__shuffle_buffer(egs_stream, random_state)
+
+        if start > 0:
+            # This worker gave the batches worker_id, worker_id + num_workers, ... of the first start batches.
+            num_skipped_egs = max(0, (start - worker_id + num_workers - 1) // num_workers) * self.batch_size
+            egs_stream = itertools.islice(egs_stream, num_skipped_egs, None)
+
+        for egs, target in egs_stream:
+            if self.aug is not None:
+                yield self.aug(egs), target
+            else:
+                yield egs, target
+
+    def __read_shards(self, shard_ids, num_egs, random_state):
+        count = 0
+        while count < num_egs:
+            for shard_id in shard_ids:
+                shard_path, labels_path, num_shard_egs = self.shards[shard_id]
+                # Read a whole shard sequentially.
+                if self.io_status:
+                    shard = np.load(shard_path)
+                    affine = np.load(get_affine_path(shard_path)) if shard.dtype == np.int8 else None
+                    keep_half = self.dequantize_on_gpu and shard.dtype == np.float16
+                    # The variable-length chunks are concatenated, see egs_shards.py.
+                    offsets = None
+                    if os.path.exists(get_lengths_path(shard_path)):
+                        offsets = np.concatenate([[0], np.cumsum(np.load(get_lengths_path(shard_path)))])
+                labels = np.load(labels_path)
+
+                for i in range(num_shard_egs):
+                    if count >= num_egs:
+                        return
+                    target = int(labels[i]) if self.num_target_types == 1 else labels[i].astype(np.int64)
+                    if self.io_status:
+                        chunk = shard[i] if offsets is None else shard[offsets[i]:offsets[i + 1]]
+                        # A contiguous [feature-dim, frames] sample like ChunkEgs.
+                        if keep_half:
+                            yield np.ascontiguousarray(chunk.T), target
+                        else:
+                            sample = np.empty((chunk.shape[1], chunk.shape[0]), dtype=np.float32)
+                            yield dequantize_egs(chunk.T, None if affine is None else affine[i], out=sample), target
+                    else:
+                        yield 0., 0.
+                    count += 1
+
+    def __shuffle_buffer(self, egs_stream, random_state):
+        buffer = []
+        for item in egs_stream:
+            if len(buffer) < self.buffer_size:
+                buffer.append(item)
+            else:
+                index = random_state.randint(self.buffer_size)
+                yield buffer[index]
+                buffer[index] = item
+
+        random_state.shuffle(buffer)
+        for item in buffer:
+            yield item
 
 
 
@@ -133,44 +647,141 @@ class BaseBunch():
     """BaseBunch:(trainset,[valid]).
     """
     def __init__(self, trainset, valid=None, use_fast_loader=False, max_prefetch=10,
-                 batch_size=512, shuffle=True, num_workers=0, pin_memory=False, drop_last=True):
+                 batch_size=512, shuffle=True, num_workers=0, pin_memory=False, drop_last=True,
+                 use_batch_sampler=False, max_batch_frames=0, bucket_width=50, persistent_workers=False, 
+                 prefetch_factor=2, seed=1024, num_spks_per_batch=0):
+        """
+        @use_batch_sampler: if true, give a batch of indexes to trainset.get_batch() (ChunkEgs only) by a BatchSampler,
+                            so that a batch is read by one kaldi_io.read_mats_batch calling rather than batch_size 
+                            __getitem__ callings.
+        @max_batch_frames: if > 0, batch the variable-length chunks of ChunkEgs by BucketBatchSampler, which groups
+                           chunks by bucket_width frames and caps every batch by max_batch_frames rather than
+                           batch_size (get_batch() is used as use_batch_sampler).
+        @persistent_workers: if true (and num_workers > 0), keep the workers of DataLoader alive across epochs rather
+                             than forking them again for every epoch. prefetch_factor is the number of batches 
+                             loaded in advance by every worker. The random states of persistent workers are not
+                             reseeded for every epoch, so the random augmentation in workers is not the same after
+                             resuming from a checkpoint.
+        @seed: the seed of SeededSampler (and BucketBatchSampler, SpeakerBatchSampler). All of the samplers
+               are decided by (seed, epoch), so an epoch could be resumed from an iter, see state_dict().
+        @num_spks_per_batch: if > 0, make every batch of num_spks_per_batch speakers x (batch_size // 
+                             num_spks_per_batch) chunks by SpeakerBatchSampler, whose speakers are partitioned to the
+                             ranks in every epoch. It is for the margin losses and uses the labels of egs index only.
+        """
 
         num_samples = len(trainset)
         num_gpu = 1
         multi_gpu = False
-        if utils.use_horovod():
-            # Multi-GPU training.
-            import horovod.torch as hvd
-            # Partition dataset among workers using DistributedSampler
-            train_sampler = torch.utils.data.distributed.DistributedSampler(
-                            trainset, num_replicas=hvd.size(), rank=hvd.rank(), shuffle=shuffle)
-            multi_gpu = True
-            num_gpu = hvd.size()
-        elif utils.use_ddp():
-            # The num_replicas/world_size and rank will be set automatically with DDP.
-            train_sampler = torch.utils.data.distributed.DistributedSampler(
-                            trainset, shuffle=shuffle)
-            multi_gpu = True
-            num_gpu = dist.get_world_size()
-        else:
+        if num_spks_per_batch > 0:
+            if max_batch_frames > 0:
+                raise ValueError("Do not support max_batch_frames and num_spks_per_batch at the same time.")
+            if not hasattr(trainset, "get_labels"):
+                raise TypeError("Expected trainset with get_labels() to use speaker batch sampler, "
+                                "but got {}.".format(type(trainset).__name__))
+            if batch_size % num_spks_per_batch != 0:
+                raise ValueError("Expected batch_size {0} is divisible by num_spks_per_batch {1}.".format(batch_size,
+                                 num_spks_per_batch))
+            train_sampler = SpeakerBatchSampler(trainset.get_labels(), num_spks_per_batch, 
+                                                batch_size // num_spks_per_batch, shuffle=shuffle, seed=seed)
+            shuffle = False
+            num_gpu = train_sampler.world_size
+        elif max_batch_frames > 0:
+            if not hasattr(trainset, "get_lengths") or not hasattr(trainset, "get_batch"):
+                raise TypeError("Expected trainset with get_lengths() and get_batch() to use bucket batch sampler, "
+                                "but got {}.".format(type(trainset).__name__))
+            train_sampler = BucketBatchSampler(trainset.get_lengths(), max_batch_frames, bucket_width=bucket_width,
+                                               shuffle=shuffle, drop_last=drop_last, seed=seed)
+            shuffle = False
+            num_gpu = train_sampler.world_size
+        elif isinstance(trainset, IterableDataset):
+            # The IterableDataset, such as ShardEgs, assigns the egs to ranks and shuffles them by itself.
+            if use_batch_sampler:
+                raise TypeError("Do not support batch sampler for {}.".format(type(trainset).__name__))
             train_sampler = None
+            shuffle = False
+            num_gpu = trainset.world_size
+            # To skip the consumed batches of every worker when resuming an epoch.
+            trainset.batch_size = batch_size
+        elif hasattr(trainset, "get_sampler"):
+            # The dataset, such as OnlineChunkEgs, gives a rank-aware sampler.
+            train_sampler = trainset.get_sampler(shuffle)
+            shuffle = False
+            num_gpu = train_sampler.world_size
+        else:
+            # It is rank-aware for Horovod/DDP as DistributedSampler.
+            train_sampler = SeededSampler(num_samples, shuffle=shuffle, seed=seed)
+            shuffle = False
+            num_gpu = train_sampler.world_size
+
+        if utils.use_horovod() or utils.use_ddp():
+            multi_gpu = True
 
         if multi_gpu:
-            # If use DistributedSampler, the shuffle of DataLoader should be set False.
+            # The samplers are rank-aware and shuffle by themselves, so the shuffle of DataLoader should be False.
             shuffle = False
             if not utils.is_main_training():
                 valid = None
 
+        # Keep them to set epoch and to resume an epoch.
+        self.train_sampler = train_sampler
+        self.batch_size = batch_size
+        # The num of samples (or batches for BucketBatchSampler and SpeakerBatchSampler) of sampler in a batch.
+        self.sampler_step = 1 if max_batch_frames > 0 or num_spks_per_batch > 0 or \
+                            isinstance(trainset, IterableDataset) else batch_size
+        self.epoch = 0
+        self.start_iter = 0
+        self.resume_state = None
+
+        # The train loader draws the seeds of its workers from its own generator (reseeded by (seed, epoch) in
+        # set_epoch()) rather than the global torch RNG, so creating an iterator does not shift the RNG of training
+        # (such as dropout) when resuming from a checkpoint. So does the valid loader, whose iterator could be 
+        # created by the thread of AsyncValidator.
+        self.seed = seed
+        self.train_generator = torch.Generator()
+        self.train_generator.manual_seed(seed)
+        self.valid_generator = torch.Generator()
+        self.valid_generator.manual_seed(seed)
+
+        if max_batch_frames > 0 or (num_spks_per_batch > 0 and hasattr(trainset, "get_batch")):
+            # The sampler gives a list of indexes.
+            loader_params = {"batch_size":None, "shuffle":False, "drop_last":False}
+        elif num_spks_per_batch > 0:
+            # The samples of a list of indexes are read by __getitem__ and collated, such as VectorEgs.
+            loader_params = {"batch_sampler":train_sampler}
+        elif use_batch_sampler:
+            if not hasattr(trainset, "get_batch"):
+                raise TypeError("Expected trainset with get_batch() to use batch sampler, but got {}.".format(type(trainset).__name__))
+            # The DataLoader will fetch trainset[list_of_indexes] without auto-collation.
+            loader_params = {"batch_size":None, "shuffle":False, "drop_last":False}
+            loader_params["sampler"] = BatchSampler(train_sampler, batch_size, drop_last)
+        else:
+            loader_params = {"batch_size":batch_size, "shuffle":shuffle, "drop_last":drop_last}
+        if "batch_sampler" not in loader_params:
+            loader_params.setdefault("sampler", train_sampler)
+
+        # Keep the workers and prefetch batches across epochs.
+        worker_params = {}
+        if num_workers > 0:
+            worker_params = {"persistent_workers":persistent_workers, "prefetch_factor":prefetch_factor}
+
         if use_fast_loader:
-            self.train_loader = DataLoaderFast(max_prefetch, trainset, batch_size = batch_size, shuffle=shuffle, 
-                                               num_workers=num_workers, pin_memory=pin_memory, drop_last=drop_last,
-                                               sampler=train_sampler)
+            self.train_loader = DataLoaderFast(max_prefetch, trainset, num_workers=num_workers, pin_memory=pin_memory, 
+                                               collate_fn=egs_collate, generator=self.train_generator, 
+                                               **loader_params, **worker_params)
         else:
-            self.train_loader = DataLoader(trainset, batch_size = batch_size, shuffle=shuffle, num_workers=num_workers, 
-                                           pin_memory=pin_memory, drop_last=drop_last, sampler=train_sampler)
+            self.train_loader = DataLoader(trainset, num_workers=num_workers, pin_memory=pin_memory, 
+                                           collate_fn=egs_collate, generator=self.train_generator, 
+                                           **loader_params, **worker_params)
 
         self.num_batch_train = len(self.train_loader)
 
+        # The augmentation of a batch on device which is applied by trainer, see pop_batch_augmentation().
+        self.batch_aug = None
+        # The segment augmentation (train only) and feature extraction (train and valid) on device for the
+        # waveform egs, see get_bunch_from_datadir().
+        self.wav_aug = None
+        self.batch_features = None
+
         if self.num_batch_train <= 0:
             raise ValueError("Expected num_batch of trainset > 0. There are your egs info: num_gpu={}, num_samples/gpu={}, "
                              "batch-size={}, drop_last={}.\nNote: If batch-size > num_samples/gpu and drop_last is true, then it "
@@ -186,7 +797,8 @@ class BaseBunch():
             # Do not use DataLoaderFast for valid for it increases the memory all the time when compute_valid_accuracy is True.
             # But I have not find the real reason.
             self.valid_loader = DataLoader(valid, batch_size = valid_batch_size, shuffle=False, num_workers=num_workers, 
-                                           pin_memory=pin_memory, drop_last=False)
+                                           pin_memory=pin_memory, drop_last=False, collate_fn=egs_collate, 
+                                           generator=self.valid_generator, **worker_params)
 
             self.num_batch_valid = len(self.valid_loader)
         else:
@@ -196,25 +808,162 @@ class BaseBunch():
 
     @classmethod
     def get_bunch_from_csv(self, trainset_csv:str, valid_csv:str=None, egs_params:dict={}, data_loader_params_dict:dict={}):
+        egs_params, batch_aug = pop_batch_augmentation(egs_params)
+        # The valid set is small and read every epoch, so it could be cached in RAM alone.
+        egs_params = dict(egs_params)
+        valid_cache_size = egs_params.pop("valid_cache_size", 0)
         Egs = ChunkEgs
+        ValidEgs = ChunkEgs
         if "egs_type" in egs_params.keys():
             egs_type = egs_params.pop("egs_type")
             if egs_type == "chunk":
                 pass
             elif egs_type == "vector":
                 Egs = VectorEgs
+                ValidEgs = VectorEgs
+                # The options of reading chunks of matrices are useless for vectors.
+                egs_params = { key:value for key, value in egs_params.items() 
+                               if key not in ["use_mmap", "mmap_max_open", "pipe_cache_dir"] }
+            elif egs_type == "shard":
+                # Stream the shards of trainset_csv, see pipeline/onestep/get_egs_shards.py.
+                Egs = ShardEgs
+                trainset_csv = get_shards_dir(trainset_csv)
+                # The options of random reading are useless for shards.
+                egs_params = { key:value for key, value in egs_params.items() 
+                               if key not in ["use_mmap", "mmap_max_open", "use_index", "pipe_cache_dir", "cache_size"] }
             else:
-                raise TypeError("Do not support {} egs now. Select one from [chunk, vector].".format(egs_type))
+                raise TypeError("Do not support {} egs now. Select one from [chunk, vector, shard].".format(egs_type))
 
         trainset = Egs(trainset_csv, **egs_params)
         # For multi-GPU training.
         if not utils.is_main_training():
             valid = None
         if valid_csv != "" and valid_csv is not None:
-            valid = Egs(valid_csv)
+            valid = ValidEgs(valid_csv, cache_size=valid_cache_size)
         else:
             valid = None
-        return self(trainset, valid, **data_loader_params_dict)
+        bunch = self(trainset, valid, **data_loader_params_dict)
+        bunch.batch_aug = batch_aug
+        return bunch
+
+    @classmethod
+    def get_bunch_from_datadir(self, data_dir:str, egs_params:dict={}, data_loader_params_dict:dict={}, 
+                               valid_num_utts=1024, valid_split_type="--total-spk", valid_chunk_num=2):
+        """Get bunch with OnlineChunkEgs from a kaldi datadir without egs csv. The valid set is split from 
+        data_dir like get_chunk_egs.py and its chunks are fixed.
+        With egs_type=wav in egs_params, get bunch with WavChunkEgs from the clean wav.scp of data_dir, and the
+        wav_aug_params (see augmentation.get_wav_augmentation) and feature_params (see features.get_batch_features)
+        of egs_params are used by trainer on device.
+        """
+        egs_params, batch_aug = pop_batch_augmentation(egs_params)
+        if egs_params.get("egs_type", "chunk") == "wav":
+            return self.get_bunch_from_wav_datadir(data_dir, egs_params, data_loader_params_dict, valid_num_utts, 
+                                                   valid_split_type, valid_chunk_num, batch_aug=batch_aug)
+
+        dataset = KaldiDataset.load_data_dir(data_dir)
+        dataset.generate("utt2spk_int")
+
+        egs_params = dict(egs_params)
+        valid_cache_size = egs_params.pop("valid_cache_size", 0)
+
+        if valid_num_utts > 0:
+            trainset, valid = dataset.split(valid_num_utts, valid_split_type)
+        else:
+            trainset, valid = dataset, None
+
+        # The options of egs csv are useless here.
+        egs_params = { key:value for key, value in egs_params.items() if key not in ["egs_type", "use_index"] }
+        trainset_egs = OnlineChunkEgs(trainset, **egs_params)
+
+        valid_egs = None
+        # For multi-GPU training.
+        if valid is not None and utils.is_main_training():
+            valid_params = { key:value for key, value in egs_params.items() if key in ["chunk_size", "seed"] }
+            valid_egs = OnlineChunkEgs(valid, fixed_chunk_num=valid_chunk_num, cache_size=valid_cache_size,
+                                       **valid_params)
+
+        info = {"feat_dim":dataset.feat_dim, "num_targets":dataset.num_spks}
+        bunch = self(trainset_egs, valid_egs, **data_loader_params_dict)
+        bunch.batch_aug = batch_aug
+        return bunch, info
+
+    @classmethod
+    def get_bunch_from_wav_datadir(self, data_dir:str, egs_params:dict={}, data_loader_params_dict:dict={}, 
+                                   valid_num_utts=1024, valid_split_type="--total-spk", valid_chunk_num=2, 
+                                   batch_aug=None):
+        if os.path.exists("{0}/segments".format(data_dir)):
+            raise TypeError("Do not support the wav egs of datadir {0} with segments.".format(data_dir))
+
+        dataset = KaldiDataset.load_data_dir(data_dir, expected_files=["utt2spk", "spk2utt", "wav.scp"])
+        dataset.generate("utt2spk_int")
+
+        feature_params = egs_params.get("feature_params", {})
+        # The noises are drawn by the seed of egs by default, see BatchWavAugment.
+        wav_aug_params = dict(egs_params.get("wav_aug_params", {}))
+        wav_aug_params.setdefault("seed", egs_params.get("seed", 1024))
+        batch_features = get_batch_features(feature_params)
+        wav_index = wav_io.load_wav_index("{0}/wav.scp".format(data_dir), sample_rate=batch_features.sample_rate)
+
+        if valid_num_utts > 0:
+            trainset, valid = dataset.split(valid_num_utts, valid_split_type)
+        else:
+            trainset, valid = dataset, None
+
+        egs_params = { key:value for key, value in egs_params.items() 
+                       if key in ["chunk_size", "num_chunks_per_spk", "scale", "seed", "io_status", "mmap_max_open"] }
+        trainset_egs = WavChunkEgs(trainset, wav_index, feature_params=feature_params, **egs_params)
+
+        valid_egs = None
+        # For multi-GPU training.
+        if valid is not None and utils.is_main_training():
+            valid_params = { key:value for key, value in egs_params.items() if key in ["chunk_size", "seed"] }
+            valid_egs = WavChunkEgs(valid, wav_index, fixed_chunk_num=valid_chunk_num, feature_params=feature_params,
+                                    **valid_params)
+
+        info = {"feat_dim":batch_features.feat_dim, "num_targets":dataset.num_spks}
+        bunch = self(trainset_egs, valid_egs, **data_loader_params_dict)
+        bunch.batch_aug = batch_aug
+        bunch.wav_aug = get_wav_augmentation(wav_aug_params)
+        bunch.batch_features = batch_features
+        return bunch, info
+
+    def set_epoch(self, epoch, start_iter=0):
+        """Set the epoch for the shuffle of samplers and ShardEgs, and skip the first start_iter batches of the epoch.
+        If a state has been loaded by load_state_dict() for this epoch, the epoch starts from its iter.
+        """
+        if self.resume_state is not None and self.resume_state["epoch"] == epoch:
+            start_iter = self.resume_state["iter"]
+            logger.info("Resume the epoch {0} of data from iter {1}.".format(epoch, start_iter))
+        self.resume_state = None
+
+        self.epoch = epoch
+        self.start_iter = start_iter
+        self.train_generator.manual_seed(self.seed + epoch)
+
+        if hasattr(self.train_loader.dataset, "set_epoch"):
+            self.train_loader.dataset.set_epoch(epoch, start_iter * self.sampler_step)
+        if self.train_sampler is not None:
+            self.train_sampler.set_epoch(epoch, start_iter * self.sampler_step)
+
+    def state_dict(self, this_iter=-1):
+        """Return the state of data after this_iter (0-based) of the current epoch is trained, which is
+        (epoch, iter, seed of sampler) rather than the random states, for all of the orders are decided by (seed, epoch).
+        """
+        epoch, start_iter = self.epoch, this_iter + 1
+        if start_iter >= self.num_batch_train:
+            epoch, start_iter = epoch + 1, 0
+
+        seed = self.train_sampler.seed if self.train_sampler is not None else self.train_loader.dataset.seed
+        return {"epoch":epoch, "iter":start_iter, "seed":seed}
+
+    def load_state_dict(self, state:dict):
+        """Resume from a state of state_dict() when set_epoch() is called with its epoch.
+        """
+        seed = self.train_sampler.seed if self.train_sampler is not None else self.train_loader.dataset.seed
+        if state["seed"] != seed:
+            logger.warning("The seed {0} of data state is different to {1}, so the resumed epoch is not the same "
+                           "as the original one.".format(state["seed"], seed))
+        self.resume_state = {"epoch":int(state["epoch"]), "iter":int(state["iter"])}
 
     def get_train_batch_num(self):
         return self.num_batch_train
@@ -245,7 +994,146 @@ class DataLoaderFast(DataLoader):
     def __iter__(self):
         return BackgroundGenerator(super(DataLoaderFast, self).__iter__(), self.max_prefetch)
 
+
+class DevicePrefetcher():
+    """Wrap a loader to copy the next batch to a CUDA device on a side stream (with non_blocking from pinned memory)
+    while the current batch is computed, so the model receives the tensors which have been on the device rather 
+    than copying them synchronously in utils.for_device_free. It just passes the batches for CPU device.
+
+    The copy time (by CUDA events, ms) of the last batch and the stall time (ms) which the main process waits for
+    the loader are kept in last_copy_time and last_stall_time.
+    """
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.use_cuda = self.device.type == "cuda" and torch.cuda.is_available()
+        self.stream = torch.cuda.Stream(device=self.device) if self.use_cuda else None
+
+        self.last_copy_time = 0.
+        self.last_stall_time = 0.
+        self.last_events = None
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        # Such as dataset and sampler of the loader.
+        if name == "loader":
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def _copy(self, batch):
+        """Copy the tensors of batch to device on the side stream and return (batch on device, copy events).
+        """
+        if not self.use_cuda:
+            return batch, None
+
+        start_event = torch.cuda.Event(enable_timing=True)
+        end_event = torch.cuda.Event(enable_timing=True)
+        with torch.cuda.stream(self.stream):
+            start_event.record(self.stream)
+            copied = []
+            for tensor in batch:
+                if isinstance(tensor, torch.Tensor):
+                    if not tensor.is_pinned():
+                        tensor = tensor.pin_memory()
+                    tensor = tensor.to(self.device, non_blocking=True)
+                copied.append(tensor)
+            end_event.record(self.stream)
+
+        return type(batch)(copied) if isinstance(batch, tuple) else copied, (start_event, end_event)
+
+    def _wait(self, batch, events):
+        if not self.use_cuda:
+            return batch
+
+        # The compute stream waits for the copy without blocking the host and the memory of tensors which are
+        # allocated on the side stream should not be reused before the compute stream finishes with them.
+        current_stream = torch.cuda.current_stream(self.device)
+        current_stream.wait_stream(self.stream)
+        for tensor in batch:
+            if isinstance(tensor, torch.Tensor):
+                tensor.record_stream(current_stream)
+
+        # Read the copy time of the last batch without blocking the host if its copy has been done.
+        if self.last_events is not None and self.last_events[1].query():
+            self.last_copy_time = self.last_events[0].elapsed_time(self.last_events[1])
+        self.last_events = events
+        return batch
+
+    def __iter__(self):
+        loader_iter = iter(self.loader)
+
+        def fetch():
+            start_time = time.time()
+            try:
+                batch = next(loader_iter)
+            except StopIteration:
+                return None
+            finally:
+                self.last_stall_time = (time.time() - start_time) * 1000
+            return self._copy(batch)
+
+        next_batch = fetch()
+        while next_batch is not None:
+            batch, events = next_batch
+            # Wait for the copy of this batch only and then start the copy of next batch, which runs on the side
+            # stream while this batch is computed.
+            batch = self._wait(batch, events)
+            stall_time = self.last_stall_time
+            next_batch = fetch()
+            self.last_stall_time = stall_time
+            yield batch
+
 ## Function
+def pop_batch_augmentation(egs_params:dict):
+    """Pop the aug of egs_params if it is a batch augmentation (such as batch_specaugment), which is applied by
+    trainer after transferring a batch to device rather than by egs in DataLoader workers.
+    Return (egs_params without it, batch augmentation or None).
+    """
+    if egs_params.get("aug", None) in batch_augmentations:
+        egs_params = dict(egs_params)
+        batch_aug = get_augmentation(egs_params.pop("aug"), egs_params.pop("aug_params", {}))
+        return egs_params, batch_aug
+    return egs_params, None
+
+def new_batch_tensor(shape, dtype=torch.float32):
+    """Allocate a tensor which is in shared memory if it is in a DataLoader worker, like default_collate does.
+    """
+    if torch.utils.data.get_worker_info() is None:
+        return torch.empty(shape, dtype=dtype)
+
+    numel = int(np.prod(shape))
+    elem = torch.empty(0, dtype=dtype)
+    if hasattr(elem, "_typed_storage"):
+        storage = elem._typed_storage()._new_shared(numel)
+    else:
+        storage = elem.storage()._new_shared(numel)
+    return elem.new(storage).view(shape)
+
+def egs_collate(batch):
+    """Collate [(egs, target)] by copying every egs once into a batch tensor (see new_batch_tensor()),
+    without converting or copying the contiguous egs from ChunkEgs/VectorEgs before stacking.
+    It is used for both the auto-collation of DataLoader and the batches from get_batch() which have been collated.
+    """
+    if isinstance(batch, tuple) or not isinstance(batch[0][0], np.ndarray):
+        # Collated batch from get_batch() or the zero egs when io_status is false.
+        return default_collate(batch) if isinstance(batch, list) else batch
+
+    egs = [ torch.from_numpy(x[0]) for x in batch ]
+    num_frames = min([ x.shape[-1] for x in egs ])
+    if any([ x.shape[-1] > num_frames for x in egs ]):
+        # Crop the variable-length chunks (such as the ones of ShardEgs) to the same length as ChunkEgs.get_batch().
+        offsets = [ np.random.randint(0, x.shape[-1] - num_frames + 1) for x in egs ]
+        egs = [ x[..., offset:offset + num_frames] for x, offset in zip(egs, offsets) ]
+    out = new_batch_tensor((len(egs),) + tuple(egs[0].shape), egs[0].dtype)
+    torch.stack(egs, 0, out=out)
+
+    # The targets are python int or int64 array of multi-label, see EgsIndex.get_target().
+    targets = torch.from_numpy(np.array([ x[1] for x in batch ], dtype=np.int64))
+
+    return out, targets
+
 def get_info_from_egsdir(egsdir):
     if os.path.exists(egsdir+"/info"):
         feat_dim = int(utils.read_file_to_list(egsdir+"/info/feat_dim")[0])
@@ -0,0 +1,196 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import os
+import logging
+import numpy as np
+import pandas as pd
+
+# Logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class EgsIndex():
+    """A columnar index of egs. It is saved as a directory of .npy files and loaded with mmap_mode='r', so every
+    DataLoader worker shares the same read-only pages rather than holding an object array of python strings
+    which will be duplicated by copy-on-write after forking.
+
+    Files in index_dir:
+        arks.npy    : [num_arks] str, the interned ark paths (or the whole rxfile if it has no offset, such as a pipe).
+        ark_ids.npy : [N] int32, the index of ark path in arks.
+        offsets.npy : [N] int64, the byte offset in ark, -1 means no offset.
+        starts.npy  : [N] int32, the chunk-start (0-based), -1 for vector egs.
+        ends.npy    : [N] int32, the chunk-end (included), -1 for vector egs.
+        labels.npy  : [N] int32 or [N, num_target_types] int32 for multi-label.
+    """
+    columns = ["ark_ids", "offsets", "starts", "ends", "labels"]
+
+    def __init__(self, arks, ark_ids, offsets, starts, ends, labels):
+        self.arks = arks
+        self.ark_ids = ark_ids
+        self.offsets = offsets
+        self.starts = starts
+        self.ends = ends
+        self.labels = labels
+
+        self.num_target_types = 1 if len(self.labels.shape) == 1 else self.labels.shape[1]
+
+    @classmethod
+    def from_table(self, table, chunk=True):
+        """
+        @table: a list of rows or an array, [utt-id, feats_path:offset, [chunk-start, chunk-end,] [label]xn]
+        @chunk: the table is chunk egs with chunk-start and chunk-end columns or vector egs without them.
+        """
+        data_frame = table if isinstance(table, pd.DataFrame) else pd.DataFrame(table)
+        num_info_columns = 4 if chunk else 2
+
+        if data_frame.shape[1] <= num_info_columns:
+            raise ValueError("Expected at least one label column in egs, but got {} columns.".format(data_frame.shape[1]))
+
+        arks, ark_ids, offsets = split_rxfiles(data_frame.iloc[:, 1])
+
+        if chunk:
+            starts = data_frame.iloc[:, 2].values.astype(np.int32)
+            ends = data_frame.iloc[:, 3].values.astype(np.int32)
+        else:
+            starts = np.full(len(data_frame), -1, dtype=np.int32)
+            ends = np.full(len(data_frame), -1, dtype=np.int32)
+
+        labels = data_frame.iloc[:, num_info_columns:].values.astype(np.int32)
+        if labels.shape[1] == 1:
+            labels = labels[:, 0]
+
+        return self(arks, ark_ids, offsets, starts, ends, np.ascontiguousarray(labels))
+
+    @classmethod
+    def from_csv(self, egs_csv:str, chunk=True):
+        return self.from_table(pd.read_csv(egs_csv, sep=" "), chunk=chunk)
+
+    @classmethod
+    def load(self, index_dir:str, mmap=True):
+        if not os.path.exists(index_dir):
+            raise ValueError("The egs index {0} is not exist.".format(index_dir))
+
+        mmap_mode = 'r' if mmap else None
+        arks = np.load("{0}/arks.npy".format(index_dir))
+        columns = [ np.load("{0}/{1}.npy".format(index_dir, name), mmap_mode=mmap_mode) for name in self.columns ]
+
+        return self(arks, *columns)
+
+    def save(self, index_dir:str):
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        np.save("{0}/arks.npy".format(index_dir), self.arks)
+        for name in self.columns:
+            np.save("{0}/{1}.npy".format(index_dir, name), getattr(self, name))
+
+    def get_ark(self, index):
+        """Return (ark_path, offset) without parsing any rxspecifier.
+        """
+        return str(self.arks[self.ark_ids[index]]), int(self.offsets[index])
+
+    def get_chunk(self, index):
+        return [int(self.starts[index]), int(self.ends[index])]
+
+    def get_target(self, index):
+        # Return python int or int64 array to make targets of batch be LongTensor after collating.
+        if self.num_target_types == 1:
+            return int(self.labels[index])
+        else:
+            return self.labels[index].astype(np.int64)
+
+    def __len__(self):
+        return len(self.ark_ids)
+
+
+class OnlineEgsIndex():
+    """An utterance-level index for chunks sampled online (see OnlineChunkEgs and samplers.OnlineChunkSampler).
+    It only holds the ark paths, offsets, num_frames and labels of utts, and a chunk is indexed by 
+    (utt_index, start) which is drawn by the sampler, or by an int if the chunks are fixed by set_chunks().
+    """
+    def __init__(self, arks, ark_ids, offsets, num_frames, labels, chunk_size:int):
+        self.arks = arks
+        self.ark_ids = ark_ids
+        self.offsets = offsets
+        self.num_frames = num_frames
+        self.labels = labels
+        self.chunk_size = chunk_size
+
+        self.chunks = None
+        self.num_target_types = 1
+
+    @classmethod
+    def from_dataset(self, dataset, chunk_size:int):
+        """
+        @dataset: a KaldiDataset with feats_scp, utt2num_frames and utt2spk_int.
+        """
+        utts = list(dataset.feats_scp.keys())
+        arks, ark_ids, offsets = split_rxfiles([ dataset.feats_scp[utt] for utt in utts ])
+        num_frames = np.array([ dataset.utt2num_frames[utt] for utt in utts ], dtype=np.int64).reshape(-1)
+        labels = np.array([ dataset.utt2spk_int[utt] for utt in utts ], dtype=np.int64).reshape(-1)
+
+        return self(arks, ark_ids, offsets, num_frames, labels, chunk_size)
+
+    def set_chunks(self, chunks):
+        """Fix the chunks by a [N, 2] array of (utt_index, start), such as the ones of valid set.
+        """
+        self.chunks = np.asarray(chunks, dtype=np.int64).reshape(-1, 2)
+
+    def get_utt_start(self, index):
+        if self.chunks is not None and not isinstance(index, tuple):
+            return self.chunks[index]
+        return index
+
+    def get_ark(self, index):
+        utt_index, _ = self.get_utt_start(index)
+        return str(self.arks[self.ark_ids[utt_index]]), int(self.offsets[utt_index])
+
+    def get_chunk(self, index):
+        _, start = self.get_utt_start(index)
+        return [int(start), int(start) + self.chunk_size - 1]
+
+    def get_target(self, index):
+        utt_index, _ = self.get_utt_start(index)
+        return int(self.labels[utt_index])
+
+    def __len__(self):
+        return len(self.chunks) if self.chunks is not None else len(self.num_frames)
+
+
+## Function
+def split_rxfiles(rxfiles):
+    """Split 'path:offset' rxfiles and intern the paths.
+    Return (arks, ark_ids, offsets) and the offset is -1 if a rxfile has no offset (such as a pipe).
+    """
+    path_offset = pd.Series(rxfiles).astype(str).str.extract(r'^(.*?)(?::([0-9]+))?$')
+    arks, ark_ids = np.unique(np.array(path_offset[0].tolist(), dtype=str), return_inverse=True)
+    offsets = np.array(path_offset[1].fillna(-1).tolist(), dtype=np.int64)
+    return arks, ark_ids.reshape(-1).astype(np.int32), offsets
+
+
+def get_index_dir(egs_csv:str):
+    """e.g. exp/egs/train.egs.csv -> exp/egs/train.egs.index
+    """
+    return os.path.splitext(egs_csv)[0] + ".index"
+
+
+def load_egs_index(egs_csv:str, chunk=True, use_index=True):
+    """Load the pre-parsed index of egs_csv if it exists and is not older than egs_csv,
+    else parse egs_csv in memory.
+    """
+    index_dir = get_index_dir(egs_csv)
+
+    if use_index and os.path.exists(index_dir):
+        index_files = [ "{0}/{1}.npy".format(index_dir, name) for name in ["arks"] + EgsIndex.columns ]
+        # A partially written index, e.g. an interrupted save(), misses some files.
+        if not all([ os.path.exists(index_file) for index_file in index_files ]):
+            logger.warning("The egs index {0} is incomplete, so ignore it.".format(index_dir))
+        elif min([ os.path.getmtime(index_file) for index_file in index_files ]) >= os.path.getmtime(egs_csv):
+            return EgsIndex.load(index_dir)
+        else:
+            logger.warning("The egs index {0} is older than {1}, so ignore it.".format(index_dir, egs_csv))
+
+    return EgsIndex.from_csv(egs_csv, chunk=chunk)
@@ -0,0 +1,180 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import os
+import logging
+import numpy as np
+
+import libs.support.kaldi_io as kaldi_io
+
+from .egs_index import load_egs_index
+
+# Logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+"""Sharded egs which are materialized from the chunk egs csv, so that training reads a few large files
+sequentially rather than random chunks of feats.scp arks over network storage.
+
+Files in shards_dir:
+    shard-00000.npy         : [n, chunk, feat_dim] float32 (or float16, int8), the chunks in shuffled order.
+    shard-00000.labels.npy  : [n] int32 or [n, num_target_types] int32 for multi-label.
+    shard-00000.affine.npy  : [n, 2] float32, the (min, scale) of every int8 chunk, x = (q + 128) * scale + min.
+    shard-00000.lengths.npy : [n] int32, the frames of every chunk if the chunks have different lengths (the egs of
+                              max_chunk > min_chunk), where the shard is [total-frames, feat_dim] of concatenated chunks.
+    ...
+    shards.list             : every line is 'shard-path labels-path num-egs' and it is written at last.
+"""
+
+## Function
+def get_shards_dir(egs_csv:str):
+    """e.g. exp/egs/train.egs.csv -> exp/egs/train.egs.shards
+    """
+    return os.path.splitext(egs_csv)[0] + ".shards"
+
+
+def write_egs_shards(egs_csv:str, shards_dir:str=None, shard_size=256, seed=1024, use_index=True, dtype="float32"):
+    """Read all chunks of egs_csv in a global random order and save them to shards of about shard_size MB.
+    Every shard is read by one kaldi_io.read_mats_batch calling (per length) which groups the random reads by ark file.
+    @dtype: float32, float16 or int8 (with an affine header per chunk) to store the chunks. 
+    """
+    if dtype not in ["float32", "float16", "int8"]:
+        raise TypeError("Do not support {0} dtype for shards. Select one from [float32, float16, int8].".format(dtype))
+    if shards_dir is None:
+        shards_dir = get_shards_dir(egs_csv)
+
+    if not os.path.exists(shards_dir):
+        os.makedirs(shards_dir)
+
+    egs_index = load_egs_index(egs_csv, chunk=True, use_index=use_index)
+    num_egs = len(egs_index)
+
+    if num_egs <= 0:
+        raise ValueError("Expected num_egs > 0, but got {0} egs in {1}.".format(num_egs, egs_csv))
+
+    order = np.random.RandomState(seed).permutation(num_egs)
+    lengths = np.asarray(egs_index.ends, dtype=np.int64) - np.asarray(egs_index.starts, dtype=np.int64) + 1
+    variable_length = len(np.unique(lengths)) > 1
+
+    # The size of every egs (of mean length) is known by reading the first one.
+    first = kaldi_io.read_mats_batch([egs_index.get_ark(order[0]) + tuple(egs_index.get_chunk(order[0]))])
+    egs_size = first[0].shape[1] * lengths.mean() * np.dtype(dtype).itemsize
+    egs_per_shard = max(1, int(shard_size * 1024 * 1024 // egs_size))
+    num_shards = (num_egs + egs_per_shard - 1) // egs_per_shard
+
+    logger.info("Write {0} egs of {1} to {2} {3} shards ({4} egs per shard) in {5}.".format(num_egs, egs_csv,
+                 num_shards, dtype, egs_per_shard, shards_dir))
+
+    lines = []
+    for shard_id in range(num_shards):
+        indexes = order[shard_id * egs_per_shard:(shard_id + 1) * egs_per_shard]
+        requests = [ egs_index.get_ark(index) + tuple(egs_index.get_chunk(index)) for index in indexes ]
+        shard_path = "{0}/shard-{1:05d}.npy".format(shards_dir, shard_id)
+        labels_path = "{0}/shard-{1:05d}.labels.npy".format(shards_dir, shard_id)
+
+        if variable_length:
+            egs, affine = read_variable_length_egs(requests, lengths[indexes], dtype)
+            np.save(get_lengths_path(shard_path), lengths[indexes].astype(np.int32))
+        else:
+            egs, affine = quantize_egs(kaldi_io.read_mats_batch(requests), dtype)
+        labels = np.ascontiguousarray(egs_index.labels[indexes])
+
+        np.save(shard_path, egs)
+        np.save(labels_path, labels)
+        if affine is not None:
+            np.save(get_affine_path(shard_path), affine)
+        lines.append("{0} {1} {2}".format(shard_path, labels_path, len(indexes)))
+
+    # The list is written at last and it means the shards are complete.
+    with open("{0}/shards.list".format(shards_dir), 'w') as writer:
+        writer.write("\n".join(lines) + "\n")
+
+    return shards_dir
+
+
+def get_affine_path(shard_path:str):
+    return os.path.splitext(shard_path)[0] + ".affine.npy"
+
+
+def get_lengths_path(shard_path:str):
+    return os.path.splitext(shard_path)[0] + ".lengths.npy"
+
+
+def read_variable_length_egs(requests, lengths, dtype="float32"):
+    """Read the chunks with different lengths by one kaldi_io.read_mats_batch calling per length, and return
+    ([total-frames, feat_dim] egs which are concatenated in the order of requests, [n, 2] affine or None).
+    """
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    egs = None
+    affine = None
+    for length in np.unique(lengths):
+        members = np.flatnonzero(lengths == length)
+        group, group_affine = quantize_egs(kaldi_io.read_mats_batch([ requests[i] for i in members ]), dtype)
+        if egs is None:
+            egs = np.empty((offsets[-1], group.shape[2]), dtype=group.dtype)
+            if group_affine is not None:
+                affine = np.empty((len(lengths), 2), dtype=np.float32)
+        for i, chunk in zip(members, group):
+            egs[offsets[i]:offsets[i + 1]] = chunk
+        if affine is not None:
+            affine[members] = group_affine
+
+    return egs, affine
+
+
+def quantize_egs(egs, dtype="float32"):
+    """Return (quantized egs, affine or None) of [n, chunk, feat_dim] float32 egs.
+    The int8 quantization is affine per chunk, so the error of every value is not more than scale/2
+    where scale = (max - min) / 255 of its chunk.
+    """
+    if dtype == "float32":
+        return egs, None
+    elif dtype == "float16":
+        return egs.astype(np.float16), None
+    elif dtype == "int8":
+        mins = egs.min(axis=(1, 2))
+        scales = (egs.max(axis=(1, 2)) - mins) / 255.
+        scales[scales == 0.] = 1.
+
+        quantized = np.rint((egs - mins[:, None, None]) / scales[:, None, None]) - 128.
+        affine = np.stack([mins, scales], axis=1).astype(np.float32)
+        return np.clip(quantized, -128, 127).astype(np.int8), affine
+    else:
+        raise TypeError("Do not support {0} dtype for shards.".format(dtype))
+
+
+def dequantize_egs(egs, affine=None, out=None):
+    """Dequantize a chunk (or chunks with [n, 2] affine) to float32. 
+    The out could be given to write the transposed chunk to a contiguous [feat_dim, chunk] array.
+    """
+    if out is None:
+        out = np.empty(egs.shape, dtype=np.float32)
+
+    out[...] = egs
+    if affine is not None:
+        affine = np.asarray(affine, dtype=np.float32)
+        extra_dims = (None,) * (out.ndim - affine.ndim + 1)
+        out += 128.
+        out *= affine[(..., 1) + extra_dims]
+        out += affine[(..., 0) + extra_dims]
+
+    return out
+
+
+def load_shards_list(shards_dir:str):
+    """Return [(shard_path, labels_path, num_egs)].
+    """
+    list_path = "{0}/shards.list".format(shards_dir)
+    if not os.path.exists(list_path):
+        raise ValueError("The shards list {0} is not exist. The shards of egs may be incomplete.".format(list_path))
+
+    shards = []
+    with open(list_path, 'r') as reader:
+        for line in reader:
+            items = line.split()
+            if len(items) == 3:
+                shards.append((items[0], items[1], int(items[2])))
+
+    return shards
@@ -0,0 +1,186 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import math
+import logging
+import torch
+
+import libs.support.utils as utils
+
+# Logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class BatchFeatures():
+    """Compute kaldi-like fbank or mfcc features of a [batch, samples] waveform tensor on its device (such as GPU),
+    which follows compute-fbank-feats/compute-mfcc-feats with snip-edges=true and povey window, and then apply the
+    sliding cmn like apply-cmvn-sliding --norm-vars=false --center=true. It returns a [batch, feat-dim, frames] tensor
+    as ChunkEgs does. The default options are the ones of subtools/conf/sre-fbank-80.conf but without energy.
+
+    The sliding cmn is computed by a centered window which is cut (not shifted) at the edges of chunk, so it is
+    a bit different to kaldi at the first and last cmn_window/2 frames.
+    """
+    def __init__(self, feature_type="fbank", sample_rate=16000, frame_length=25, frame_shift=10, num_mel_bins=80,
+                 num_ceps=23, low_freq=40, high_freq=-200, preemphasis=0.97, dither=1.0, remove_dc_offset=True,
+                 cepstral_lifter=22., cmn_window=300):
+        """
+        @frame_length, frame_shift: ms.
+        @high_freq: if <= 0, it is the offset from nyquist.
+        @cmn_window: the frames of the window for sliding cmn, 0 means no cmn and -1 means the mean of chunk.
+        """
+        if feature_type not in ["fbank", "mfcc"]:
+            raise TypeError("Do not support {0} features. Select one from [fbank, mfcc].".format(feature_type))
+
+        self.feature_type = feature_type
+        self.sample_rate = sample_rate
+        self.window_size = int(sample_rate * frame_length / 1000)
+        self.window_shift = int(sample_rate * frame_shift / 1000)
+        self.padded_window_size = 2 ** math.ceil(math.log2(self.window_size))
+        self.preemphasis = preemphasis
+        self.dither = dither
+        self.remove_dc_offset = remove_dc_offset
+        self.cmn_window = cmn_window
+
+        self.num_mel_bins = num_mel_bins
+        self.num_ceps = num_ceps
+        self.feat_dim = num_mel_bins if feature_type == "fbank" else num_ceps
+
+        nyquist = 0.5 * sample_rate
+        high_freq = high_freq + nyquist if high_freq <= 0 else high_freq
+        if not 0 <= low_freq < high_freq <= nyquist:
+            raise ValueError("Expected 0 <= low_freq < high_freq <= nyquist, but got {0}, {1} and {2}.".format(low_freq,
+                             high_freq, nyquist))
+
+        # The constants are moved to the device of inputs lazily.
+        self.constants = {}
+        self.window = torch.pow(torch.hann_window(self.window_size, periodic=False, dtype=torch.float64), 0.85).float()
+        self.mel_banks = get_mel_banks(num_mel_bins, self.padded_window_size, sample_rate, low_freq, high_freq)
+        if feature_type == "mfcc":
+            dct = get_dct_matrix(num_mel_bins, num_ceps)
+            lifter = 1. + 0.5 * cepstral_lifter * torch.sin(math.pi * torch.arange(num_ceps, dtype=torch.float64) /
+                                                             cepstral_lifter) if cepstral_lifter > 0 else 1.
+            self.dct = (dct * lifter).float()
+
+    def get_constant(self, name, device):
+        key = (name, str(device))
+        if key not in self.constants:
+            self.constants[key] = getattr(self, name).to(device)
+        return self.constants[key]
+
+    def get_num_frames(self, num_samples:int):
+        return 1 + (num_samples - self.window_size) // self.window_shift if num_samples >= self.window_size else 0
+
+    def get_num_samples(self, num_frames:int):
+        """The min number of samples to get num_frames frames.
+        """
+        return (num_frames - 1) * self.window_shift + self.window_size
+
+    def __call__(self, inputs, generator=None):
+        """
+        @inputs: a [batch, samples] tensor in the scale of 16-bit samples.
+        @generator: a torch.Generator on the device of inputs for dither. Default is the global RNG.
+        """
+        if not isinstance(inputs, torch.Tensor):
+            raise TypeError("Expected torch.Tensor, but got {}".format(type(inputs).__name__))
+        assert len(inputs.shape) == 2
+
+        device = inputs.device
+        inputs = inputs.float()
+        num_frames = self.get_num_frames(inputs.shape[1])
+        if num_frames <= 0:
+            raise ValueError("Expected at least {0} samples, but got {1}.".format(self.window_size, inputs.shape[1]))
+
+        # [batch, frames, window_size]
+        frames = inputs[:, :self.get_num_samples(num_frames)].unfold(1, self.window_size, self.window_shift)
+
+        if self.dither > 0.:
+            frames = frames + torch.randn(frames.shape, generator=generator, device=device) * self.dither
+        if self.remove_dc_offset:
+            frames = frames - frames.mean(dim=2, keepdim=True)
+        if self.preemphasis > 0.:
+            previous = torch.cat([frames[:, :, :1], frames[:, :, :-1]], dim=2)
+            frames = frames - self.preemphasis * previous
+
+        frames = frames * self.get_constant("window", device)
+        spectrum = torch.fft.rfft(frames, n=self.padded_window_size, dim=2)
+        power = spectrum.real.pow(2) + spectrum.imag.pow(2)
+
+        # [batch, frames, num_mel_bins]
+        epsilon = torch.finfo(torch.float32).eps
+        features = torch.matmul(power, self.get_constant("mel_banks", device)).clamp(min=epsilon).log()
+
+        if self.feature_type == "mfcc":
+            features = torch.matmul(features, self.get_constant("dct", device))
+
+        features = features.transpose(1, 2)
+
+        if self.cmn_window < 0:
+            features = features - features.mean(dim=2, keepdim=True)
+        elif self.cmn_window > 0:
+            half_window = self.cmn_window // 2
+            features = features - torch.nn.functional.avg_pool1d(features, 2 * half_window + 1, stride=1,
+                                  padding=half_window, count_include_pad=False)
+
+        return features.contiguous()
+
+
+## Function
+def get_mel_banks(num_bins, padded_window_size, sample_rate, low_freq, high_freq):
+    """Return [padded_window_size // 2 + 1, num_bins] triangular mel filters like kaldi's MelBanks, where the last
+    frequency (nyquist) is not used.
+    """
+    mel = lambda freq: 1127. * torch.log(1. + freq / 700.)
+
+    num_fft_bins = padded_window_size // 2
+    fft_bin_width = sample_rate / padded_window_size
+
+    mel_low = mel(torch.tensor(low_freq, dtype=torch.float64))
+    mel_high = mel(torch.tensor(high_freq, dtype=torch.float64))
+    mel_delta = (mel_high - mel_low) / (num_bins + 1)
+
+    bins = torch.arange(num_bins, dtype=torch.float64).unsqueeze(1)
+    left = mel_low + bins * mel_delta
+    center = left + mel_delta
+    right = center + mel_delta
+
+    mels = mel(fft_bin_width * torch.arange(num_fft_bins, dtype=torch.float64)).unsqueeze(0)
+    up = (mels - left) / (center - left)
+    down = (right - mels) / (right - center)
+    banks = torch.clamp(torch.min(up, down), min=0.)
+
+    banks = torch.cat([banks, torch.zeros(num_bins, 1, dtype=torch.float64)], dim=1)
+    return banks.t().float().contiguous()
+
+
+def get_dct_matrix(num_mel_bins, num_ceps):
+    """Return [num_mel_bins, num_ceps] normalized DCT-II matrix like kaldi's ComputeDctMatrix.
+    """
+    n = torch.arange(num_mel_bins, dtype=torch.float64).unsqueeze(1)
+    k = torch.arange(num_ceps, dtype=torch.float64).unsqueeze(0)
+    dct = math.sqrt(2. / num_mel_bins) * torch.cos(math.pi / num_mel_bins * (n + 0.5) * k)
+    dct[:, 0] = math.sqrt(1. / num_mel_bins)
+    return dct
+
+
+def get_batch_features(feature_params:dict={}):
+    default_feature_params = {
+        "feature_type":"fbank",
+        "sample_rate":16000,
+        "frame_length":25.,
+        "frame_shift":10.,
+        "num_mel_bins":80,
+        "num_ceps":23,
+        "low_freq":40.,
+        "high_freq":-200.,
+        "preemphasis":0.97,
+        "dither":1.0,
+        "remove_dc_offset":True,
+        "cepstral_lifter":22.,
+        "cmn_window":300
+    }
+
+    feature_params = utils.assign_params_dict(default_feature_params, feature_params)
+
+    return BatchFeatures(**feature_params)
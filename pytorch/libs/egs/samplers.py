@@ -0,0 +1,322 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import logging
+import numpy as np
+
+from torch.utils.data import Sampler
+import torch.distributed as dist
+
+import libs.support.utils as utils
+
+# Logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def get_rank_and_world_size():
+    if utils.use_horovod():
+        import horovod.torch as hvd
+        return hvd.rank(), hvd.size()
+    elif utils.use_ddp():
+        return dist.get_rank(), dist.get_world_size()
+    else:
+        return 0, 1
+
+
+class SeededSampler(Sampler):
+    """A rank-aware sampler of dataset indexes which replaces RandomSampler, SequentialSampler and DistributedSampler.
+    The order of an epoch is only decided by (seed + epoch) and the rank gets [rank::world_size] of it (padded to be
+    evenly divisible like DistributedSampler), so an epoch could be resumed from any position by set_epoch(epoch, start)
+    without saving the state of a random generator.
+    """
+    def __init__(self, num_samples:int, shuffle=True, seed=1024):
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+        self.rank, self.world_size = get_rank_and_world_size()
+
+        self.total_size = num_samples
+        self.num_samples = (num_samples + self.world_size - 1) // self.world_size
+
+    def set_epoch(self, epoch, start=0):
+        """
+        @start: skip the first start indexes of this rank in the epoch to resume it.
+        """
+        self.epoch = epoch
+        self.start = start
+
+    def state_dict(self):
+        return {"epoch":self.epoch, "start":self.start, "seed":self.seed}
+
+    def __iter__(self):
+        if self.shuffle:
+            order = np.random.RandomState(self.seed + self.epoch).permutation(self.total_size)
+        else:
+            order = np.arange(self.total_size)
+
+        padding = self.num_samples * self.world_size - self.total_size
+        if padding > 0:
+            order = np.concatenate([order, order[:padding]])
+
+        return iter(order[self.rank::self.world_size][self.start:].tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+class OnlineChunkSampler(Sampler):
+    """Draw fresh speaker-balanced chunks for every epoch rather than replaying the chunks fixed in egs csv.
+    Every speaker gets num_chunks_per_spk chunks in an epoch and every chunk is a uniform random window
+    of the speaker (an utt is selected w.r.t its number of windows, num_frames - chunk_size + 1).
+    The chunks of an epoch are drawn by the same (seed + epoch) in all ranks and then split by rank,
+    so it is reproducible and the ranks get different chunks without any communication.
+
+    It yields (utt_index, start) for OnlineChunkEgs.
+    """
+    def __init__(self, num_frames, labels, chunk_size:int, num_chunks_per_spk=-1, scale=1.5, shuffle=True, seed=1024):
+        """
+        @num_frames, labels: [num_utts] int arrays of utts, see egs_index.OnlineEgsIndex.
+        @num_chunks_per_spk: -1->suggestion (num_chunks / num_spks * scale), 0->max, int->int, like
+                             --chunk-num of get_chunk_egs.py but the chunks are not overlapped.
+        """
+        num_frames = np.asarray(num_frames, dtype=np.int64)
+        labels = np.asarray(labels, dtype=np.int64)
+
+        self.chunk_size = chunk_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+        self.rank, self.world_size = get_rank_and_world_size()
+
+        valid_utts = np.flatnonzero(num_frames >= chunk_size)
+        if len(valid_utts) < len(num_frames):
+            logger.warning("There are {0} utts whose num frames is less than chunk size {1}, so skip "
+                           "them.".format(len(num_frames) - len(valid_utts), chunk_size))
+        if len(valid_utts) == 0:
+            raise ValueError("Expected at least one utt with num frames >= chunk size {0}.".format(chunk_size))
+
+        # Sort utts by speaker, so the windows of a speaker are a range of cumsum.
+        self.utts = valid_utts[np.argsort(labels[valid_utts], kind='stable')]
+        num_windows = num_frames[self.utts] - chunk_size + 1
+        self.cum_windows = np.cumsum(num_windows)
+
+        spks, spk_begin, spk_num_utts = np.unique(labels[self.utts], return_index=True, return_counts=True)
+        spk_end = spk_begin + spk_num_utts
+        self.spk_window_begin = self.cum_windows[spk_end - 1] - np.add.reduceat(num_windows, spk_begin)
+        self.spk_num_windows = self.cum_windows[spk_end - 1] - self.spk_window_begin
+
+        num_spk_chunks = np.add.reduceat(num_frames[self.utts] // chunk_size, spk_begin)
+        if num_chunks_per_spk == 0:
+            self.num_chunks_per_spk = int(num_spk_chunks.max())
+        elif num_chunks_per_spk == -1:
+            self.num_chunks_per_spk = max(1, int(num_spk_chunks.sum() // len(spks) * scale))
+        else:
+            self.num_chunks_per_spk = num_chunks_per_spk
+
+        self.num_spks = len(spks)
+        self.num_samples = self.num_chunks_per_spk * self.num_spks // self.world_size
+
+    def set_epoch(self, epoch, start=0):
+        """
+        @start: skip the first start chunks of this rank in the epoch to resume it.
+        """
+        self.epoch = epoch
+        self.start = start
+
+    def state_dict(self):
+        return {"epoch":self.epoch, "start":self.start, "seed":self.seed}
+
+    def get_chunks(self, epoch):
+        """Return [num_samples * world_size, 2] (utt_index, start) of all ranks for an epoch.
+        """
+        random_state = np.random.RandomState(self.seed + epoch)
+
+        spk_ids = np.repeat(np.arange(self.num_spks), self.num_chunks_per_spk)
+        windows = random_state.randint(0, self.spk_num_windows[spk_ids]) + self.spk_window_begin[spk_ids]
+
+        # The window is the start of chunk in the utt which has it.
+        positions = np.searchsorted(self.cum_windows, windows, side='right')
+        starts = windows - np.where(positions > 0, self.cum_windows[positions - 1], 0)
+        chunks = np.stack([self.utts[positions], starts], axis=1)
+
+        if self.shuffle:
+            chunks = chunks[random_state.permutation(len(chunks))]
+
+        return chunks[:self.num_samples * self.world_size]
+
+    def __iter__(self):
+        chunks = self.get_chunks(self.epoch)[self.rank::self.world_size][self.start:]
+        return iter([ (int(utt_index), int(start)) for utt_index, start in chunks ])
+
+    def __len__(self):
+        return self.num_samples
+
+
+class BucketBatchSampler(Sampler):
+    """Group the chunks with similar length to buckets (by bucket_width frames) and make batches in every bucket,
+    whose size is capped by max_frames rather than a fixed batch size, i.e. batch_size = max_frames // the max
+    length of bucket. The batches are shuffled by (seed + epoch) and split by rank like OnlineChunkSampler.
+
+    It yields a list of indexes for trainset.get_batch() which crops the chunks of a batch to the same length,
+    so there is no padding in a batch.
+    """
+    def __init__(self, lengths, max_frames:int, bucket_width=50, shuffle=True, drop_last=True, seed=1024):
+        """
+        @lengths: [N] int array, the number of frames of every chunk.
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+        self.rank, self.world_size = get_rank_and_world_size()
+
+        bucket_ids = (lengths - lengths.min()) // bucket_width
+        self.buckets = []
+        self.batch_sizes = []
+        for bucket_id in np.unique(bucket_ids):
+            members = np.flatnonzero(bucket_ids == bucket_id)
+            batch_size = max_frames // int(lengths[members].max())
+            if batch_size < 1:
+                raise ValueError("Expected max_frames >= the length of chunks {0}, but got {1}.".format(
+                                 int(lengths[members].max()), max_frames))
+            self.buckets.append(members)
+            self.batch_sizes.append(batch_size)
+
+        if drop_last:
+            num_batches = sum([ len(members) // batch_size for members, batch_size in zip(self.buckets, self.batch_sizes) ])
+        else:
+            num_batches = sum([ (len(members) + batch_size - 1) // batch_size 
+                                for members, batch_size in zip(self.buckets, self.batch_sizes) ])
+
+        self.num_batches = num_batches // self.world_size
+
+    def set_epoch(self, epoch, start=0):
+        """
+        @start: skip the first start batches of this rank in the epoch to resume it.
+        """
+        self.epoch = epoch
+        self.start = start
+
+    def state_dict(self):
+        return {"epoch":self.epoch, "start":self.start, "seed":self.seed}
+
+    def get_batches(self, epoch):
+        random_state = np.random.RandomState(self.seed + epoch)
+
+        batches = []
+        for members, batch_size in zip(self.buckets, self.batch_sizes):
+            if self.shuffle:
+                members = members[random_state.permutation(len(members))]
+            num_batches = len(members) // batch_size if self.drop_last else (len(members) + batch_size - 1) // batch_size
+            batches.extend([ members[i * batch_size:(i + 1) * batch_size] for i in range(num_batches) ])
+
+        if self.shuffle:
+            batches = [ batches[i] for i in random_state.permutation(len(batches)) ]
+
+        return batches[:self.num_batches * self.world_size]
+
+    def __iter__(self):
+        batches = self.get_batches(self.epoch)[self.rank::self.world_size][self.start:]
+        return iter([ batch.tolist() for batch in batches ])
+
+    def __len__(self):
+        return self.num_batches
+
+
+class SpeakerBatchSampler(Sampler):
+    """Make batches of num_spks_per_batch (P) speakers x num_chunks_per_spk (K) chunks for the margin losses, which
+    need several chunks of a speaker and many speakers in a batch. The speakers are shuffled and partitioned to the
+    ranks by (seed + epoch) in every epoch, so a rank covers its own speakers and the speakers are covered by the
+    ranks in an epoch (but num_spks % world_size random ones which are dropped to balance the ranks).
+
+    In a rank, the batches are made by rounds. A round is a permutation of the speakers of this rank and every P of
+    it is a batch, so the speakers of a batch are different. A speaker gives its next K chunks (of a shuffled cycle
+    of its chunks) when it appears in a round, so the speakers are balanced like the speaker_balance chunks.
+
+    It yields a list of indexes like BucketBatchSampler, and only the labels of chunks are used.
+    """
+    def __init__(self, labels, num_spks_per_batch:int, num_chunks_per_spk:int, shuffle=True, seed=1024):
+        """
+        @labels: [N] int array, the speaker label of every chunk, see get_labels() of ChunkEgs.
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+
+        self.num_spks_per_batch = num_spks_per_batch
+        self.num_chunks_per_spk = num_chunks_per_spk
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+        self.rank, self.world_size = get_rank_and_world_size()
+
+        if num_spks_per_batch < 1 or num_chunks_per_spk < 1:
+            raise ValueError("Expected num_spks_per_batch >= 1 and num_chunks_per_spk >= 1, but got {0} and "
+                             "{1}.".format(num_spks_per_batch, num_chunks_per_spk))
+
+        self.labels = labels
+        self.spks, self.spk_num_chunks = np.unique(labels, return_counts=True)
+        self.spk_begin = np.cumsum(self.spk_num_chunks) - self.spk_num_chunks
+
+        # The rank with the least speakers decides the num of batches in a round.
+        self.num_spks_per_rank = len(self.spks) // self.world_size
+        if self.num_spks_per_rank < num_spks_per_batch:
+            raise ValueError("Expected at least num_spks_per_batch={0} speakers in every rank, but got {1} speakers "
+                             "for {2} ranks.".format(num_spks_per_batch, len(self.spks), self.world_size))
+
+        # An epoch sees about every chunk once.
+        self.num_batches = max(1, len(labels) // (num_spks_per_batch * num_chunks_per_spk * self.world_size))
+
+    def set_epoch(self, epoch, start=0):
+        """
+        @start: skip the first start batches of this rank in the epoch to resume it.
+        """
+        self.epoch = epoch
+        self.start = start
+
+    def state_dict(self):
+        return {"epoch":self.epoch, "start":self.start, "seed":self.seed}
+
+    def get_batches(self, epoch, rank):
+        """Return [num_batches, P * K] indexes of a rank for an epoch. All ranks draw the same speaker partition
+        and chunk cycles by (seed + epoch).
+        """
+        random_state = np.random.RandomState(self.seed + epoch)
+        num_spks = len(self.spks)
+
+        # Sort chunks by speaker and shuffle them in every speaker (the label is the primary key of lexsort).
+        keys = random_state.random_sample(len(self.labels)) if self.shuffle else np.arange(len(self.labels))
+        chunks = np.lexsort((keys, self.labels))
+
+        spk_order = random_state.permutation(num_spks) if self.shuffle else np.arange(num_spks)
+        rank_spks = spk_order[rank::self.world_size][:self.num_spks_per_rank]
+
+        batches_per_round = self.num_spks_per_rank // self.num_spks_per_batch
+        num_rounds = (self.num_batches + batches_per_round - 1) // batches_per_round
+        rank_random_state = np.random.RandomState([self.seed + epoch, rank])
+        if self.shuffle:
+            rounds = [ rank_spks[rank_random_state.permutation(len(rank_spks))] for _ in range(num_rounds) ]
+        else:
+            rounds = [ rank_spks for _ in range(num_rounds) ]
+        size = batches_per_round * self.num_spks_per_batch
+        spk_ids = np.concatenate([ spks[:size] for spks in rounds ])[:self.num_batches * self.num_spks_per_batch]
+        round_ids = np.arange(len(spk_ids)) // size
+
+        # The k-th chunk of a speaker in round r is the (r * K + k)-th one of its cycle.
+        cycle = round_ids[:, None] * self.num_chunks_per_spk + np.arange(self.num_chunks_per_spk)[None, :]
+        positions = cycle % self.spk_num_chunks[spk_ids][:, None] + self.spk_begin[spk_ids][:, None]
+
+        return chunks[positions].reshape(self.num_batches, -1)
+
+    def __iter__(self):
+        batches = self.get_batches(self.epoch, self.rank)[self.start:]
+        return iter([ batch.tolist() for batch in batches ])
+
+    def __len__(self):
+        return self.num_batches
@@ -9,6 +9,7 @@ import pandas as pd
 
 # import libs.support.kaldi_common as kaldi_common # Used to interact with shell
 from .kaldi_dataset import KaldiDataset
+from .egs_index import EgsIndex, get_index_dir, split_rxfiles
 
 # Logger
 logger = logging.getLogger(__name__)
@@ -16,12 +17,14 @@ logger.addHandler(logging.NullHandler())
 
 
 class ChunkSamples():
-    def __init__(self, dataset:KaldiDataset, chunk_size:int, chunk_type='speaker_balance', chunk_num_selection=0, 
-                 scale=1.5, overlap=0.1, drop_last=False, seed=1024):
+    def __init__(self, dataset:KaldiDataset, chunk_size:int, chunk_type='speaker_balance', chunk_num_selection=0,
+                 scale=1.5, overlap=0.1, drop_last=False, seed=1024, max_chunk_size=-1):
         '''
         Parameters:
             self.dataset: the object which contain the dicts such as utt2spk, utt2spk_int and so on.
             self.chunk_size: the number of frames in a chunk.
+            self.max_chunk_size: if > chunk_size, every chunk is extended to a random length in [chunk_size, 
+                                 max_chunk_size] (within its utt) for variable-length training with bucketing.
             self.chunk_type: which decides how to chunk the feats for training.
             chunk_num_selection: -1->suggestion scale, 0->max, >0->specify.
             self.overlap: the proportion of overlapping for every chunk.
@@ -33,61 +36,84 @@ class ChunkSamples():
         self.scale = scale
         self.overlap = overlap
         self.drop_last = drop_last
+        self.max_chunk_size = max_chunk_size
 
         assert 0<= self.overlap < 1
 
         np.random.seed(seed)
 
-        # chunk_samples: table [[]]
+        # chunk_samples: columns {utt_index, chunk_index, start} w.r.t self.utts, see __sample.
         self.head = ['utt-id', 'ark-path', 'start-position', 'end-position', 'class-label']
         self.chunk_samples = self.__sample()
 
+    def __get_utts(self, utts):
+        """Load the arrays of utts which will be indexed by the chunks.
+        """
+        self.utts = np.array(utts, dtype=object)
+        self.num_frames = np.array([ self.dataset.utt2num_frames[utt] for utt in utts ], dtype=np.int64).reshape(-1)
+        self.labels = np.array([ self.dataset.utt2spk_int[utt] for utt in utts ], dtype=np.int64).reshape(-1)
+
+        short = np.flatnonzero(self.num_frames < self.chunk_size)
+        if len(short) > 0:
+            logger.warn('There are {0} utts whose num frames is less than chunk size {1}, so skip them, such as '
+                        '{2}.'.format(len(short), self.chunk_size, list(self.utts[short[:5]])))
+
+        return self.num_frames >= self.chunk_size
+
+    def __sequential_chunks(self, valid):
+        """Compute the chunks of all utts at once rather than in a while loop for every utt.
+        Return (num_sequential_chunks, has_tail_chunk) of every utt. The i-th sequential chunk of an utt starts at
+        i * (chunk_size - overlap_size) and the tail chunk ends at the last frame.
+        """
+        overlap_size = int(self.overlap * self.chunk_size)
+        step = self.chunk_size - overlap_size
+
+        num_chunks = np.where(valid, (self.num_frames - self.chunk_size) // step + 1, 0)
+        has_tail = valid & (not self.drop_last) & (num_chunks * step + overlap_size < self.num_frames)
+
+        return num_chunks, has_tail
+
+    def __expand(self, utt_indexes, counts):
+        """Repeat every utt index counts times, and return (utt_indexes, the 0-based position in the repeats).
+        """
+        repeated = np.repeat(utt_indexes, counts)
+        position = np.arange(len(repeated)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return repeated, position
+
+    def __sum_by_spk(self, values, spk_begin, spk_num_utts):
+        cumsum = np.concatenate([[0], np.cumsum(values)])
+        return cumsum[spk_begin + spk_num_utts] - cumsum[spk_begin]
+
     def __sample(self):
         # JFZhou: speaker_balance and sequential.
-        chunk_samples = []
+        # They are vectorized and the random calling sequence is kept, so the samples are the same as
+        # the ones generated by loops with the same seed.
+        overlap_size = int(self.overlap * self.chunk_size)
+        step = self.chunk_size - overlap_size
 
         if self.chunk_type == 'speaker_balance':
-            spk2chunks = {}
-            total_chunks = 0
-            max_chunk_num = 0
-            chunk_counter = {}
-            for key in self.dataset.spk2utt.keys():
-                utt_selected = self.dataset.spk2utt[key]
-                spk_chunk_num = 0
-                for utt in utt_selected:
-                    ark_path = self.dataset.feats_scp[utt]
-                    num_frames = self.dataset.utt2num_frames[utt]
-
-                    if num_frames < self.chunk_size:
-                        logger.warn('The num frames {0} of {1} is less than chunk size {2}, so skip it.'.format(utt, num_frames, self.chunk_size))
-                    else:
-                        chunk_counter[utt] = 0
-                        offset = 0
-                        overlap_size = int(self.overlap * self.chunk_size)
-                        while offset + self.chunk_size <= num_frames:
-                            chunk = "{0} {1} {2} {3} {4}".format(utt+'-'+str(chunk_counter[utt]),ark_path,offset,offset+self.chunk_size-1,self.dataset.utt2spk_int[utt])
-                            offset += self.chunk_size - overlap_size
-
-                            if key in spk2chunks.keys():
-                                spk2chunks[key].append(chunk)
-                            else:
-                                spk2chunks[key] = [chunk]
-
-                            chunk_counter[utt] += 1
-                            total_chunks += 1
-                            spk_chunk_num += 1
-
-                        if not self.drop_last and offset + overlap_size < num_frames:
-                            chunk = "{0} {1} {2} {3} {4}".format(utt+'-'+str(chunk_counter[utt]),ark_path,num_frames-self.chunk_size,num_frames-1,self.dataset.utt2spk_int[utt])
-                            total_chunks += 1
-                            spk_chunk_num += 1
-                            chunk_counter[utt] += 1
-
-                if spk_chunk_num > max_chunk_num:
-                    max_chunk_num = spk_chunk_num
-
-            for key in spk2chunks.keys():
-                chunk_selected = spk2chunks[key]
+            spks = list(self.dataset.spk2utt.keys())
+            spk_num_utts = np.array([ len(self.dataset.spk2utt[spk]) for spk in spks ], dtype=np.int64)
+            valid = self.__get_utts([ utt for spk in spks for utt in self.dataset.spk2utt[spk] ])
+            num_chunks, has_tail = self.__sequential_chunks(valid)
+
+            # The tail chunks are counted (for the selection and chunk-id) but not selected here.
+            chunk_counter = num_chunks + has_tail
+            spk_begin = np.cumsum(spk_num_utts) - spk_num_utts
+            spk_chunk_num = self.__sum_by_spk(chunk_counter, spk_begin, spk_num_utts)
+            spk_seq_num = self.__sum_by_spk(num_chunks, spk_begin, spk_num_utts)
+
+            total_chunks = int(chunk_counter.sum())
+            max_chunk_num = int(spk_chunk_num.max()) if len(spks) > 0 else 0
+
+            seq_utts, seq_positions = self.__expand(np.arange(len(self.utts)), num_chunks)
+            seq_begin = np.cumsum(spk_seq_num) - spk_seq_num
+
+            utt_indexes = []
+            chunk_indexes = []
+            starts = []
+
+            for spk_id in np.flatnonzero(spk_seq_num > 0):
                 if self.chunk_num_selection==0:
                     num_chunks_selected = max_chunk_num
                 elif self.chunk_num_selection==-1:
@@ -95,65 +121,103 @@ class ChunkSamples():
                 else:
                     num_chunks_selected = self.chunk_num_selection
 
-                num_chunks = len(chunk_selected)
-                if num_chunks < num_chunks_selected:
-                    valid_utts = [ utt for utt in self.dataset.spk2utt[key] if self.dataset.utt2num_frames[utt] >= self.chunk_size ]
-                    utts = np.random.choice(valid_utts,num_chunks_selected-num_chunks,replace=True)
-                    for utt in utts:
-                        start = np.random.randint(0, self.dataset.utt2num_frames[utt]-self.chunk_size+1)
-                        end = start + self.chunk_size - 1
-                        chunk_selected.append("{0} {1} {2} {3} {4}".format(utt+'-'+str(chunk_counter[utt]),self.dataset.feats_scp[utt],start,end,self.dataset.utt2spk_int[utt]))
-                        chunk_counter[utt] += 1
+                spk_seq = slice(seq_begin[spk_id], seq_begin[spk_id] + spk_seq_num[spk_id])
+                num_chunks_spk = int(spk_seq_num[spk_id])
+
+                if num_chunks_spk < num_chunks_selected:
+                    utt_indexes.append(seq_utts[spk_seq])
+                    chunk_indexes.append(seq_positions[spk_seq])
+                    starts.append(seq_positions[spk_seq] * step)
+
+                    spk_utts = np.arange(spk_begin[spk_id], spk_begin[spk_id] + spk_num_utts[spk_id])
+                    valid_utts = spk_utts[valid[spk_utts]]
+                    utts = valid_utts[np.random.choice(len(valid_utts), num_chunks_selected-num_chunks_spk, replace=True)]
+                    # The same as calling randint for every utt in order.
+                    extra_starts = np.random.randint(0, self.num_frames[utts]-self.chunk_size+1)
+
+                    # The chunk-id continues from chunk_counter of utt and the repeated utts get successive ids.
+                    order = np.argsort(utts, kind='stable')
+                    sorted_utts = utts[order]
+                    first = np.searchsorted(sorted_utts, sorted_utts, side='left')
+                    rank = np.empty(len(utts), dtype=np.int64)
+                    rank[order] = np.arange(len(utts)) - first
+
+                    utt_indexes.append(utts)
+                    chunk_indexes.append(chunk_counter[utts] + rank)
+                    starts.append(extra_starts)
                 else:
-                    chunk_selected = np.random.choice(spk2chunks[key],num_chunks_selected,replace=False)
-
-                for chunk in chunk_selected:
-                    chunk_samples.append(chunk.split())
+                    selected = np.random.permutation(num_chunks_spk)[:num_chunks_selected]
+                    utt_indexes.append(seq_utts[spk_seq][selected])
+                    chunk_indexes.append(seq_positions[spk_seq][selected])
+                    starts.append(seq_positions[spk_seq][selected] * step)
 
         elif self.chunk_type == 'sequential':
-            for utt in self.dataset.feats_scp.keys():
-
-                ark_path = self.dataset.feats_scp[utt]
-                num_frames = self.dataset.utt2num_frames[utt]
+            valid = self.__get_utts(list(self.dataset.feats_scp.keys()))
+            num_chunks, has_tail = self.__sequential_chunks(valid)
 
-                if num_frames < self.chunk_size:
-                    logger.warn('The num frames {0} of {1} is less than chunk size {2}, so skip it.'.format(utt, num_frames, self.chunk_size))
-                else:
-                    chunk_counter = 0
-                    offset = 0
-                    overlap_size = int(self.overlap * self.chunk_size)
-                    while offset + self.chunk_size <= num_frames:
-                        chunk_samples.append([utt+'-'+str(chunk_counter),ark_path,offset,offset+self.chunk_size-1,self.dataset.utt2spk_int[utt]])
-                        chunk_counter += 1
-                        offset += self.chunk_size - overlap_size
+            utt_indexes, chunk_indexes = self.__expand(np.arange(len(self.utts)), num_chunks + has_tail)
+            is_tail = chunk_indexes >= num_chunks[utt_indexes]
+            starts = np.where(is_tail, self.num_frames[utt_indexes] - self.chunk_size, chunk_indexes * step)
 
-                    if not self.drop_last and offset + overlap_size < num_frames:
-                        chunk_samples.append([utt+'-'+str(chunk_counter),ark_path,num_frames-self.chunk_size,num_frames-1,self.dataset.utt2spk_int[utt]])
+            utt_indexes, chunk_indexes, starts = [utt_indexes], [chunk_indexes], [starts]
 
         # every_utt for valid
         elif self.chunk_type == "every_utt":
-            chunk_selected = []
-            for utt in self.dataset.utt2spk.keys():
-                ark_path = self.dataset.feats_scp[utt]
-                num_frames = self.dataset.utt2num_frames[utt]
+            valid = self.__get_utts(list(self.dataset.utt2spk.keys()))
+            num_chunks = np.where(valid, max(0, self.chunk_num_selection), 0)
 
-                if num_frames < self.chunk_size:
-                    logger.warn('The num frames {0} of {1} is less than chunk size {2}, so skip it.'.format(utt, num_frames, self.chunk_size))
-                else:
-                    for chunk_counter in range(0, self.chunk_num_selection):
-                        start = np.random.randint(0, self.dataset.utt2num_frames[utt]-self.chunk_size+1)
-                        end = start + self.chunk_size - 1
-                        chunk_selected.append("{0} {1} {2} {3} {4}".format(utt+'-'+str(chunk_counter),self.dataset.feats_scp[utt],start,end,self.dataset.utt2spk_int[utt]))
+            utt_indexes, chunk_indexes = self.__expand(np.arange(len(self.utts)), num_chunks)
+            # The same as calling randint for every chunk in order.
+            starts = np.random.randint(0, self.num_frames[utt_indexes]-self.chunk_size+1) if len(utt_indexes) > 0 \
+                     else np.zeros(0, dtype=np.int64)
 
-            for chunk in chunk_selected:
-                    chunk_samples.append(chunk.split())
+            utt_indexes, chunk_indexes, starts = [utt_indexes], [chunk_indexes], [starts]
 
         else:
             raise TypeError("Do not support chunk type {0}.".format(self.chunk_type))
 
+        concat = lambda arrays: np.concatenate(arrays).astype(np.int64) if len(arrays) > 0 else np.zeros(0, dtype=np.int64)
+        chunk_samples = {"utt_index":concat(utt_indexes), "chunk_index":concat(chunk_indexes), "start":concat(starts)}
+
+        # Variable-length chunks.
+        chunk_samples["num_frames"] = np.full(len(chunk_samples["start"]), self.chunk_size, dtype=np.int64)
+        if self.max_chunk_size > self.chunk_size and len(chunk_samples["start"]) > 0:
+            max_num_frames = self.num_frames[chunk_samples["utt_index"]] - chunk_samples["start"]
+            num_frames = np.random.randint(self.chunk_size, self.max_chunk_size + 1, size=len(max_num_frames))
+            chunk_samples["num_frames"] = np.minimum(num_frames, max_num_frames)
+
         return chunk_samples
 
-    def save(self, save_path:str, force=True):
+    def __len__(self):
+        return len(self.chunk_samples["utt_index"])
+
+    def get_data_frame(self):
+        utt_indexes = self.chunk_samples["utt_index"]
+        starts = self.chunk_samples["start"]
+
+        utt_ids = pd.Series(self.utts[utt_indexes], dtype=object) + '-' + \
+                  pd.Series(self.chunk_samples["chunk_index"]).astype(str)
+        ark_paths = np.array([ self.dataset.feats_scp[utt] for utt in self.utts ], dtype=object)[utt_indexes]
+
+        return pd.DataFrame({self.head[0]:utt_ids, self.head[1]:ark_paths, self.head[2]:starts,
+                             self.head[3]:starts + self.chunk_samples["num_frames"] - 1, 
+                             self.head[4]:self.labels[utt_indexes]})
+
+    def get_egs_index(self):
+        # Parse the rxfiles of utts rather than the ones of chunks.
+        arks, ark_ids, offsets = split_rxfiles([ self.dataset.feats_scp[utt] for utt in self.utts ])
+        utt_indexes = self.chunk_samples["utt_index"]
+        starts = self.chunk_samples["start"]
+
+        return EgsIndex(arks, ark_ids[utt_indexes], offsets[utt_indexes], starts.astype(np.int32),
+                        (starts + self.chunk_samples["num_frames"] - 1).astype(np.int32), 
+                        self.labels[utt_indexes].astype(np.int32))
+
+    def save(self, save_path:str, force=True, index=True):
+        """
+        @index: if true, save a pre-parsed columnar index (see egs_index.py) next to save_path as well,
+                e.g. train.egs.csv -> train.egs.index.
+        """
         if os.path.exists(save_path) and not force:
             raise ValueError("The path {0} is exist. Please rm it by yourself.".format(save_path))
 
@@ -161,5 +225,7 @@ class ChunkSamples():
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
 
-        data_frame = pd.DataFrame(self.chunk_samples, columns=self.head)
-        data_frame.to_csv(save_path, sep=" ", header=True, index=False)
+        self.get_data_frame().to_csv(save_path, sep=" ", header=True, index=False)
+
+        if index:
+            self.get_egs_index().save(get_index_dir(save_path))
@@ -380,9 +380,11 @@ class StatisticsPooling(torch.nn.Module):
         # Used for unbiased estimate of stddev
         self.unbiased = unbiased
 
+    @utils.for_float32
     def forward(self, inputs):
         """
         @inputs: a 3-dimensional tensor (a batch), including [samples-index, frames-dim-index, frames-index]
+        The mean and variance are computed in float32 with AMP, for the variance of float16 could overflow.
         """
         assert len(inputs.shape) == 3
         assert inputs.shape[1] == self.input_dim
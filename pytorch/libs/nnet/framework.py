@@ -169,7 +169,20 @@ class TopVirtualNnet(torch.nn.Module):
             num_correct = (targets==prediction).sum()
 
         return num_correct.item()/len(targets)
-    
+
+    @utils.for_device_free
+    def compute_accuracy_tensor(self, outputs, targets):
+        """The same as compute_accuracy() but without syncing to host, see sync_free of SimpleTrainer.
+        @return: a 0-dimensional tensor of accuracy on the device of outputs
+        """
+        assert outputs.shape[0] == len(targets)
+
+        with torch.no_grad():
+            prediction = self.predict(outputs)
+            accuracy = (targets==prediction).float().mean()
+
+        return accuracy
+
     def step(self, epoch, this_iter, epoch_batchs):
         pass
 
@@ -8,6 +8,7 @@ import torch
 import torch.nn.functional as F
 
 from libs.support.utils import to_device
+import libs.support.utils as utils
 from .components import *
 
 ## TopVirtualLoss ✿
@@ -188,9 +189,11 @@ class MarginSoftmaxLoss(TopVirtualLoss):
              # torch.nn.init.xavier_normal_(self.weight, gain=1.0)
             torch.nn.init.normal_(self.weight, 0., 0.01) # It seems better.
 
+    @utils.for_float32
     def forward(self, inputs, targets):
         """
         @inputs: a 3-dimensional tensor (a batch), including [samples-index, frames-dim-index, frames-index]
+        The cosine, margin and scale are computed in float32 with AMP.
         """
         assert len(inputs.shape) == 3
         assert inputs.shape[2] == 1
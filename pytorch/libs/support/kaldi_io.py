@@ -10,6 +10,8 @@ from __future__ import division
 
 import numpy as np
 import sys, os, re, gzip, struct
+import collections
+import logging
 
 #################################################
 # Adding kaldi tools to shell path,
@@ -25,6 +27,10 @@ os.environ['PATH'] = path.readline().strip() + ':' + os.environ['PATH']
 path.close()
 
 
+# Logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
 #################################################
 # Define all custom exceptions,
 class UnsupportedDataType(Exception): pass
@@ -147,9 +153,28 @@ def popen(cmd, mode="rb"):
 def read_key(fd):
     """ [key] = read_key(fd)
      Read the utterance-key from the opened ark/stream descriptor 'fd'.
+     If 'fd' is buffered (file, pipe, stdin), find the space in the peeked buffer rather than reading byte by byte.
     """
     assert('b' in fd.mode), "Error: 'fd' was opened in text mode (in python3 use sys.stdin.buffer)"
 
+    if not hasattr(fd, "peek"):
+        return _read_key_bytewise(fd)
+
+    key = b''
+    while 1:
+        buf = fd.peek(1) # The whole buffered bytes (at least 1 if not eof) without moving the position.
+        if len(buf) == 0 : break
+        position = buf.find(b' ')
+        if position >= 0:
+            key += fd.read(position + 1)[:-1]
+            break
+        key += fd.read(len(buf))
+    key = key.decode("latin1").strip()
+    if key == '': return None # end of file,
+    assert(_key_pattern.match(key) != None) # check format (no whitespace!)
+    return key
+
+def _read_key_bytewise(fd):
     key = ''
     while 1:
         char = fd.read(1).decode("latin1")
@@ -158,9 +183,67 @@ def read_key(fd):
         key += char
     key = key.strip()
     if key == '': return None # end of file,
-    assert(re.match('^\S+$',key) != None) # check format (no whitespace!)
+    assert(_key_pattern.match(key) != None) # check format (no whitespace!)
     return key
 
+_key_pattern = re.compile(r'^\S+$')
+
+def index_ark(file_or_fd):
+    """ generator(key,offset) = index_ark(file_or_fd)
+     Scan an ark file once and yield (key, offset) where offset is the byte offset of the object (after the key),
+     i.e. 'ark_path:offset' is the rxfile in scp. The binary objects are skipped by their headers without being
+     decoded. It supports float/double/compressed matrices, float/double vectors, int vectors and ascii matrices.
+     file_or_fd : ark or opened file descriptor (seekable).
+    """
+    fd = open_or_fd(file_or_fd)
+    try:
+        key = read_key(fd)
+        while key:
+            offset = fd.tell()
+            _skip_object(fd)
+            yield key, offset
+            key = read_key(fd)
+    finally:
+        if fd is not file_or_fd : fd.close()
+
+def write_ark_scp(ark_file, scp_file):
+    """ write_ark_scp(ark_file, scp_file)
+     Write the scp ('key ark_file:offset' per line) of an existing ark file by scanning it once,
+     which is like 'copy-feats ark:foo.ark ark,scp:foo.ark,foo.scp' but without rewriting the ark.
+    """
+    with open(scp_file, 'w') as writer:
+        for key, offset in index_ark(ark_file):
+            writer.write("{0} {1}:{2}\n".format(key, ark_file, offset))
+
+def _skip_object(fd):
+    binary = fd.read(2)
+    if binary != b'\0B':
+        # Ascii matrix or vector,
+        assert(binary == b' [')
+        _read_mat_ascii(fd)
+        return
+    header = fd.read(3)
+    if header == b'FM ' or header == b'DM ':
+        sample_size = 4 if header == b'FM ' else 8
+        s1, rows, s2, cols = struct.unpack('<bibi', fd.read(10))
+        fd.seek(rows * cols * sample_size, 1)
+    elif header == b'FV ' or header == b'DV ':
+        sample_size = 4 if header == b'FV ' else 8
+        s1, dim = struct.unpack('<bi', fd.read(5))
+        fd.seek(dim * sample_size, 1)
+    elif header.startswith(b'CM'):
+        if header != b'CM ': fd.read(1) # The token of 'CM2' and 'CM3' is followed by a space.
+        globmin, globrange, rows, cols = struct.unpack('<ffii', fd.read(16))
+        if header == b'CM ': fd.seek(cols * 8 + rows * cols, 1)
+        elif header == b'CM2': fd.seek(rows * cols * 2, 1)
+        else: fd.seek(rows * cols, 1)
+    elif header[:1] == b'\4':
+        # Int vector: '\4' + int32 size and then (int8 size, int32 value) for every element,
+        dim, = struct.unpack('<i', header[1:] + fd.read(2))
+        fd.seek(dim * 5, 1)
+    else:
+        raise UnknownMatrixHeader("The header contained '%s'" % header)
+
 
 #################################################
 # Integer vectors (alignments, ...),
@@ -324,6 +407,17 @@ def read_vec_flt(file_or_fd):
     if fd is not file_or_fd : fd.close() # cleanup
     return ans
 
+def read_vec_flt_at(ark_path, offset):
+    """ [flt-vec] = read_vec_flt_at(ark_path, offset)
+     Read kaldi float vector at the byte offset of ark file without parsing the rxspecifier,
+     offset < 0 means that ark_path is a whole rxfile, such as a pipe.
+    """
+    if offset < 0:
+        return read_vec_flt(ark_path)
+    with open(ark_path, 'rb') as fd:
+        fd.seek(offset)
+        return read_vec_flt(fd)
+
 def _read_vec_flt_binary(fd):
     header = fd.read(3).decode()
     if header == 'FV ' : sample_size = 4 # floats
@@ -343,6 +437,150 @@ def _read_vec_flt_binary(fd):
     return ans
 
 
+def load_vectors(rspecifier, num_threads=8, cache=False):
+    """ (keys, mat) = load_vectors(rspecifier, num_threads=8, cache=False)
+     Load all float vectors of 'ark:foo.ark' or 'scp:foo.scp' to a key list and a contiguous [N, D] matrix
+     rather than iterating read_vec_flt_auto and appending vectors to a list.
+     For a binary ark, the records are located in one vectorized pass over the mapped file and the
+     matrix is gathered from the map directly. For a scp, the ark files are read in a thread pool with merged preads.
+     Other inputs (pipes, gzipped or ascii) are read by read_vec_flt_auto.
+
+     cache : if true, save foo.scp.npy (matrix) and foo.scp.keys.npy next to the scp (or ark) and load them
+             next time if they are newer than it.
+
+     Example:
+     keys, mat = kaldi_io.load_vectors("scp:exp/xvector/train/xvector.scp")
+    """
+    prefix, path = _split_rspecifier(rspecifier)
+    cache_path = "{0}.npy".format(path)
+    keys_cache_path = "{0}.keys.npy".format(path)
+
+    if cache and os.path.exists(cache_path) and os.path.exists(keys_cache_path) and \
+       os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        return np.load(keys_cache_path).tolist(), np.load(cache_path)
+
+    keys, mat = None, None
+    if path[-1] != '|' and path != '-' and path.split('.')[-1] != 'gz':
+        if prefix == "ark":
+            keys, mat = _load_ark_vectors(path)
+        else:
+            keys, mat = _load_scp_vectors(path, num_threads)
+
+    if keys is None:
+        # Fallback,
+        keys, vecs = [], []
+        for key, vec in read_vec_flt_auto("{0}:{1}".format(prefix, path)):
+            keys.append(key)
+            vecs.append(vec)
+        mat = np.stack(vecs) if len(vecs) > 0 else np.zeros((0, 0), dtype='float32')
+
+    if cache and path[-1] != '|' and path != '-':
+        np.save(keys_cache_path, np.array(keys, dtype=str))
+        np.save(cache_path, mat)
+
+    return keys, mat
+
+def _split_rspecifier(rspecifier):
+    if not re.search('^(ark|scp)(,scp|,b|,t|,n?f|,n?p|,b?o|,n?s|,n?cs)*:', rspecifier):
+        raise TypeError("Specifier of {} is not scp or ark.".format(rspecifier))
+    (prefix, path) = rspecifier.split(':', 1)
+    return prefix.split(',')[0], path
+
+def _load_ark_vectors(ark_path):
+    # Return (None, None) if the ark is not a binary ark of float vectors with the same dim.
+    buf = np.memmap(ark_path, dtype='uint8', mode='r')
+    if len(buf) == 0: return [], np.zeros((0, 0), dtype='float32')
+
+    first = buf[:min(len(buf), 1024)].tobytes()
+    position = first.find(b' \0B')
+    if position < 0 or first[position+3:position+6] not in (b'FV ', b'DV ') or first[position+6:position+7] != b'\4':
+        return None, None
+    header = first[position+1:position+7]
+    dtype = np.dtype('float32') if header[2:5] == b'FV ' else np.dtype('float64')
+    dim = struct.unpack('<i', first[position+7:position+11])[0]
+    record_size = 10 + dim * dtype.itemsize
+
+    # Find the candidates of header '\0B[FD]V \4' by one vectorized pass (block by block to bound memory).
+    candidates = []
+    block_size = 1 << 26
+    for begin in range(0, len(buf), block_size):
+        block = buf[begin:min(len(buf), begin + block_size + 5)]
+        index = np.flatnonzero(block[:-5] == 0)
+        for i, byte in enumerate(header[1:]):
+            index = index[block[index + i + 1] == byte]
+        candidates.append(index[index < block_size] + begin)
+    candidates = np.concatenate(candidates)
+
+    # A candidate in data of the previous record means that the records are not located by the pattern directly,
+    # it is very rare, so fallback then. All records should have the same type and dim.
+    if len(candidates) == 0 or np.any(np.diff(candidates) < record_size + 2) or \
+       candidates[-1] + record_size != len(buf) or \
+       np.any(buf[candidates[:, None] + np.arange(6, 10)].view('<i4').reshape(-1) != dim):
+        return None, None
+
+    key_begins = np.concatenate([[0], candidates[:-1] + record_size])
+    raw = memoryview(buf)
+    keys = [ bytes(raw[b:e]).decode("latin1").strip() for b, e in zip(key_begins, candidates) ]
+
+    mat = np.empty((len(candidates), dim), dtype=dtype)
+    data_begins = candidates + 10
+    step = max(1, (1 << 22) // record_size)
+    for i in range(0, len(candidates), step):
+        # Gather the data of records.
+        index = data_begins[i:i+step, None] + np.arange(dim * dtype.itemsize)
+        mat[i:i+step] = buf[index].view(dtype)
+    return keys, mat
+
+def _load_scp_vectors(scp_path, num_threads=8):
+    from concurrent.futures import ThreadPoolExecutor
+
+    keys = []
+    groups = {}
+    with open(scp_path, 'r') as reader:
+        for line in reader:
+            if line.strip() == "": continue
+            (key, rxfile) = line.strip().split(None, 1)
+            if not re.search(':[0-9]+$', rxfile):
+                return None, None
+            (ark_path, offset) = rxfile.rsplit(':', 1)
+            if ark_path.split('.')[-1] == 'gz':
+                return None, None
+            groups.setdefault(ark_path, []).append((len(keys), int(offset)))
+            keys.append(key)
+    if len(keys) == 0: return keys, np.zeros((0, 0), dtype='float32')
+
+    # Get dim and type from the first vector.
+    ark_path, members = next(iter(groups.items()))
+    with open(ark_path, 'rb') as fd:
+        offset = members[0][1]
+        fd.seek(offset)
+        header = fd.read(10)
+    if header[:2] != b'\0B' or header[2:5] not in (b'FV ', b'DV '):
+        return None, None
+    dtype = np.dtype('float32') if header[2:5] == b'FV ' else np.dtype('float64')
+    dim = struct.unpack('<i', header[6:10])[0]
+    record_size = 10 + dim * dtype.itemsize
+
+    mat = np.empty((len(keys), dim), dtype=dtype)
+
+    def read_group(ark_path, members):
+        fd = os.open(ark_path, os.O_RDONLY)
+        try:
+            ranges = [ (offset, offset + record_size) for _, offset in members ]
+            for (index, offset), record in zip(members, _pread_merged(fd, ranges, values_only=True)):
+                if record[:6] != header[:6] or struct.unpack('<i', record[6:10])[0] != dim:
+                    raise UnknownVectorHeader("Expected vectors with the same type and dim in {0}, but {1}:{2} is not.".format(
+                                              scp_path, ark_path, offset))
+                mat[index] = np.frombuffer(record[10:], dtype=dtype)
+        finally:
+            os.close(fd)
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for future in [ executor.submit(read_group, ark_path, members) for ark_path, members in groups.items() ]:
+            future.result()
+
+    return keys, mat
+
 # Writing,
 def write_vec_flt(file_or_fd, v, key=''):
     """ write_vec_flt(f, v, key='')
@@ -443,6 +681,17 @@ def read_mat(file_or_fd, chunk=None):
         if fd is not file_or_fd: fd.close()
     return mat
 
+def read_mat_at(ark_path, offset, chunk=None):
+    """ [mat] = read_mat_at(ark_path, offset, chunk=None)
+     Read single kaldi matrix at the byte offset of ark file without parsing the rxspecifier,
+     offset < 0 means that ark_path is a whole rxfile, such as a pipe.
+    """
+    if offset < 0 or ark_path.split('.')[-1] == 'gz':
+        return read_mat(ark_path if offset < 0 else "{0}:{1}".format(ark_path, offset), chunk=chunk)
+    with open(ark_path, 'rb') as fd:
+        fd.seek(offset)
+        return read_mat(fd, chunk=chunk)
+
 def _read_mat_binary(fd, chunk=None):
     # chunk:[start_line_index, end_line_index] # Snowdar 2019-09-19
     # Data type
@@ -504,49 +753,82 @@ def _read_mat_ascii(fd, chunk=None):
             return mat
 
 
+# Format of header 'struct' of compressed matrix,
+_compressed_global_header = np.dtype([('minvalue','float32'),('range','float32'),('num_rows','int32'),('num_cols','int32')]) # member '.format' is not written,
+
 def _read_compressed_mat(fd, format, chunk=None):
     """ Read a compressed matrix,
         see: https://github.com/kaldi-asr/kaldi/blob/master/src/matrix/compressed-matrix.h
         methods: CompressedMatrix::Read(...), CompressedMatrix::CopyToMat(...),
+        formats: 'CM ' (kOneByteWithColHeaders), 'CM2' (kTwoByte) and 'CM3' (kOneByte).
+
+        Only the rows of chunk are decoded (and only they are read for the row-major CM2 and CM3),
+        and the bytes are mapped to floats by lookup tables rather than by masks.
     """
     # chunk:[start_line_index, end_line_index] # Snowdar 2019-09-19
-    assert(format == 'CM ') # The formats CM2, CM3 are not supported...
-
-    # Format of header 'struct',
-    global_header = np.dtype([('minvalue','float32'),('range','float32'),('num_rows','int32'),('num_cols','int32')]) # member '.format' is not written,
-    per_col_header = np.dtype([('percentile_0','uint16'),('percentile_25','uint16'),('percentile_75','uint16'),('percentile_100','uint16')])
+    if format != 'CM ':
+        # The token of 'CM2' and 'CM3' is followed by a space.
+        assert(fd.read(1).decode() == ' ')
 
     # Read global header,
-    globmin, globrange, rows, cols = np.frombuffer(fd.read(16), dtype=global_header, count=1)[0]
-
-    # The data is structed as [Colheader, ... , Colheader, Data, Data , .... ]
-    #                                                 {                     cols                     }{         size                 }
-    col_headers = np.frombuffer(fd.read(cols*8), dtype=per_col_header, count=cols)
-    col_headers = np.array([np.array([x for x in y]) * globrange * 1.52590218966964e-05 + globmin for y in col_headers], dtype=np.float32)
-
-    data = np.reshape(np.frombuffer(fd.read(cols*rows), dtype='uint8', count=cols*rows), newshape=(cols,rows)) # stored as col-major,
-
-    mat = np.zeros((cols,rows), dtype='float32')
-    p0 = col_headers[:, 0].reshape(-1, 1)
-    p25 = col_headers[:, 1].reshape(-1, 1)
-    p75 = col_headers[:, 2].reshape(-1, 1)
-    p100 = col_headers[:, 3].reshape(-1, 1)
-    mask_0_64 = (data <= 64)
-    mask_193_255 = (data > 192)
-    mask_65_192 = (~(mask_0_64 | mask_193_255))
-
-    mat += (p0    + (p25 - p0) / 64. * data) * mask_0_64.astype(np.float32)
-    mat += (p25 + (p75 - p25) / 128. * (data - 64)) * mask_65_192.astype(np.float32)
-    mat += (p75 + (p100 - p75) / 63. * (data - 192)) * mask_193_255.astype(np.float32)
+    globmin, globrange, rows, cols = np.frombuffer(fd.read(16), dtype=_compressed_global_header, count=1)[0]
+    start_index, end_index = _get_chunk_range(chunk, rows)
+    num_rows = end_index - start_index + 1
+
+    if format == 'CM ':
+        # The data is structed as [Colheader, ... , Colheader, Data, Data , .... ]
+        #                          {        cols            }{      cols * rows    }
+        col_headers = np.frombuffer(fd.read(cols*8), dtype='uint16', count=cols*4).reshape(cols, 4)
+        data = np.frombuffer(fd.read(cols*rows), dtype='uint8', count=cols*rows).reshape(cols, rows) # stored as col-major,
+        return _decode_compressed_cols(globmin, globrange, col_headers, data[:, start_index:end_index+1])
+    elif format == 'CM2':
+        _skip_bytes(fd, start_index * cols * 2)
+        data = np.frombuffer(fd.read(num_rows*cols*2), dtype='uint16', count=num_rows*cols).reshape(num_rows, cols)
+        return _decode_compressed_rows(globmin, globrange, data)
+    elif format == 'CM3':
+        _skip_bytes(fd, start_index * cols)
+        data = np.frombuffer(fd.read(num_rows*cols), dtype='uint8', count=num_rows*cols).reshape(num_rows, cols)
+        return _decode_compressed_rows(globmin, globrange, data)
+    else:
+        raise UnknownMatrixHeader("The header contained '%s'" % format)
+
+def _get_chunk_range(chunk, rows):
+    if chunk is None:
+        return 0, rows - 1
+    return int(chunk[0]), int(chunk[1])
+
+def _skip_bytes(fd, num_bytes):
+    if num_bytes <= 0: return
+    if fd.seekable(): fd.seek(num_bytes, 1) # Seek from current position
+    else: fd.read(num_bytes) # Such as a pipe,
+
+def _decode_compressed_cols(globmin, globrange, col_headers, data):
+    """ [mat] = _decode_compressed_cols(globmin, globrange, col_headers, data)
+     Decode 'CM ' data with a [cols, 256] lookup table, i.e. CompressedMatrix::CharToFloat(...) for every possible byte.
+     col_headers : [cols, 4] uint16 percentiles (0, 25, 75, 100),
+     data : [cols, num_rows] uint8 (col-major), which could be a chunk of all rows,
+     Returns [num_rows, cols] float32 row-major matrix.
+    """
+    percentiles = np.float32(globmin) + np.float32(globrange) * np.float32(1.52590218966964e-05) * col_headers.astype(np.float32)
+    p0, p25, p75, p100 = [ percentiles[:, i:i+1] for i in range(4) ]
 
-    start_index = 0
-    end_index = rows - 1
+    value = np.arange(256, dtype=np.float32)
+    lut = np.where(value <= 64, p0 + (p25 - p0) * value * np.float32(1/64.),
+          np.where(value <= 192, p25 + (p75 - p25) * (value - 64) * np.float32(1/128.),
+                   p75 + (p100 - p75) * (value - 192) * np.float32(1/63.)))
 
-    if chunk is not None:
-        start_index = int(chunk[0])
-        end_index = int(chunk[1])
+    # transpose! col-major -> row-major,
+    return lut[np.arange(lut.shape[0]), data.T].astype(np.float32, copy=False)
 
-    return mat.T[start_index:end_index+1] # transpose! col-major -> row-major,
+def _decode_compressed_rows(globmin, globrange, data):
+    """ [mat] = _decode_compressed_rows(globmin, globrange, data)
+     Decode row-major 'CM2' (uint16) or 'CM3' (uint8) data, the uint8 one with a 256-entry lookup table.
+    """
+    if data.dtype == np.uint8:
+        lut = np.float32(globmin) + np.arange(256, dtype=np.float32) * np.float32(globrange / 255.)
+        return lut[data]
+    else:
+        return np.float32(globmin) + data.astype(np.float32) * np.float32(globrange / 65535.)
 
 
 # Writing,
@@ -588,6 +870,309 @@ def write_mat(file_or_fd, m, key=''):
         if fd is not file_or_fd : fd.close()
 
 
+#################################################
+# Cache of piped rxfiles, [Snowdar]
+#
+
+class PipeCache():
+    """ cache = PipeCache(cache_dir)
+     Materialize the output of a piped rxfile ('cmd |', such as 'apply-cmvn-sliding ... |' in feats.scp) to a local
+     file in cache_dir once, and return the cached file next time rather than forking a shell for every reading.
+     The cache files are named by the sha1 of the command and written atomically (temp file + rename), so they
+     could be shared by DataLoader workers and by later trainings.
+
+     Read a chunk:
+     ark_path, offset = cache.get('apply-cmvn-sliding ... |')
+     mat = read_mat_at(ark_path, offset, chunk=[0, 199])
+    """
+    def __init__(self, cache_dir, log_interval=10000):
+        self.cache_dir = cache_dir
+        self.log_interval = log_interval
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, rxfile):
+        """ (ark_path, offset) = get(rxfile)
+         Return the cached file of a piped rxfile, and the offset of the object in it is always 0.
+        """
+        import hashlib
+        assert rxfile[-1] == '|', "Expected a piped rxfile, but got {0}".format(rxfile)
+
+        name = hashlib.sha1(rxfile.encode()).hexdigest()
+        cache_path = "{0}/{1}/{2}.ark".format(self.cache_dir, name[:2], name)
+
+        if os.path.exists(cache_path):
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._materialize(rxfile, cache_path)
+
+        if self.log_interval > 0 and (self.hits + self.misses) % self.log_interval == 0:
+            logger.info("Pipe cache of process {0}: {1} hits, {2} misses, hit rate {3:.2f}%.".format(
+                         os.getpid(), self.hits, self.misses, 100. * self.hits / (self.hits + self.misses)))
+
+        return cache_path, 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def _materialize(self, rxfile, cache_path):
+        # Drop the key if the command writes an ark rather than a single object.
+        materialize_pipe(rxfile, cache_path, drop_key=True)
+
+
+def materialize_pipe(rxfile, cache_path, drop_key=False):
+    """ materialize_pipe(rxfile, cache_path, drop_key=False)
+     Run the command of a piped rxfile ('cmd |') to the end and write its output to cache_path atomically
+     (temp file + rename). The exit status is checked here rather than in a cleanup thread like popen, so the
+     truncated output of a failed or killed command is never cached.
+
+     drop_key : if true, drop the leading key of an ark output which is not a single binary or ascii object.
+    """
+    import subprocess
+    cmd = rxfile[:-1]
+    proc = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise SubprocessFailed('cmd %s returned %d !' % (cmd, proc.returncode))
+
+    data = proc.stdout
+    if len(data) == 0:
+        raise SubprocessFailed('cmd %s wrote nothing !' % cmd)
+
+    if drop_key and data[:2] != b'\0B' and data[:2] != b' [':
+        pos = data.find(b' ')
+        if pos <= 0:
+            raise BadInputFormat('Expected a key or an object in the output of cmd %s, but got %r' % (cmd, data[:16]))
+        data = data[pos + 1:]
+
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir != "" and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    tmp_path = "{0}.{1}.tmp".format(cache_path, os.getpid())
+    with open(tmp_path, 'wb') as writer:
+        writer.write(data)
+    os.replace(tmp_path, cache_path)
+
+
+#################################################
+# Batched random access of chunks in ark files, [Snowdar]
+#
+
+def read_mats_batch(requests, out=None, transpose=False, max_gap=4096):
+    """ [mats] = read_mats_batch(requests, out=None, transpose=False)
+     Read a batch of chunks with the same number of rows from binary 'FM '/'DM ' matrices.
+     The requests are sorted by ark file and offset, and the byte ranges which are adjacent (or their gap
+     is not more than max_gap) are merged to be read by one os.pread, so a batch of 512 chunks costs one open
+     per ark file and a few preads rather than 512 open/seek/read.
+     Compressed or ascii matrices and pipes are read by read_mat_at one by one.
+
+     requests : a list of (ark_path, offset, start, end) and the chunk is rows [start, end] (included),
+     out : an optional preallocated float32 buffer [N, rows, cols] ([N, cols, rows] if transpose),
+     transpose : if true, fill the buffer with the transposed [cols, rows] chunks.
+
+     Returns the buffer in the order of requests.
+    """
+    num_rows = set([ int(end) - int(start) + 1 for _, _, start, end in requests ])
+    if len(num_rows) != 1:
+        raise ValueError("Expected all chunks with the same number of rows, but got {0}.".format(sorted(num_rows)))
+    num_rows = num_rows.pop()
+
+    order = sorted(range(len(requests)), key=lambda i: (requests[i][0], requests[i][1], requests[i][2]))
+
+    i = 0
+    while i < len(order):
+        # Group by ark file,
+        ark_path = requests[order[i]][0]
+        j = i
+        while j < len(order) and requests[order[j]][0] == ark_path: j += 1
+        group = order[i:j]
+        i = j
+
+        if int(requests[group[0]][1]) < 0 or ark_path[-1] == '|' or ark_path.split('.')[-1] == 'gz':
+            for index in group:
+                out = _fill_batch(out, index, len(requests), read_mat_at(*requests[index][:2], chunk=requests[index][2:]), transpose)
+            continue
+
+        fd = os.open(ark_path, os.O_RDONLY)
+        try:
+            # Read headers of all distinct matrices,
+            offsets = sorted(set([ int(requests[index][1]) for index in group ]))
+            headers = {}
+            for offset, buf in _pread_merged(fd, [ (offset, offset + 15) for offset in offsets ], max_gap):
+                headers[offset] = buf
+
+            # Read data of all chunks,
+            ranges = []
+            fallback = []
+            for index in group:
+                offset, start, end = [ int(x) for x in requests[index][1:] ]
+                header = headers[offset]
+                if header[:5] == b'\0BFM ': dtype = np.dtype('float32')
+                elif header[:5] == b'\0BDM ': dtype = np.dtype('float64')
+                else:
+                    fallback.append(index)
+                    continue
+                s1, rows, s2, cols = np.frombuffer(header[5:15], dtype='int8,int32,int8,int32', count=1)[0]
+                if not 0 <= start <= end < rows:
+                    raise ValueError("Chunk [{0}, {1}] is out of {2} rows of matrix in {3}:{4}.".format(start, end, rows, ark_path, offset))
+                begin = offset + 15 + start * cols * dtype.itemsize
+                ranges.append((begin, begin + num_rows * cols * dtype.itemsize, index, dtype, cols))
+
+            for (begin, end, index, dtype, cols), buf in zip(ranges, _pread_merged(fd, [ x[:2] for x in ranges ], max_gap, values_only=True)):
+                out = _fill_batch(out, index, len(requests), np.frombuffer(buf, dtype=dtype).reshape(num_rows, cols), transpose)
+        finally:
+            os.close(fd)
+
+        for index in fallback:
+            out = _fill_batch(out, index, len(requests), read_mat_at(*requests[index][:2], chunk=requests[index][2:]), transpose)
+
+    return out
+
+def _pread_merged(fd, ranges, max_gap=4096, values_only=False):
+    """ Read [begin, end) byte ranges of fd by merged os.pread calls.
+     Yields (begin, bytes) (or bytes if values_only) in the sorted order of ranges.
+    """
+    if len(ranges) == 0: return
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+    results = [None] * len(ranges)
+
+    k = 0
+    while k < len(order):
+        merged_begin, merged_end = ranges[order[k]]
+        m = k + 1
+        while m < len(order) and ranges[order[m]][0] - merged_end <= max_gap:
+            merged_end = max(merged_end, ranges[order[m]][1])
+            m += 1
+        buf = memoryview(os.pread(fd, merged_end - merged_begin, merged_begin))
+        for index in order[k:m]:
+            begin, end = ranges[index]
+            results[index] = buf[begin - merged_begin:end - merged_begin]
+        k = m
+
+    for index, (begin, end) in enumerate(ranges):
+        yield results[index] if values_only else (begin, results[index])
+
+def _fill_batch(out, index, batch_size, mat, transpose=False):
+    if transpose: mat = mat.T
+    if out is None:
+        out = np.empty((batch_size,) + mat.shape, dtype=np.float32)
+    out[index] = mat
+    return out
+
+
+#################################################
+# Memory-mapped random access of matrices in ark files, [Snowdar]
+#
+
+class MmapArkReader():
+    """ reader = MmapArkReader(max_open=64)
+     Random-access reader for binary 'FM '/'DM ' (and compressed 'CM ', 'CM2', 'CM3') matrices stored in ark files.
+     Every ark file is mapped once by np.memmap and the mapped files are kept in a bounded LRU,
+     so reading a chunk is just slicing the map without open/seek/read syscalls.
+
+     It should be created per DataLoader worker (the maps are not pickled and are re-opened lazily
+     after forking), and the returned 'FM '/'DM ' matrix is a read-only zero-copy view of the map.
+
+     Read a chunk:
+     mat = reader.read_mat('foo.ark:1024', chunk=[0, 199])
+     mat = reader.read_mat_at('foo.ark', 1024, chunk=[0, 199])
+    """
+    def __init__(self, max_open=64):
+        assert max_open >= 1
+        self.max_open = max_open
+        self.maps = collections.OrderedDict()
+
+    def __getstate__(self):
+        # Do not pickle the maps when spawning workers.
+        state = self.__dict__.copy()
+        state["maps"] = collections.OrderedDict()
+        return state
+
+    def get_map(self, ark_path):
+        if ark_path in self.maps:
+            self.maps.move_to_end(ark_path)
+        else:
+            if len(self.maps) >= self.max_open:
+                self.maps.popitem(last=False) # The map is closed when its last view is released.
+            self.maps[ark_path] = np.memmap(ark_path, dtype='uint8', mode='r')
+        return self.maps[ark_path]
+
+    def read_mat(self, rxfile, chunk=None):
+        """ [mat] = read_mat(rxfile, chunk=None)
+         rxfile : 'foo.ark:offset' which comes from feats.scp.
+        """
+        if re.search(':[0-9]+$', rxfile):
+            (ark_path, offset) = rxfile.rsplit(':', 1)
+            return self.read_mat_at(ark_path, int(offset), chunk=chunk)
+        else:
+            return read_mat(rxfile, chunk=chunk)
+
+    def read_mat_at(self, ark_path, offset, chunk=None):
+        # chunk:[start_line_index, end_line_index]
+        # Pipes, gzipped and compressed or ascii matrices could not be mapped, so read them by read_mat.
+        if offset < 0 or ark_path[-1] == '|' or ark_path.split('.')[-1] == 'gz':
+            return read_mat_at(ark_path, offset, chunk=chunk)
+
+        buf = self.get_map(ark_path)
+        if buf[offset:offset+2].tobytes() != b'\0B':
+            return read_mat_at(ark_path, offset, chunk=chunk)
+
+        header = buf[offset+2:offset+5].tobytes().decode()
+        if header == 'FM ': dtype = np.dtype('float32')
+        elif header == 'DM ': dtype = np.dtype('float64')
+        elif header.startswith('CM'): return self._read_compressed_mat(buf, offset + 5, header, chunk=chunk)
+        else: raise UnknownMatrixHeader("The header contained '%s'" % header)
+
+        s1, rows, s2, cols = np.frombuffer(buf[offset+5:offset+15].tobytes(), dtype='int8,int32,int8,int32', count=1)[0]
+
+        start_index = 0
+        end_index = rows - 1 # 0-based
+
+        if chunk is not None:
+            start_index = int(chunk[0])
+            end_index = int(chunk[1])
+
+        if not 0 <= start_index <= end_index < rows:
+            raise ValueError("Chunk [{0}, {1}] is out of {2} rows of matrix in {3}:{4}.".format(start_index, end_index,
+                             rows, ark_path, offset))
+
+        begin = offset + 15 + start_index * cols * dtype.itemsize
+        end = begin + (end_index - start_index + 1) * cols * dtype.itemsize
+        # It is a view of the map rather than a copy.
+        return buf[begin:end].view(dtype).reshape(-1, cols)
+
+    def _read_compressed_mat(self, buf, position, format, chunk=None):
+        # Only the bytes of chunk are touched for CM2 and CM3, see _read_compressed_mat(...).
+        if format != 'CM ': position += 1 # The token of 'CM2' and 'CM3' is followed by a space.
+
+        globmin, globrange, rows, cols = np.frombuffer(buf[position:position+16].tobytes(), 
+                                                       dtype=_compressed_global_header, count=1)[0]
+        position += 16
+        start_index, end_index = _get_chunk_range(chunk, rows)
+
+        if format == 'CM ':
+            col_headers = buf[position:position+cols*8].view('uint16').reshape(cols, 4)
+            position += cols*8
+            data = buf[position:position+cols*rows].reshape(cols, rows)
+            return _decode_compressed_cols(globmin, globrange, col_headers, data[:, start_index:end_index+1])
+        elif format in ('CM2', 'CM3'):
+            sample_size = 2 if format == 'CM2' else 1
+            begin = position + start_index * cols * sample_size
+            end = position + (end_index + 1) * cols * sample_size
+            data = buf[begin:end].view('uint16' if sample_size == 2 else 'uint8').reshape(-1, cols)
+            return _decode_compressed_rows(globmin, globrange, data)
+        else:
+            raise UnknownMatrixHeader("The header contained '%s'" % format)
+
+    def close(self):
+        self.maps.clear()
+
+
 #################################################
 # 'Posterior' kaldi type (posteriors, confusion network, nnet1 training targets, ...)
 # Corresponds to: vector<vector<tuple<int,float> > >
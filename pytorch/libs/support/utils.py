@@ -150,6 +150,23 @@ def for_device_free(function):
     return wrapper
 
 
+def for_float32(function):
+    """
+    A decorator to make class-function (such as forward) run in float32 even if autocast is enabled for
+    mixed-precision training (see use_amp of SimpleTrainer), where the float16 input-tensors are cast to float32.
+    Used in libs.nnet.loss.MarginSoftmaxLoss and libs.nnet.components.StatisticsPooling
+    """
+    def wrapper(self, *args, **kwargs):
+        if not torch.is_autocast_enabled():
+            return function(self, *args, **kwargs)
+
+        args = [ arg.float() if isinstance(arg, torch.Tensor) and arg.is_floating_point() else arg for arg in args ]
+        with torch.cuda.amp.autocast(enabled=False):
+            return function(self, *args, **kwargs)
+
+    return wrapper
+
+
 def create_model_from_py(model_blueprint, model_creation=""):
     """ Used in pipeline/train.py and pipeline/onestep/extract_emdeddings.py and it makes config of nnet
     more free with no-change of training and other common scripts.
@@ -248,10 +265,28 @@ def save_checkpoint(checkpoint_path, **kwargs):
         model_path:<string>
         optimizer:<optimizer.state_dict>
         lr_scheduler:<lr_scheduler.state_dict>
+    It is written to a temp file and then renamed, so an existing checkpoint is always complete.
     """
     state_dict = {}
     state_dict.update(kwargs)
-    torch.save(state_dict, checkpoint_path)
+    tmp_path = "{0}.{1}.tmp".format(checkpoint_path, os.getpid())
+    torch.save(state_dict, tmp_path)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def split_train_stage(train_stage):
+    """Split the --train-stage of launcher to (start_epoch, start_iter), i.e. the completed epochs and the completed
+    optimizer steps of the next epoch.
+        "-1" -> (-1, 0), "3" -> (3, 0), "4.1000" -> (3, 1000) which resumes from 4.1000.checkpoint.
+    """
+    train_stage = str(train_stage)
+    if "." not in train_stage:
+        return int(train_stage), 0
+
+    epoch, this_iter = train_stage.split(".")
+    if int(epoch) < 1 or int(this_iter) < 1:
+        raise ValueError("Expected --train-stage=epoch.iter with epoch >= 1 and iter >= 1, but got {0}.".format(train_stage))
+    return int(epoch) - 1, int(this_iter)
 
 
 def format(x, str):
@@ -402,6 +437,16 @@ def is_main_training():
             return False
     return True
 
+def barrier():
+    """Wait for all training processes, such as the others waiting for the main one to write a shared file.
+    It does nothing for single-GPU training.
+    """
+    if use_horovod():
+        import horovod.torch as hvd
+        hvd.allreduce(torch.tensor(0), name="barrier")
+    elif use_ddp():
+        dist.barrier()
+
 def auto_scale_lr(lr):
     if use_horovod():
         import horovod.torch as hvd
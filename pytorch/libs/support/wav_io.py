@@ -0,0 +1,268 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import os
+import struct
+import shutil
+import hashlib
+import logging
+import collections
+import numpy as np
+
+import libs.support.kaldi_io as kaldi_io
+import libs.support.utils as utils
+
+# Logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+"""Random access of waveforms (such as MUSAN noise, music, speech and RIRs, or clean training speech) by a cached
+columnar index of wav.scp and memory-mapped wav files, so that reading a segment is just slicing a mapped file.
+"""
+
+# The sample formats of wav and their codes in WavIndex.
+wav_formats = [np.dtype('<i2'), np.dtype('<f4')]
+
+def read_wav_header(wav_path:str):
+    """Return (data_offset, num_samples, num_channels, sample_rate, format_code) of a 16-bit PCM or 32-bit float
+    RIFF wav file by walking its chunks.
+    """
+    with open(wav_path, 'rb') as reader:
+        riff, _, wave = struct.unpack('<4sI4s', reader.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError("Expected a RIFF/WAVE file, but got {0}.".format(wav_path))
+
+        fmt = None
+        while True:
+            header = reader.read(8)
+            if len(header) < 8:
+                raise ValueError("There is no data chunk in {0}.".format(wav_path))
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', reader.read(16))
+                reader.seek(chunk_size - 16 + chunk_size % 2, 1)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise ValueError("The data chunk is before fmt chunk in {0}.".format(wav_path))
+                audio_format, num_channels, sample_rate, _, _, bits = fmt
+                if audio_format == 0xFFFE:
+                    # WAVE_FORMAT_EXTENSIBLE, see its sub-format by bits.
+                    audio_format = 1 if bits == 16 else 3
+                if audio_format == 1 and bits == 16:
+                    format_code = 0
+                elif audio_format == 3 and bits == 32:
+                    format_code = 1
+                else:
+                    raise TypeError("Do not support wav with format {0} and {1} bits: {2}.".format(audio_format,
+                                    bits, wav_path))
+
+                data_offset = reader.tell()
+                # The size of data chunk is not reliable for the wav from a pipe (such as sox ... -t wav -).
+                data_size = min(chunk_size, os.path.getsize(wav_path) - data_offset)
+                num_samples = data_size // (wav_formats[format_code].itemsize * num_channels)
+                return data_offset, num_samples, num_channels, sample_rate, format_code
+            else:
+                reader.seek(chunk_size + chunk_size % 2, 1)
+
+
+class WavIndex():
+    """A columnar index of wav.scp. It is saved as a directory of .npy files and loaded with mmap_mode='r' like
+    egs_index.EgsIndex, so the headers of wav files are parsed once rather than in every training.
+    The piped wavs (such as 'sox ... -t wav - |') are materialized to cache_dir once by their sha1.
+
+    Files in index_dir:
+        names.npy       : [N] str, the keys of wav.scp.
+        paths.npy       : [num_paths] str, the interned wav paths.
+        path_ids.npy    : [N] int32, the index of wav path in paths.
+        offsets.npy     : [N] int64, the byte offset of samples in wav.
+        num_samples.npy : [N] int64, the number of samples (of every channel).
+        channels.npy    : [N] int16, the number of channels and only the first channel is read.
+        formats.npy     : [N] int8, the code of sample format, see wav_formats.
+    """
+    columns = ["path_ids", "offsets", "num_samples", "channels", "formats"]
+
+    def __init__(self, names, paths, path_ids, offsets, num_samples, channels, formats, sample_rate=16000):
+        self.names = names
+        self.paths = paths
+        self.path_ids = path_ids
+        self.offsets = offsets
+        self.num_samples = num_samples
+        self.channels = channels
+        self.formats = formats
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def from_scp(self, wav_scp:str, cache_dir:str=None, sample_rate=16000):
+        """
+        @cache_dir: where to materialize the piped wavs, default is the wav_cache next to wav_scp.
+        """
+        if cache_dir is None:
+            cache_dir = "{0}/wav_cache".format(os.path.dirname(os.path.abspath(wav_scp)))
+
+        names = []
+        wav_paths = []
+        with open(wav_scp, 'r') as reader:
+            for line in reader:
+                items = line.strip().split(maxsplit=1)
+                if len(items) != 2:
+                    continue
+                name, wav = items
+                if wav.endswith('|'):
+                    wav = materialize_piped_wav(wav, cache_dir)
+                names.append(name)
+                wav_paths.append(wav)
+
+        if len(names) == 0:
+            raise ValueError("Expected at least one wav in {0}.".format(wav_scp))
+
+        headers = np.array([ read_wav_header(wav_path) for wav_path in wav_paths ], dtype=np.int64).reshape(-1, 5)
+        sample_rates = np.unique(headers[:, 3])
+        if len(sample_rates) != 1 or sample_rates[0] != sample_rate:
+            raise ValueError("Expected the sample rate of all wavs in {0} is {1}, but got {2}.".format(wav_scp,
+                             sample_rate, sample_rates.tolist()))
+
+        paths, path_ids = np.unique(np.array(wav_paths, dtype=str), return_inverse=True)
+
+        return self(np.array(names, dtype=str), paths, path_ids.reshape(-1).astype(np.int32), headers[:, 0],
+                    headers[:, 1], headers[:, 2].astype(np.int16), headers[:, 4].astype(np.int8),
+                    sample_rate=sample_rate)
+
+    @classmethod
+    def load(self, index_dir:str, mmap=True, sample_rate=16000):
+        if not os.path.exists(index_dir):
+            raise ValueError("The wav index {0} is not exist.".format(index_dir))
+
+        mmap_mode = 'r' if mmap else None
+        names = np.load("{0}/names.npy".format(index_dir))
+        paths = np.load("{0}/paths.npy".format(index_dir))
+        columns = [ np.load("{0}/{1}.npy".format(index_dir, name), mmap_mode=mmap_mode) for name in self.columns ]
+
+        return self(names, paths, *columns, sample_rate=sample_rate)
+
+    def save(self, index_dir:str):
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        np.save("{0}/names.npy".format(index_dir), self.names)
+        np.save("{0}/paths.npy".format(index_dir), self.paths)
+        # The formats.npy is the last saved file.
+        for name in self.columns:
+            np.save("{0}/{1}.npy".format(index_dir, name), getattr(self, name))
+
+    def get_name2index(self):
+        return { str(name):index for index, name in enumerate(self.names) }
+
+    def __len__(self):
+        return len(self.path_ids)
+
+
+class MmapWavReader():
+    """ reader = MmapWavReader(max_open=64)
+     Read segments of the wavs in a WavIndex. Every wav file is mapped once by np.memmap and the mapped files are
+     kept in a bounded LRU pool like kaldi_io.MmapArkReader, so reading a segment is just slicing the map.
+     It should be created per process (the maps are not pickled and are re-opened lazily after forking).
+
+     Read a batch of segments:
+     segments = reader.read_batch(wav_index, [0, 3], starts=[16000, 0], length=32000)
+    """
+    def __init__(self, max_open=64):
+        assert max_open >= 1
+        self.max_open = max_open
+        self.maps = collections.OrderedDict()
+
+    def __getstate__(self):
+        # Do not pickle the maps when spawning workers.
+        state = self.__dict__.copy()
+        state["maps"] = collections.OrderedDict()
+        return state
+
+    def get_map(self, wav_path):
+        if wav_path in self.maps:
+            self.maps.move_to_end(wav_path)
+        else:
+            if len(self.maps) >= self.max_open:
+                self.maps.popitem(last=False) # The map is closed when its last view is released.
+            self.maps[wav_path] = np.memmap(wav_path, dtype='uint8', mode='r')
+        return self.maps[wav_path]
+
+    def get_samples(self, wav_index:WavIndex, index):
+        """Return the [num_samples] view of the first channel of a wav without copying.
+        """
+        buf = self.get_map(str(wav_index.paths[wav_index.path_ids[index]]))
+        dtype = wav_formats[int(wav_index.formats[index])]
+        channels = int(wav_index.channels[index])
+        num_samples = int(wav_index.num_samples[index])
+        offset = int(wav_index.offsets[index])
+
+        samples = buf[offset:offset + num_samples * channels * dtype.itemsize].view(dtype)
+        return samples[::channels] if channels > 1 else samples
+
+    def read_batch(self, wav_index:WavIndex, indexes, starts, length:int, out=None):
+        """Read a [batch, length] float32 array (in the scale of 16-bit samples like kaldi) of the segments
+        [start, start + length) of wavs. The reads are grouped by wav file to reuse the maps, and a segment which
+        is out of its wav is wrapped around, so the short noises are repeated.
+        """
+        if out is None:
+            out = np.empty((len(indexes), length), dtype=np.float32)
+
+        order = np.argsort(np.asarray(wav_index.path_ids)[np.asarray(indexes, dtype=np.int64)], kind='stable')
+        for i in order:
+            index, start = int(indexes[i]), int(starts[i])
+            samples = self.get_samples(wav_index, index)
+            if 0 <= start and start + length <= len(samples):
+                out[i] = samples[start:start + length]
+            else:
+                out[i] = samples[np.arange(start, start + length) % len(samples)]
+            if wav_index.formats[index] == 1:
+                out[i] *= 32768.
+
+        return out
+
+
+## Function
+def materialize_piped_wav(rxfile:str, cache_dir:str):
+    """Write the output of a piped wav ('cmd |') to cache_dir once and return the cached wav path.
+    """
+    name = hashlib.sha1(rxfile.encode()).hexdigest()
+    cache_path = "{0}/{1}/{2}.wav".format(cache_dir, name[:2], name)
+
+    if not os.path.exists(cache_path):
+        kaldi_io.materialize_pipe(rxfile, cache_path)
+
+    return cache_path
+
+
+def get_wav_index_dir(wav_scp:str):
+    """e.g. data/musan_noise/wav.scp -> data/musan_noise/wav.index
+    """
+    return os.path.splitext(wav_scp)[0] + ".index"
+
+
+def load_wav_index(wav_scp:str, cache_dir:str=None, sample_rate=16000):
+    """Load the index of wav_scp if it exists and is not older than wav_scp, else build and save it.
+    Only the main training process builds the index and the others load it after a barrier. The index is saved
+    to a temp dir and then renamed, so an existing index is always complete.
+    """
+    index_dir = get_wav_index_dir(wav_scp)
+
+    if utils.is_main_training():
+        formats_path = "{0}/formats.npy".format(index_dir)
+        if not os.path.exists(formats_path) or os.path.getmtime(formats_path) < os.path.getmtime(wav_scp):
+            if os.path.exists(formats_path):
+                logger.warning("The wav index {0} is older than {1}, so build it again.".format(index_dir, wav_scp))
+
+            logger.info("Build the wav index of {0} to {1}.".format(wav_scp, index_dir))
+            wav_index = WavIndex.from_scp(wav_scp, cache_dir=cache_dir, sample_rate=sample_rate)
+
+            tmp_dir = "{0}.{1}.tmp".format(index_dir, os.getpid())
+            wav_index.save(tmp_dir)
+            if os.path.exists(index_dir):
+                shutil.rmtree(index_dir)
+            os.replace(tmp_dir, index_dir)
+
+    utils.barrier()
+
+    return WavIndex.load(index_dir, sample_rate=sample_rate)
@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import os
+import random
+import logging
+import threading
+import numpy as np
+import torch
+
+import libs.support.utils as utils
+
+# Logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class AsyncCheckpointSaver():
+    """Save the iteration-level checkpoints ({epoch}.{iter}.checkpoint in model_dir, see SimpleTrainer) by a
+    background thread, so training does not wait for the disk. The state is copied to CPU before returning from
+    save(), then it is written to a temp file and renamed, so a checkpoint is complete if it exists.
+    There is at most one checkpoint being written and only the last keep ones written by this saver are kept, so
+    the checkpoints of a former training in model_dir (such as the one resumed from) are never removed.
+    """
+    def __init__(self, model_dir:str, keep=2):
+        self.model_dir = model_dir
+        self.keep = keep
+        self.thread = None
+        self.saved_checkpoints = []
+
+    def save(self, state:dict, epoch:int, this_iter:int):
+        """
+        @epoch, this_iter: 1-based, see get_checkpoint_path().
+        """
+        # Copy the tensors (which could be changed by the next step) synchronously.
+        state = copy_to_cpu(state)
+        self.wait()
+
+        checkpoint_path = get_checkpoint_path(self.model_dir, epoch, this_iter)
+        self.thread = threading.Thread(target=self._save, args=(state, checkpoint_path), daemon=True)
+        self.thread.start()
+
+    def _save(self, state, checkpoint_path):
+        try:
+            utils.save_checkpoint(checkpoint_path, **state)
+            logger.info("Save checkpoint to {0}.".format(checkpoint_path))
+            if checkpoint_path not in self.saved_checkpoints:
+                self.saved_checkpoints.append(checkpoint_path)
+            self.remove_old_checkpoints()
+        except BaseException:
+            logger.exception("Failed to save checkpoint to {0}.".format(checkpoint_path))
+
+    def remove_old_checkpoints(self):
+        if self.keep <= 0:
+            return
+        old_checkpoints, self.saved_checkpoints = self.saved_checkpoints[:-self.keep], self.saved_checkpoints[-self.keep:]
+        for checkpoint_path in old_checkpoints:
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+## Function
+def copy_to_cpu(state):
+    """Return a copy of a nested dict/list/tuple whose tensors are copied to CPU.
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    elif isinstance(state, dict):
+        return { key:copy_to_cpu(value) for key, value in state.items() }
+    elif isinstance(state, (list, tuple)):
+        return type(state)(copy_to_cpu(value) for value in state)
+    else:
+        return state
+
+
+def get_rng_state():
+    """The numpy state is kept by a tensor rather than an array, see get_numpy_rng_state().
+    """
+    rng_state = {"python":random.getstate(), "torch":torch.get_rng_state(),
+                 "numpy":get_numpy_rng_state(np.random)}
+    if torch.cuda.is_available():
+        rng_state["cuda"] = torch.cuda.get_rng_state_all()
+    return rng_state
+
+
+def set_rng_state(rng_state:dict):
+    random.setstate(rng_state["python"])
+    set_numpy_rng_state(np.random, rng_state["numpy"])
+    torch.set_rng_state(rng_state["torch"])
+    if "cuda" in rng_state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng_state["cuda"])
+
+
+def get_numpy_rng_state(random_state):
+    """Return the state of np.random or a np.random.RandomState as a list with the keys in a tensor.
+    """
+    name, keys, pos, has_gauss, cached_gaussian = random_state.get_state()
+    return [name, torch.from_numpy(keys.astype(np.int64)), int(pos), int(has_gauss), float(cached_gaussian)]
+
+
+def set_numpy_rng_state(random_state, state:list):
+    name, keys, pos, has_gauss, cached_gaussian = state
+    random_state.set_state((name, keys.numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+
+
+def get_checkpoint_path(model_dir:str, epoch:int, this_iter:int):
+    """The checkpoint after this_iter (1-based) optimizer steps of the epoch (1-based), e.g. 4.1000.checkpoint.
+    """
+    return "{0}/{1}.{2}.checkpoint".format(model_dir, epoch, this_iter)
@@ -56,6 +56,12 @@ class LRSchedulerWrapper():
         elif self.name == "1cycle":
             self.lr_scheduler.step()
 
+    def state_dict(self):
+        return self.lr_scheduler.state_dict()
+
+    def load_state_dict(self, state_dict):
+        self.lr_scheduler.load_state_dict(state_dict)
+
 
 ## Learn rate scheduler ✿
 class CosineAnnealingWarmRestarts(_LRScheduler):
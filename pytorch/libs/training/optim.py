@@ -144,6 +144,20 @@ class Lookahead(Optimizer):
                     p.data.copy_(q.data)
         return loss
 
+    def state_dict(self):
+        # The step_counter is in the param_groups of base optimizer.
+        return {"optimizer":self.optimizer.state_dict(), 
+                "slow_weights":self.slow_weights if self.init_weights else None}
+
+    def load_state_dict(self, state_dict):
+        self.optimizer.load_state_dict(state_dict["optimizer"])
+        self.param_groups = self.optimizer.param_groups
+
+        if state_dict["slow_weights"] is not None:
+            self.slow_weights = [[q.to(p.device) for p, q in zip(group['params'], slow_weights)]
+                                    for group, slow_weights in zip(self.param_groups, state_dict["slow_weights"])]
+            self.init_weights = True
+
 
 ## Optimizer ✿
 class SGDW(Optimizer):
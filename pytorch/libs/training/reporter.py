@@ -51,7 +51,7 @@ class Reporter():
             self.record_file = "{0}/log/{1}".format(self.trainer.params["model_dir"], default_params["record_file"])
 
             # The case to recover training
-            if self.trainer.params["start_epoch"] > 0:
+            if self.trainer.params["start_epoch"] > 0 or self.trainer.params.get("start_iter", 0) > 0:
                 self.start_write_log = True
             elif os.path.exists(self.record_file):
                 # Do backup to avoid clearing the loss log when re-running a same launcher.
@@ -86,15 +86,45 @@ class Reporter():
 
             if self.is_report(training_point):
                 print("Device:{0}, {1}".format(self.device, utils.dict_to_params_str(info_dict, auto=False, sep=", ")))
-                dataframe = pd.DataFrame(self.record_value)
-                if self.start_write_log:
-                    dataframe.to_csv(self.record_file, mode='a', header=False, index=False)
-                else:
-                    # with open(self.record_file, "w") as f:
-                    #     f.truncate()
-                    dataframe.to_csv(self.record_file, header=True, index=False)
-                    self.start_write_log = True
-                self.record_value.clear()
+                # Hold the records until the pending validation (see AsyncValidator) is merged.
+                if not self.has_pending_valid():
+                    self.write_records()
+
+    def has_pending_valid(self):
+        return any([ info_dict.get("valid_loss", "") is None for info_dict in self.record_value ])
+
+    def write_records(self):
+        if len(self.record_value) == 0:
+            return
+
+        # The validation which is not finished is left empty.
+        for info_dict in self.record_value:
+            if info_dict.get("valid_loss", "") is None:
+                info_dict.update({"valid_loss":"", "valid_acc":""})
+
+        dataframe = pd.DataFrame(self.record_value)
+        if self.start_write_log:
+            dataframe.to_csv(self.record_file, mode='a', header=False, index=False)
+        else:
+            # with open(self.record_file, "w") as f:
+            #     f.truncate()
+            dataframe.to_csv(self.record_file, header=True, index=False)
+            self.start_write_log = True
+        self.record_value.clear()
+
+    def record_valid(self, valid_dict, training_point):
+        """Merge the result of an asynchronous validation into the record of its training point.
+        """
+        current_epoch, current_iter, _ = training_point
+        if self.record_file is not None:
+            for info_dict in self.record_value:
+                if info_dict["epoch"] == current_epoch + 1 and info_dict["iter"] == current_iter + 1:
+                    info_dict.update(valid_dict)
+
+            print("Device:{0}, epoch:{1}, iter:{2}, {3}".format(self.device, current_epoch + 1, current_iter + 1,
+                  utils.dict_to_params_str(valid_dict, auto=False, sep=", ")))
+            if not self.has_pending_valid():
+                self.write_records()
 
     def _update(self):
         # Do not use any var which will be updated by main process, such as self.trainer.training_point.
@@ -102,9 +132,16 @@ class Reporter():
             try:
                 res = self.queue.get()
                 if res is None:
+                    if self.record_file is not None:
+                        self.write_records()
                     self.bar.finish()
                     break
 
+                if res[0] == "valid":
+                    _, training_point, valid_dict = res
+                    self.record_valid(valid_dict, training_point)
+                    continue
+
                 snapshot, training_point, current_lr = res
                 current_epoch, current_iter, num_batchs_train = training_point
                 update_iters = current_epoch * num_batchs_train + current_iter + 1
@@ -120,10 +157,27 @@ class Reporter():
                     traceback.print_exc()
                 sys.exit(1)
 
-    def update(self, snapshot:dict):
+    def update(self, snapshot:dict, training_point=None, current_lr=None):
+        """
+        @training_point, current_lr: the ones of a former iter whose snapshot is delayed (see sync_free of
+                                     SimpleTrainer). Default is the current ones.
+        """
         # One update calling and one using of self.trainer.training_point and current_lr.
-        current_lr = self.optimizer.state_dict()['param_groups'][0]['lr']
-        self.queue.put((snapshot, self.trainer.training_point, current_lr))
+        if training_point is None:
+            training_point = self.trainer.training_point
+        if current_lr is None:
+            # Read the lr directly rather than copying all of the states by optimizer.state_dict().
+            current_lr = self.optimizer.param_groups[0]['lr']
+        self.queue.put((snapshot, training_point, current_lr))
+
+    def update_valid(self, training_point, valid_loss, valid_acc):
+        """The result of AsyncValidator, which is merged into the snapshot of training_point (valid_loss is None).
+        The valid_loss and valid_acc are None for a failed validation and valid_acc is None without 
+        compute_valid_accuracy, which are left empty.
+        """
+        valid_dict = {"valid_loss":"{0:.6f}".format(valid_loss) if valid_loss is not None else "",
+                      "valid_acc":"{0:.2f}".format(valid_acc*100) if valid_acc is not None else ""}
+        self.queue.put(("valid", training_point, valid_dict))
 
     def finish(self):
         self.queue.put(None)
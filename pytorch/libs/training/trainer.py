@@ -7,6 +7,7 @@ import logging
 import math
 import time
 import traceback
+import contextlib
 import progressbar
 import pandas as pd
 import numpy as np
@@ -15,8 +16,12 @@ import torch
 from .reporter import Reporter
 from .lr_scheduler import LRSchedulerWrapper
 from .lr_finder import for_lr_finder
+from .checkpoint import AsyncCheckpointSaver, get_checkpoint_path, get_rng_state, set_rng_state
+from .checkpoint import get_numpy_rng_state, set_numpy_rng_state
+from .validator import AsyncValidator
 
 import libs.support.utils as utils
+from libs.egs.egs import DevicePrefetcher
 
 # Wrap stderr before logger init.
 progressbar.streams.wrap_stderr()
@@ -40,6 +45,7 @@ Package(
         model_dir:str
         exist_model:str
         start_epoch:int
+        start_iter:int
         epochs:int
         ...
         }
@@ -55,7 +61,9 @@ class _BaseTrainer():
         default_params = {"model_dir":"", "model_blueprint":"", "exist_model":"", "start_epoch":0, "epochs":10, 
                           "use_gpu":True, "gpu_id":"", "benchmark":True, "max_change":10.0, 
                           "compute_accuracy":True, "compute_valid_accuracy":True, "compute_one_batch_valid":True,
-                          "suffix":"params"}
+                          "suffix":"params", "device_prefetch":False, "use_amp":False, "accumulation_steps":1,
+                          "start_iter":0, "checkpoint_interval_iters":0, "keep_checkpoints":2, "async_validation":False,
+                          "sync_free":False}
 
         elements, params = package
         self.elements = utils.assign_params_dict(default_elements, elements)
@@ -72,7 +80,29 @@ class _BaseTrainer():
         self.params["start_epoch"] = max(0, self.params["start_epoch"])
 
         self.stop_early = stop_early # To do.
-        self.training_point = (self.params["start_epoch"], 0, self.elements["data"].num_batch_train)
+        # See init_training.
+        self.use_amp = False
+        self.scaler = None
+        # See sync_free of SimpleTrainer.run.
+        self.grad_norm = None
+        self.pending_records = []
+
+        # An optimizer step is made of accumulation_steps batches (micro-batches) of loader, and the iters of 
+        # training_point are the optimizer steps.
+        if self.params["accumulation_steps"] < 1:
+            raise ValueError("Expected accumulation_steps >= 1, but got {0}.".format(self.params["accumulation_steps"]))
+        num_steps = self.elements["data"].num_batch_train // self.params["accumulation_steps"]
+        if num_steps <= 0:
+            raise ValueError("Expected num_batch of trainset {0} >= accumulation_steps {1}.".format(
+                             self.elements["data"].num_batch_train, self.params["accumulation_steps"]))
+        self.training_point = (self.params["start_epoch"], 0, num_steps)
+
+        # The report interval of Reporter (which is created on the main rank only), and every rank materializes the
+        # records of sync_free training by it, see is_sync_point().
+        if self.params.get("report_times_every_epoch") is not None:
+            self.report_interval_iters = max(1, num_steps // self.params["report_times_every_epoch"])
+        else:
+            self.report_interval_iters = self.params.get("report_interval_iters", 100)
 
     def select_device(self):
         return utils.select_model_device(self.elements["model"], self.params["use_gpu"], 
@@ -91,7 +121,16 @@ class _BaseTrainer():
             utils.write_nnet_config(model_blueprint, model_creation, "{0}/config/nnet.config".format(model_dir))
 
         ## Recover checkpoint | Tansform learning | Initialize parametes 
-        if start_epoch > 0:
+        checkpoint = None
+        if self.params["start_iter"] > 0:
+            # Recover all of the training states from an iteration-level checkpoint, see save_checkpoint().
+            checkpoint_path = get_checkpoint_path(model_dir, start_epoch + 1, self.params["start_iter"])
+            if utils.is_main_training(): logger.info("Recover training from {0}.".format(checkpoint_path))
+            # The checkpoint is written by this trainer and has python objects (such as the python RNG state and the
+            # state of lr_scheduler), which are rejected by weights_only (the default of torch >= 2.6).
+            checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+            model.load_state_dict(checkpoint["model"])
+        elif start_epoch > 0:
             # This train_stage is equal to number of completed epoch
             if utils.is_main_training(): logger.info("Recover training from {0} epoch.".format(start_epoch))
             model.load_state_dict(torch.load('{0}/{1}.{2}'.format(model_dir, start_epoch, suffix), 
@@ -115,8 +154,10 @@ class _BaseTrainer():
             else:
                 # Broadcast optimizer state.
                 hvd.broadcast_optimizer_state(self.elements["optimizer"], root_rank=0)
+                # The grads are allreduced once every accumulation_steps backward passes.
                 self.elements["optimizer"] = hvd.DistributedOptimizer(self.elements["optimizer"], 
-                                             named_parameters=self.elements["model"].named_parameters())
+                                             named_parameters=self.elements["model"].named_parameters(),
+                                             backward_passes_per_step=self.params["accumulation_steps"])
 
         ## Select device
         model = self.select_device()
@@ -128,6 +169,70 @@ class _BaseTrainer():
             self.elements["model"] = model.module
             self.elements["model_forward"] = model
 
+        # Mixed-precision training by autocast and a dynamic loss scaler, which is available for CUDA only.
+        self.use_amp = self.params["use_amp"] and utils.get_device(model).type == "cuda"
+        if self.params["use_amp"] and not self.use_amp and utils.is_main_training():
+            logger.warning("The mixed-precision training is only available for CUDA, so use float32.")
+        self.scaler = torch.cuda.amp.GradScaler() if self.use_amp else None
+
+        if checkpoint is not None:
+            # The optimizer state is loaded to the device of parameters, so load it after selecting device.
+            self.load_checkpoint(checkpoint)
+
+    def get_checkpoint(self, this_batch):
+        """Return the full training state after this_batch (0-based) of loader is trained in this epoch, see
+        AsyncCheckpointSaver.
+        """
+        model = self.elements["model"]
+        optimizer = self.elements["optimizer"]
+        lr_scheduler = self.elements["lr_scheduler"]
+        data = self.elements["data"]
+
+        checkpoint = {"epoch":self.training_point[0], "iter":self.training_point[1] + 1,
+                      "model":model.state_dict(), "optimizer":optimizer.state_dict(), "rng":get_rng_state(),
+                      # The margin of MarginSoftmaxLoss which is updated by model.step().
+                      "lambda_factor":{ name:module.lambda_factor for name, module in model.named_modules() 
+                                        if hasattr(module, "lambda_factor") }}
+
+        if lr_scheduler is not None and hasattr(lr_scheduler, "state_dict"):
+            checkpoint["lr_scheduler"] = lr_scheduler.state_dict()
+        if self.scaler is not None:
+            checkpoint["scaler"] = self.scaler.state_dict()
+        if hasattr(data, "state_dict"):
+            # The position of sampler, see BaseBunch.state_dict().
+            checkpoint["data"] = data.state_dict(this_batch)
+        if getattr(data, "wav_aug", None) is not None:
+            # The noises of waveform egs are drawn by the own random state of BatchWavAugment.
+            checkpoint["rng"]["wav_aug"] = get_numpy_rng_state(data.wav_aug.random_state)
+
+        return checkpoint
+
+    def load_checkpoint(self, checkpoint:dict):
+        model = self.elements["model"]
+        lr_scheduler = self.elements["lr_scheduler"]
+        data = self.elements["data"]
+
+        self.elements["optimizer"].load_state_dict(checkpoint["optimizer"])
+        if "lr_scheduler" in checkpoint and lr_scheduler is not None:
+            lr_scheduler.load_state_dict(checkpoint["lr_scheduler"])
+        if "scaler" in checkpoint and self.scaler is not None:
+            self.scaler.load_state_dict(checkpoint["scaler"])
+
+        modules = dict(model.named_modules())
+        for name, lambda_factor in checkpoint["lambda_factor"].items():
+            modules[name].lambda_factor = lambda_factor
+
+        # The loaders do not draw from the global RNG (see BaseBunch), so it could be restored before creating them.
+        set_rng_state(checkpoint["rng"])
+        if "wav_aug" in checkpoint["rng"] and getattr(data, "wav_aug", None) is not None:
+            set_numpy_rng_state(data.wav_aug.random_state, checkpoint["rng"]["wav_aug"])
+            data.wav_aug.split_random_state()
+
+        if "data" in checkpoint and hasattr(data, "load_state_dict"):
+            data.load_state_dict(checkpoint["data"])
+            # The data state is the next epoch if the checkpoint is at the end of an epoch.
+            self.params["start_epoch"] = checkpoint["data"]["epoch"]
+
     def save_model(self, from_epoch=True):
         if from_epoch:
             model_name = self.training_point[0]+1
@@ -158,8 +263,45 @@ class SimpleTrainer(_BaseTrainer):
     def __init__(self, *args, **kwargs):
         super(SimpleTrainer, self).__init__(*args, **kwargs)
 
-    def train_one_batch(self, batch):
+    def prepare_inputs(self, inputs, training=True, generator=None):
+        """Apply the on-device transforms of data bunch to a batch after transferring it to the device in order:
+        segment augmentation (train only) -> features extraction -> batch augmentation (train only).
+        @generator: the torch.Generator for the dither of features extraction, see AsyncValidator.
+        """
+        model = self.elements["model"]
+        data = self.elements["data"]
+
+        if not isinstance(inputs, torch.Tensor):
+            return inputs
+
+        # The float16 egs (see ShardEgs) are converted to float32 after transferring to the device.
+        if inputs.dtype == torch.float16:
+            inputs = utils.to_device(model, inputs).float()
+
+        # The waveform egs, see BaseBunch.get_bunch_from_wav_datadir.
+        wav_aug = getattr(data, "wav_aug", None)
+        batch_features = getattr(data, "batch_features", None)
+        if training and wav_aug is not None:
+            inputs = wav_aug(utils.to_device(model, inputs))
+        if batch_features is not None:
+            inputs = batch_features(utils.to_device(model, inputs), generator=generator)
+
+        # The batch augmentation, such as batch_specaugment, is applied on the device.
+        batch_aug = getattr(data, "batch_aug", None)
+        if training and batch_aug is not None:
+            inputs = batch_aug(utils.to_device(model, inputs))
+
+        return inputs
+
+    def train_one_batch(self, batch, micro_batch=0, num_micro_batches=1, sync=True):
         """A normal training core without fetching data from iterator.
+        @micro_batch, num_micro_batches: the grads of num_micro_batches batches are accumulated for one optimizer
+        step, which zeros the grads at the first micro-batch and steps at the last one.
+        @sync: if False, return the loss and accuracy as device tensors and keep the grad_norm in self.grad_norm
+               without checking nan (the inf/nan grads are zeroed instead), so there is no host sync in this batch,
+               see materialize_records(). Unlike the synchronous nan check, the optimizer still steps with the 
+               zeroed grads (momentum and weight decay change the weights), but the training stops at the next
+               sync point before any model or checkpoint is saved.
         """
         model = self.elements["model"]
         model_forward = self.elements["model_forward"]
@@ -169,38 +311,132 @@ class SimpleTrainer(_BaseTrainer):
             model.train()
 
         inputs, targets = batch
-        optimizer.zero_grad()
+        inputs = self.prepare_inputs(inputs, training=True)
+        if micro_batch == 0:
+            optimizer.zero_grad()
 
-        loss = model.get_loss(model_forward(inputs), targets)
-        loss.backward()
+        last_micro_batch = micro_batch == num_micro_batches - 1
+
+        # Do not allreduce the grads of DDP until the last micro-batch.
+        if not last_micro_batch and isinstance(model_forward, torch.nn.parallel.DistributedDataParallel):
+            sync_context = model_forward.no_sync()
+        else:
+            sync_context = contextlib.nullcontext()
+
+        with sync_context:
+            # The MarginSoftmaxLoss and StatisticsPooling are kept in float32 by themselves with autocast.
+            with torch.cuda.amp.autocast(enabled=self.use_amp):
+                loss = model.get_loss(model_forward(inputs), targets)
+
+            # The grads are the mean of micro-batches, as the ones of a whole batch.
+            scaled_loss = loss / num_micro_batches if num_micro_batches > 1 else loss
+            if self.use_amp:
+                self.scaler.scale(scaled_loss).backward()
+            else:
+                scaled_loss.backward()
         loss.detach() # For safe.
 
+        accuracy = None
+        if self.params["compute_accuracy"]:
+            if sync:
+                accuracy = model.compute_accuracy(model.get_posterior(), targets)
+            else:
+                accuracy = model.compute_accuracy_tensor(model.get_posterior(), targets)
+
+        loss = loss.item() if sync else loss.detach()
+
+        if not last_micro_batch:
+            return loss, accuracy
+
+        # Reference:https://github.com/horovod/horovod/blob/master/horovod/torch/__init__.py:420~423.
+        # Synchronize the grad for grad_norm (or unscaling grad) when using horovod.
+        synchronized = utils.use_horovod() and (self.params["max_change"] > 0 or self.use_amp)
+        if synchronized: optimizer.synchronize()
+
+        # The grads should be unscaled before clipping, so max_change is the same as float32 training.
+        if self.use_amp: self.scaler.unscale_(optimizer)
+
+        self.grad_norm = None
         if self.params["max_change"] > 0:
-            # Reference:https://github.com/horovod/horovod/blob/master/horovod/torch/__init__.py:420~423.
-            # Synchronize the grad for grad_norm when using horovod.
-            if utils.use_horovod(): optimizer.synchronize()
             grad_norm = torch.nn.utils.clip_grad_norm_(model.parameters(), self.params["max_change"])
+            self.grad_norm = grad_norm.detach()
 
-            if math.isnan(grad_norm):
+            # The inf/nan grads are expected sometimes with AMP, and the scaler skips this step and reduces its scale.
+            if sync and math.isnan(grad_norm) and not self.use_amp:
                 raise RuntimeError('There is nan problem in iter/epoch: {0}/{1}'.format(self.training_point[1]+1, self.training_point[0]+1))
-            else:
-                if utils.use_horovod():
-                    with optimizer.skip_synchronize():
-                        optimizer.step()
-                else:
-                    optimizer.step()
+            elif not sync and not self.use_amp:
+                # The nan is found later by materialize_records(), so zero the inf/nan grads on device (without a
+                # host sync) to keep the weights finite until then. Skipping the step would need a host sync.
+                # The grads are flattened to mask them by a few kernels rather than one per parameter, and they are
+                # masked rather than multiplied by the finite flag, for nan * 0 = nan.
+                grads = [ param.grad for param in model.parameters() if param.grad is not None ]
+                flat_grads = torch.cat([ grad.reshape(-1) for grad in grads ])
+                flat_grads.masked_fill_(~torch.isfinite(self.grad_norm), 0.)
+                torch._foreach_copy_(grads, [ flat_grad.view_as(grad) for flat_grad, grad in 
+                                              zip(flat_grads.split([ grad.numel() for grad in grads ]), grads) ])
+
+        if synchronized:
+            with optimizer.skip_synchronize():
+                self.optimizer_step()
+        else:
+            self.optimizer_step()
+
+        return loss, accuracy
+
+    def optimizer_step(self):
+        optimizer = self.elements["optimizer"]
+
+        if self.use_amp:
+            # It skips optimizer.step() if the unscaled grads have inf/nan.
+            self.scaler.step(optimizer)
+            self.scaler.update()
         else:
             optimizer.step()
 
-        accuracy = model.compute_accuracy(model.get_posterior(), targets) if self.params["compute_accuracy"] else None
+    def get_current_lr(self):
+        # Read the lr directly, where optimizer.state_dict() copies all of the states for every calling.
+        return self.elements["optimizer"].param_groups[0]["lr"]
+
+    def is_sync_point(self, training_point):
+        """The iters where the pending records of sync_free training are materialized, i.e. the report iters of
+        reporter, which are the same for all ranks, so a nan is found at the same iter by every rank.
+        """
+        return training_point[1] % self.report_interval_iters == 0 or training_point[1] + 1 == training_point[2]
+
+    def materialize_records(self):
+        """Copy the losses, accuracies and grad norms of the pending iters of sync_free training to host together
+        and check nan of them.
+        @return: a list of (training_point, current_lr, loss, accuracy) with float values
+        """
+        records, self.pending_records = self.pending_records, []
+        if len(records) == 0:
+            return []
+
+        def to_host(values):
+            if isinstance(values[0], torch.Tensor):
+                return torch.stack(values).float().cpu().tolist()
+            return list(values)
+
+        training_points, current_lrs, losses, accuracies, grad_norms = zip(*records)
+        losses, accuracies, grad_norms = to_host(losses), to_host(accuracies), to_host(grad_norms)
+
+        if not self.use_amp:
+            for training_point, grad_norm in zip(training_points, grad_norms):
+                if grad_norm is not None and math.isnan(grad_norm):
+                    raise RuntimeError('There is nan problem in iter/epoch: {0}/{1}'.format(training_point[1]+1, training_point[0]+1))
 
-        return loss.item(), accuracy
+        return list(zip(training_points, current_lrs, losses, accuracies))
 
-    def compute_validation(self, data_loader):
+    def compute_validation(self, data_loader, model=None, generator=None):
         """A normal evaluation core.
+        @model: a copy of model to evaluate, such as the snapshot of AsyncValidator. Default is the training model.
+        @generator: the torch.Generator of the random ops (dither) in validation. Default is the global RNG.
         """
-        model = self.elements["model"]
-        model_forward = self.elements["model_forward"]
+        if model is None:
+            model = self.elements["model"]
+            model_forward = self.elements["model_forward"]
+        else:
+            model_forward = model
         train_status = model.training # Record status.
         model.eval()
 
@@ -211,7 +447,9 @@ class SimpleTrainer(_BaseTrainer):
         with torch.no_grad():
             for this_data in data_loader:
                 inputs, targets = this_data
-                loss += model.get_loss(model_forward(inputs), targets).item() * len(targets)
+                inputs = self.prepare_inputs(inputs, training=False, generator=generator)
+                with torch.cuda.amp.autocast(enabled=self.use_amp):
+                    loss += model.get_loss(model_forward(inputs), targets).item() * len(targets)
                 num_samples += len(targets)
 
                 if self.params["compute_valid_accuracy"]:
@@ -247,35 +485,121 @@ class SimpleTrainer(_BaseTrainer):
 
             if utils.is_main_training(): logger.info("Training will run for {0} epochs.".format(epochs))
 
-            for this_epoch in range(start_epoch, epochs):
-                for this_iter, batch in enumerate(data.train_loader, 0):
-                    self.training_point = (this_epoch, this_iter, data.num_batch_train) # It is important for reporter.
+            # Copy the next batch to GPU on a side stream while computing this one (it does nothing for CPU).
+            train_loader = data.train_loader
+            if self.params["device_prefetch"]:
+                train_loader = DevicePrefetcher(data.train_loader, utils.get_device(model))
 
-                    if model.use_step:
-                        model.step(*self.training_point)
+            # Gradient accumulation, see _BaseTrainer.__init__.
+            num_micro_batches = self.params["accumulation_steps"]
+            num_steps = data.num_batch_train // num_micro_batches
 
-                    if lr_scheduler is not None:
-                        # It is not convenient to wrap lr_scheduler (doing).
-                        if isinstance(lr_scheduler, LRSchedulerWrapper):
-                            lr_scheduler.step(self.training_point)
-                        else:
-                            # For some pytorch lr_schedulers, but it is not available for all.
-                            lr_scheduler.step(this_epoch)
+            # Save the full training states every checkpoint_interval_iters optimizer steps by a background thread,
+            # and recover them by --train-stage=epoch.iter of launcher.
+            checkpoint_interval_iters = self.params["checkpoint_interval_iters"]
+            checkpoint_saver = None
+            if checkpoint_interval_iters > 0 and utils.is_main_training():
+                checkpoint_saver = AsyncCheckpointSaver(self.params["model_dir"], keep=self.params["keep_checkpoints"])
 
-                    loss, acc = self.train_one_batch(batch)
+            # Keep the loss, accuracy and grad norm of every iter as device tensors and materialize them on the report
+            # iters only, so the other iters do not wait for GPU by .item() (the nan is found a bit later).
+            sync_free = self.params["sync_free"]
 
-                    # For multi-GPU training.
-                    if utils.is_main_training():
-                        if data.valid_loader and self.reporter.is_report(self.training_point):
-                            valid_loss, valid_acc = self.compute_validation(data.valid_loader)
-                            snapshot = {"train_loss":"{0:.6f}".format(loss), "valid_loss":"{0:.6f}".format(valid_loss), 
-                                        "train_acc":"{0:.2f}".format(acc*100), "valid_acc":"{0:.2f}".format(valid_acc*100)}
+            # Validate a snapshot of weights in background rather than stopping training, see AsyncValidator.
+            validator = None
+            if self.params["async_validation"] and data.valid_loader and utils.is_main_training():
+                validator = AsyncValidator(self)
+
+            for this_epoch in range(start_epoch, epochs):
+                data.set_epoch(this_epoch)
+                step_loss, step_acc = 0., 0.
+                # The start_iter > 0 if the epoch is resumed from a data state, see BaseBunch.load_state_dict().
+                for this_batch, batch in enumerate(train_loader, getattr(data, "start_iter", 0)):
+                    # The model.step, lr_scheduler and reporter count the optimizer steps rather than batches.
+                    this_iter, micro_batch = divmod(this_batch, num_micro_batches)
+                    if this_iter >= num_steps:
+                        # The tail batches could not make a whole step.
+                        break
+                    self.training_point = (this_epoch, this_iter, num_steps) # It is important for reporter.
+
+                    if micro_batch == 0:
+                        if model.use_step:
+                            model.step(*self.training_point)
+
+                        if lr_scheduler is not None:
+                            # It is not convenient to wrap lr_scheduler (doing).
+                            if isinstance(lr_scheduler, LRSchedulerWrapper):
+                                lr_scheduler.step(self.training_point)
+                            else:
+                                # For some pytorch lr_schedulers, but it is not available for all.
+                                lr_scheduler.step(this_epoch)
+
+                        step_loss, step_acc = 0., 0.
+
+                    loss, acc = self.train_one_batch(batch, micro_batch, num_micro_batches, sync=not sync_free)
+
+                    if num_micro_batches > 1:
+                        # Report the mean of micro-batches after the optimizer step.
+                        step_loss += loss / num_micro_batches
+                        step_acc += acc / num_micro_batches if acc is not None else 0.
+                        if micro_batch < num_micro_batches - 1:
+                            continue
+                        loss, acc = step_loss, step_acc
+
+                    # The model of the last iter is saved by save_model().
+                    save_checkpoint = checkpoint_saver is not None and \
+                                      (this_iter + 1) % checkpoint_interval_iters == 0 and this_iter + 1 < num_steps
+
+                    if sync_free:
+                        self.pending_records.append((self.training_point, self.get_current_lr(), loss, acc,
+                                                     self.grad_norm))
+                        # Check nan before saving a checkpoint, so a broken model is never saved.
+                        if save_checkpoint or self.is_sync_point(self.training_point):
+                            records = self.materialize_records()
                         else:
+                            records = []
+                    else:
+                        records = [(self.training_point, self.get_current_lr(), loss, acc)]
+
+                    # For multi-GPU training.
+                    if utils.is_main_training() and len(records) > 0:
+                        # The records of the former iters (sync_free) are reported without validation.
+                        for training_point, current_lr, loss, acc in records[:-1]:
                             snapshot = {"train_loss":"{0:.6f}".format(loss), "valid_loss":"",
                                         "train_acc":"{0:.2f}".format(acc*100), "valid_acc":""}
+                            self.reporter.update(snapshot, training_point, current_lr)
 
-                    if utils.is_main_training(): self.reporter.update(snapshot)
+                        _, current_lr, loss, acc = records[-1]
+                        snapshot = {"train_loss":"{0:.6f}".format(loss), "valid_loss":"",
+                                    "train_acc":"{0:.2f}".format(acc*100), "valid_acc":""}
+                        if data.valid_loader and self.reporter.is_report(self.training_point):
+                            if validator is not None:
+                                # The valid_loss is pending and the result is merged by reporter when it is ready.
+                                # It is skipped if the last validation is still running.
+                                if validator.submit(data.valid_loader, self.training_point):
+                                    snapshot.update({"valid_loss":None, "valid_acc":None})
+                            else:
+                                valid_loss, valid_acc = self.compute_validation(data.valid_loader)
+                                snapshot.update({"valid_loss":"{0:.6f}".format(valid_loss), 
+                                                 "valid_acc":"{0:.2f}".format(valid_acc*100)})
+                        if isinstance(train_loader, DevicePrefetcher):
+                            # The time (ms) of copying a batch to device and waiting for the loader.
+                            snapshot.update({"copy_ms":"{0:.2f}".format(train_loader.last_copy_time),
+                                             "stall_ms":"{0:.2f}".format(train_loader.last_stall_time)})
+
+                        self.reporter.update(snapshot, self.training_point, current_lr)
+
+                    if validator is not None:
+                        valid_result = validator.get_result()
+                        if valid_result is not None: self.reporter.update_valid(*valid_result)
+
+                    if save_checkpoint:
+                        checkpoint_saver.save(self.get_checkpoint(this_batch), this_epoch + 1, this_iter + 1)
                 if utils.is_main_training(): self.save_model()
+            if checkpoint_saver is not None: checkpoint_saver.wait()
+            if validator is not None:
+                valid_result = validator.get_result(wait=True)
+                if valid_result is not None: self.reporter.update_valid(*valid_result)
             if utils.is_main_training(): self.reporter.finish()
         except BaseException as e:
                 if utils.use_ddp(): utils.cleanup_ddp()
@@ -0,0 +1,105 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import copy
+import logging
+import threading
+import contextlib
+import torch
+
+import libs.support.utils as utils
+
+# Logger
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class AsyncValidator():
+    """Compute the validation on a snapshot of model weights by a background thread (on a side CUDA stream for GPU),
+    so training does not stop for the valid batches and the eval/train toggles of model. The result is taken by
+    get_result() when it is ready and merged into Reporter by its training point.
+
+    The snapshot is a copy of model on the same device, which costs the memory of another model (without grads and
+    optimizer states). If the last validation has not finished yet, a new one is skipped rather than queued.
+
+    The thread does not touch the global RNG which is used by training, so training is reproducible: the valid
+    loader has its own generator (see BaseBunch) and the random ops of validation use self.generator.
+    """
+    def __init__(self, trainer):
+        self.trainer = trainer
+        model = trainer.elements["model"]
+
+        # The outputs which are kept by modules (such as the posterior of loss) are not leaf tensors and could not be
+        # deep-copied, so they are detached in the copy.
+        memo = {}
+        for module in model.modules():
+            for value in module.__dict__.values():
+                if isinstance(value, torch.Tensor) and not value.is_leaf:
+                    memo[id(value)] = value.detach()
+
+        self.model = copy.deepcopy(model, memo)
+        self.model.eval()
+        for param in self.model.parameters():
+            param.requires_grad_(False)
+
+        device = utils.get_device(model)
+        self.stream = torch.cuda.Stream(device=device) if device.type == "cuda" else None
+        self.generator = torch.Generator(device=device)
+        self.generator.manual_seed(getattr(trainer.elements["data"], "seed", 1024))
+
+        self.thread = None
+        self.result = None
+
+    def is_busy(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def submit(self, data_loader, training_point):
+        """Copy the current weights to the snapshot and start to validate it. Return False if it is busy.
+        """
+        if self.is_busy():
+            return False
+
+        # The copy is in the stream of training, so it is done before the next optimizer step changes weights.
+        state_dict = self.trainer.elements["model"].state_dict()
+        with torch.no_grad():
+            for name, tensor in self.model.state_dict().items():
+                tensor.copy_(state_dict[name])
+
+        copied = None
+        if self.stream is not None:
+            copied = torch.cuda.Event()
+            copied.record()
+
+        self.thread = threading.Thread(target=self._validate, args=(data_loader, training_point, copied), daemon=True)
+        self.thread.start()
+        return True
+
+    def _validate(self, data_loader, training_point, copied):
+        try:
+            stream_context = torch.cuda.stream(self.stream) if self.stream is not None else contextlib.nullcontext()
+            with stream_context:
+                if copied is not None:
+                    self.stream.wait_event(copied)
+                valid_loss, valid_acc = self.trainer.compute_validation(data_loader, model=self.model, 
+                                                                        generator=self.generator)
+                if self.stream is not None:
+                    self.stream.synchronize()
+            self.result = (training_point, valid_loss, valid_acc)
+        except BaseException:
+            logger.exception("Failed to compute validation of {0}.".format(training_point))
+            # The failed result clears the pending valid of reporter, which holds the records until it is merged.
+            self.result = (training_point, None, None)
+
+    def get_result(self, wait=False):
+        """Return (training_point, valid_loss, valid_acc) once when the validation is finished, else None.
+        The valid_loss and valid_acc are None if the validation failed.
+        """
+        if wait and self.thread is not None:
+            self.thread.join()
+
+        if self.is_busy() or self.result is None:
+            return None
+
+        result, self.result = self.result, None
+        return result
@@ -38,6 +38,10 @@ def get_args():
     parser.add_argument("--chunk-size", type=int, default=200,
                     help="A fixed chunk size.")
 
+    parser.add_argument("--max-chunk-size", type=int, default=-1,
+                    help="If > chunk-size, the length of train chunks is random in [chunk-size, max-chunk-size] "
+                         "which could be batched by max_batch_frames of BaseBunch.")
+
     parser.add_argument("--valid-sample", type=str, action=kaldi_common.StrToBoolAction,
                     default=True, choices=["true", "false"],
                     help="Get the valid samples or not.")
@@ -76,6 +80,10 @@ def get_args():
     parser.add_argument("--valid-scale", type=float, default=1.5,
                     help="The scale for --valid-chunk-num:-1.")
 
+    parser.add_argument("--egs-index", type=str, action=kaldi_common.StrToBoolAction,
+                    default=True, choices=["true", "false"],
+                    help="Save a pre-parsed .npy index next to every egs csv to be memory-mapped by ChunkEgs.")
+
     # Main
     parser.add_argument("data_dir", metavar="data-dir", type=str, help="A kaldi datadir.")
     parser.add_argument("save_dir", metavar="save-dir", type=str, help="The save dir of mapping file of chunk-egs.")
@@ -102,7 +110,8 @@ def get_chunk_egs(args):
 
     logger.info("Generate chunk egs with chunk-size={0}.".format(args.chunk_size))
     trainset_samples = ChunkSamples(trainset, args.chunk_size, chunk_type=args.sample_type,
-                            chunk_num_selection=args.chunk_num, scale=args.scale, overlap=args.overlap, drop_last=args.drop_last)
+                            chunk_num_selection=args.chunk_num, scale=args.scale, overlap=args.overlap, drop_last=args.drop_last,
+                            max_chunk_size=args.max_chunk_size)
 
     if args.valid_sample:
         valid_sample = ChunkSamples(valid, args.chunk_size, chunk_type=args.valid_sample_type, 
@@ -112,10 +121,10 @@ def get_chunk_egs(args):
     if not os.path.exists("{0}/info".format(args.save_dir)):
         os.makedirs("{0}/info".format(args.save_dir))
 
-    trainset_samples.save("{0}/train.egs.csv".format(args.save_dir))
+    trainset_samples.save("{0}/train.egs.csv".format(args.save_dir), index=args.egs_index)
 
     if args.valid_sample:
-        valid_sample.save("{0}/valid.egs.csv".format(args.save_dir))
+        valid_sample.save("{0}/valid.egs.csv".format(args.save_dir), index=args.egs_index)
 
     with open("{0}/info/num_frames".format(args.save_dir),'w') as writer:
         writer.write(str(trainset.num_frames))
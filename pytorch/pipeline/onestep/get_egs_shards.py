@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+
+import sys
+import os
+import logging
+import argparse
+import traceback
+
+sys.path.insert(0, 'subtools/pytorch')
+
+from libs.egs.egs_shards import write_egs_shards, get_shards_dir
+
+"""Materialize the chunk egs of egsdir to shuffled shards which could be read sequentially by ShardEgs.
+"""
+
+logger = logging.getLogger('libs')
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setLevel(logging.INFO)
+formatter = logging.Formatter("%(asctime)s [%(pathname)s:%(lineno)s - "
+                              "%(funcName)s - %(levelname)s ]\n#### %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+def get_args():
+    # Start
+    parser = argparse.ArgumentParser(
+        description="""Write shards of chunk egs.""",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        conflict_handler='resolve')
+
+    # Options
+    parser.add_argument("--shard-size", type=int, default=256,
+                    help="The size (MB) of every shard.")
+
+    parser.add_argument("--seed", type=int, default=1024,
+                    help="The seed to shuffle egs before sharding.")
+
+    parser.add_argument("--dtype", type=str, default="float32",
+                    choices=["float32", "float16", "int8"],
+                    help="The dtype to store egs. The int8 egs are quantized by an affine (min, scale) per chunk.")
+
+    # Main
+    parser.add_argument("egs_dir", metavar="egs-dir", type=str, help="The egsdir with train.egs.csv.")
+
+    # End
+    print(' '.join(sys.argv))
+    args = parser.parse_args()
+
+    return args
+
+
+def get_egs_shards(args):
+    train_csv = "{0}/train.egs.csv".format(args.egs_dir)
+
+    if not os.path.exists(train_csv):
+        raise ValueError("Expected {0} to exist.".format(train_csv))
+
+    logger.info("Write shards of {0} to {1}".format(train_csv, get_shards_dir(train_csv)))
+    write_egs_shards(train_csv, shard_size=args.shard_size, seed=args.seed, dtype=args.dtype)
+
+    logger.info("Generate shards of egs from {0} done.".format(args.egs_dir))
+
+def main():
+    args = get_args()
+
+    try:
+        get_egs_shards(args)
+    except BaseException as e:
+        # Look for BaseException so we catch KeyboardInterrupt, which is
+        # what we get when a background thread dies.
+        if not isinstance(e, KeyboardInterrupt):
+            traceback.print_exc()
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
@@ -14,10 +14,11 @@ fetures_exp=exp/features
 # Do vad and traditional cmn process
 nj=20
 cmn=true 
-compress=false # Should be false to make use of kaldi_io I/O
+compress=false # Compressed feats (CM, CM2 and CM3) could be read by kaldi_io, but only uncompressed ones are zero-copy with use_mmap.
 
 # Remove utts
 min_chunk=200
+max_chunk=-1 # If > min_chunk, get variable-length chunks with [min_chunk, max_chunk] frames for max_batch_frames in launcher.
 limit_utts=8
 
 # Get chunk egs
@@ -31,6 +32,11 @@ overlap=0.1
 valid_sample_type="every_utt" # With split type [--total-spk] and sample type [every_utt], we will get enough spkers as more
                               # as possible and finally we get valid_num_utts * valid_chunk_num = 1024 * 2 = 2048 valid chunks.
 valid_chunk_num=2
+egs_index=true # Save a pre-parsed .npy index of egs csv for ChunkEgs.
+
+# Write shards of egs (stage 3, set endstage=3 to run it) and use them by egs_type=shard in launcher.
+shard_size=256 # MB
+shard_dtype=float32 # float32 | float16 | int8. Use float16 or int8 to cut the disk bandwidth and page cache by 2x or 4x.
 
 . subtools/path.sh
 . subtools/parse_options.sh
@@ -75,6 +81,7 @@ if [[ $stage -le 2 && 2 -le $endstage ]];then
 
     python3 subtools/pytorch/pipeline/onestep/get_chunk_egs.py \
         --chunk-size=$min_chunk \
+        --max-chunk-size=$max_chunk \
         --valid-sample=$valid_sample \
         --valid-num-utts=$valid_num_utts \
         --valid-split-type=$valid_split_type \
@@ -84,7 +91,18 @@ if [[ $stage -le 2 && 2 -le $endstage ]];then
         --overlap=$overlap \
         --valid-chunk-num=$valid_chunk_num \
         --valid-sample-type=$valid_sample_type \
+        --egs-index=$egs_index \
         ${traindata}_nosil $egsdir || exit 1
 fi
 
+if [[ $stage -le 3 && 3 -le $endstage ]];then
+    echo "$0: stage 3"
+    [ "$egsdir" == "" ] && echo "The egsdir is not specified." && exit 1
+
+    python3 subtools/pytorch/pipeline/onestep/get_egs_shards.py \
+        --shard-size=$shard_size \
+        --dtype=$shard_dtype \
+        $egsdir || exit 1
+fi
+
 exit 0
@@ -0,0 +1,9 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import os
+import sys
+
+# Import libs as the launchers do from subtools/pytorch.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,48 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import numpy as np
+import torch
+
+from libs.egs.augmentation import Cutout, SpecAugment, BatchSpecAugment
+
+
+def test_batch_cutout_random_holes():
+    """The batch cutout draws the number of holes like the per-sample one, which is checked by the masked ratio
+    of small holes (rarely overlapped). The ratio is biased low by 25% if the two axes draw their numbers alone.
+    """
+    np.random.seed(0)
+    torch.manual_seed(0)
+    aug = Cutout(frequency=0.1, frame=0.1, holes=4, random_holes=True)
+    num_samples = 4000
+
+    batch_ratios = (aug(torch.ones(num_samples, 100, 100)) == 0).float().mean(dim=(1, 2)).numpy()
+    sample_ratios = np.array([ (aug(np.ones((100, 100))) == 0).mean() for i in range(num_samples) ])
+
+    std_error = np.sqrt((batch_ratios.var() + sample_ratios.var()) / num_samples)
+    assert abs(batch_ratios.mean() - sample_ratios.mean()) < 5 * std_error
+
+
+def test_batch_specaugment_like_specaugment():
+    """Every sample of a batch gets its own masks and they are the same as SpecAugment in distribution, which is
+    checked by the masked ratio and the mean after the inverted scaling of frequency masks.
+    """
+    np.random.seed(0)
+    torch.manual_seed(0)
+    params = {"frequency":0.2, "frame":0.2, "rows":3, "cols":3, "random_rows":True, "random_cols":True}
+    num_samples = 4000
+
+    batch_outputs = BatchSpecAugment(**params)(torch.ones(num_samples, 40, 100))
+    assert len(torch.unique((batch_outputs == 0).view(num_samples, -1), dim=0)) > num_samples // 2
+
+    aug = SpecAugment(**params)
+    batch_ratios = (batch_outputs == 0).float().mean(dim=(1, 2)).numpy()
+    sample_ratios = np.array([ (aug(np.ones((40, 100))) == 0).mean() for i in range(num_samples) ])
+    std_error = np.sqrt((batch_ratios.var() + sample_ratios.var()) / num_samples)
+    assert abs(batch_ratios.mean() - sample_ratios.mean()) < 5 * std_error
+
+    batch_means = batch_outputs.mean(dim=(1, 2)).numpy()
+    sample_means = np.array([ aug(np.ones((40, 100))).mean() for i in range(num_samples) ])
+    std_error = np.sqrt((batch_means.var() + sample_means.var()) / num_samples)
+    assert abs(batch_means.mean() - sample_means.mean()) < 5 * std_error
@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import os
+import copy
+import numpy as np
+import pytest
+import torch
+
+import libs.support.kaldi_io as kaldi_io
+from libs.egs.egs import ChunkEgs, BaseBunch
+from libs.training.checkpoint import AsyncCheckpointSaver, copy_to_cpu, get_checkpoint_path, get_rng_state, set_rng_state
+
+
+def write_egs(tmp_path, num_utts=32, feat_dim=8, chunk=20):
+    rng = np.random.RandomState(0)
+    ark_path = str(tmp_path / "feats.ark")
+    with open(ark_path, 'wb') as writer:
+        for i in range(num_utts):
+            kaldi_io.write_mat(writer, rng.randn(50, feat_dim).astype(np.float32), key="utt{0}".format(i))
+
+    lines = ["utt-id ark-path start-position end-position class-label"]
+    for key, offset in kaldi_io.index_ark(ark_path):
+        i = int(key[3:])
+        lines.append("{0} {1}:{2} {3} {4} {5}".format(key, ark_path, offset, i % 10, i % 10 + chunk - 1, i % 4))
+
+    egs_csv = str(tmp_path / "train.egs.csv")
+    with open(egs_csv, 'w') as writer:
+        writer.write("\n".join(lines) + "\n")
+    return egs_csv
+
+
+def make_model():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Dropout(0.5), torch.nn.Linear(8 * 20, 4))
+    return model, torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+
+
+def train(bunch, model, optimizer, start_epoch, epochs, save_point=None):
+    """A loop like SimpleTrainer.run() which returns the checkpoint of save_point (epoch, iter) if it is given.
+    """
+    checkpoint = None
+    for epoch in range(start_epoch, epochs):
+        bunch.set_epoch(epoch)
+        for this_iter, (inputs, targets) in enumerate(bunch.train_loader, bunch.start_iter):
+            optimizer.zero_grad()
+            torch.nn.functional.cross_entropy(model(inputs), targets).backward()
+            optimizer.step()
+            if (epoch, this_iter) == save_point:
+                checkpoint = copy.deepcopy(copy_to_cpu({"model":model.state_dict(), "optimizer":optimizer.state_dict(),
+                                                        "rng":get_rng_state(), "data":bunch.state_dict(this_iter)}))
+    return checkpoint
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_resume_with_dropout(tmp_path, num_workers):
+    egs_csv = write_egs(tmp_path)
+    get_bunch = lambda: BaseBunch(ChunkEgs(egs_csv), batch_size=4, num_workers=num_workers, seed=7)
+
+    model, optimizer = make_model()
+    checkpoint = train(get_bunch(), model, optimizer, 0, 3, save_point=(1, 2))
+
+    # Recover as SimpleTrainer.init_training() does.
+    resumed_model, resumed_optimizer = make_model()
+    resumed_model.load_state_dict(checkpoint["model"])
+    resumed_optimizer.load_state_dict(checkpoint["optimizer"])
+    set_rng_state(checkpoint["rng"])
+    bunch = get_bunch()
+    bunch.load_state_dict(checkpoint["data"])
+    train(bunch, resumed_model, resumed_optimizer, checkpoint["data"]["epoch"], 3)
+
+    for param, resumed_param in zip(model.parameters(), resumed_model.parameters()):
+        assert torch.equal(param, resumed_param)
+
+
+def test_remove_old_checkpoints(tmp_path):
+    """Only the last keep checkpoints of this saver are kept, and the ones of a former training are never removed
+    even if they are older.
+    """
+    former_checkpoint = get_checkpoint_path(str(tmp_path), 3, 200)
+    torch.save({}, former_checkpoint)
+
+    saver = AsyncCheckpointSaver(str(tmp_path), keep=2)
+    for this_iter in [100, 200, 300]:
+        saver.save({"rng":get_rng_state()}, 2, this_iter)
+    saver.wait()
+
+    assert sorted(os.listdir(tmp_path)) == ["2.200.checkpoint", "2.300.checkpoint", "3.200.checkpoint"]
+    assert torch.load(get_checkpoint_path(str(tmp_path), 2, 300), weights_only=False)["rng"]["torch"] is not None
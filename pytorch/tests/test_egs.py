@@ -0,0 +1,79 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import os
+import time
+import numpy as np
+
+import libs.support.kaldi_io as kaldi_io
+from libs.egs.egs import BaseBunch
+from libs.egs.egs_index import EgsIndex, get_index_dir, load_egs_index
+
+
+def test_vector_egs_with_chunk_options(tmp_path):
+    """The launchers give the options of chunk egs (use_mmap, pipe_cache_dir) for every egs_type.
+    """
+    rng = np.random.RandomState(0)
+    ark_path = str(tmp_path / "xvector.ark")
+    vectors = {}
+    with open(ark_path, 'wb') as writer:
+        for i in range(8):
+            vectors["utt{0}".format(i)] = rng.randn(6).astype(np.float32)
+            kaldi_io.write_vec_flt(writer, vectors["utt{0}".format(i)], key="utt{0}".format(i))
+
+    lines = ["utt-id ark-path class-label"]
+    lines += [ "{0} {1}:{2} {3}".format(key, ark_path, offset, i % 2) 
+               for i, (key, offset) in enumerate(kaldi_io.index_ark(ark_path)) ]
+    egs_csv = str(tmp_path / "train.egs.csv")
+    with open(egs_csv, 'w') as writer:
+        writer.write("\n".join(lines) + "\n")
+
+    egs_params = {"egs_type":"vector", "use_mmap":True, "pipe_cache_dir":str(tmp_path / "cache"), "cache_size":0}
+    bunch = BaseBunch.get_bunch_from_csv(egs_csv, None, egs_params, {"batch_size":4, "shuffle":False})
+
+    inputs, targets = next(iter(bunch.train_loader))
+    assert inputs.shape[0] == 4 and inputs.shape[-1] == 6
+    np.testing.assert_allclose(inputs.numpy().reshape(4, 6), np.stack([ vectors["utt{0}".format(i)] for i in range(4) ]))
+
+
+def write_chunk_csv(tmp_path, num_utts=6):
+    lines = ["utt-id ark-path start-position end-position class-label"]
+    lines += [ "utt{0} {1}:{2} {3} {4} {5}".format(i, tmp_path / "feats{0}.ark".format(i % 2), 100 * i, i, i + 199, i % 3)
+               for i in range(num_utts) ]
+    lines.append("whole {0} 0 199 1".format(tmp_path / "whole.mat"))
+    egs_csv = str(tmp_path / "train.egs.csv")
+    with open(egs_csv, 'w') as writer:
+        writer.write("\n".join(lines) + "\n")
+    return egs_csv
+
+
+def test_egs_index(tmp_path):
+    egs_csv = write_chunk_csv(tmp_path)
+    egs_index = EgsIndex.from_csv(egs_csv)
+    egs_index.save(get_index_dir(egs_csv))
+    loaded = load_egs_index(egs_csv)
+
+    assert isinstance(loaded.ark_ids, np.memmap) and len(loaded) == 7
+    for index in range(6):
+        assert loaded.get_ark(index) == (str(tmp_path / "feats{0}.ark".format(index % 2)), 100 * index)
+        assert loaded.get_chunk(index) == [index, index + 199]
+        assert loaded.get_target(index) == index % 3
+    # A rxfile without offset.
+    assert loaded.get_ark(6) == (str(tmp_path / "whole.mat"), -1)
+
+
+def test_egs_index_fallback(tmp_path):
+    egs_csv = write_chunk_csv(tmp_path)
+    index_dir = get_index_dir(egs_csv)
+    EgsIndex.from_csv(egs_csv).save(index_dir)
+
+    # An incomplete index.
+    os.remove("{0}/starts.npy".format(index_dir))
+    assert not isinstance(load_egs_index(egs_csv).ark_ids, np.memmap)
+
+    # An index which is older than the csv.
+    EgsIndex.from_csv(egs_csv).save(index_dir)
+    os.utime(egs_csv, (time.time() + 10, time.time() + 10))
+    assert not isinstance(load_egs_index(egs_csv).ark_ids, np.memmap)
+    assert load_egs_index(egs_csv).get_chunk(2) == [2, 201]
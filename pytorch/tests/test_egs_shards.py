@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import numpy as np
+import pytest
+import torch
+
+import libs.support.kaldi_io as kaldi_io
+from libs.egs.egs import ShardEgs, BaseBunch
+from libs.egs.egs_shards import write_egs_shards
+
+
+def write_variable_length_egs(tmp_path, num_utts=20, feat_dim=8):
+    """Write an ark and an egs csv whose chunks have different lengths (max_chunk > min_chunk)
+    and whose label is the index of utt.
+    """
+    rng = np.random.RandomState(0)
+    ark_path = str(tmp_path / "feats.ark")
+    mats = {}
+    with open(ark_path, 'wb') as writer:
+        for i in range(num_utts):
+            mats["utt{0}".format(i)] = rng.randn(120, feat_dim).astype(np.float32)
+            kaldi_io.write_mat(writer, mats["utt{0}".format(i)], key="utt{0}".format(i))
+
+    chunks = {}
+    lines = ["utt-id ark-path start-position end-position class-label"]
+    for key, offset in kaldi_io.index_ark(ark_path):
+        i = int(key[3:])
+        start, end = i, i + 40 + (i % 4) * 10 - 1
+        chunks[i] = mats[key][start:end + 1]
+        lines.append("{0} {1}:{2} {3} {4} {5}".format(key, ark_path, offset, start, end, i))
+
+    egs_csv = str(tmp_path / "train.egs.csv")
+    with open(egs_csv, 'w') as writer:
+        writer.write("\n".join(lines) + "\n")
+
+    return egs_csv, chunks
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_variable_length_shards(tmp_path, dtype):
+    egs_csv, chunks = write_variable_length_egs(tmp_path)
+    # About 6 egs per shard.
+    shards_dir = write_egs_shards(egs_csv, shard_size=0.01, use_index=False, dtype=dtype)
+
+    trainset = ShardEgs(shards_dir, shuffle=False)
+    egs = list(iter(trainset))
+    assert len(egs) == len(chunks)
+
+    for sample, target in egs:
+        expected = chunks[target].T
+        assert sample.shape == expected.shape
+        # The error of int8 is not more than half of (max - min) / 255 of the chunk.
+        atol = 0. if dtype == "float32" else (expected.max() - expected.min()) / 255. / 2 + 1e-5
+        np.testing.assert_allclose(sample, expected, rtol=0., atol=atol)
+
+
+def test_variable_length_shards_batch(tmp_path):
+    egs_csv, chunks = write_variable_length_egs(tmp_path)
+    shards_dir = write_egs_shards(egs_csv, shard_size=0.01, use_index=False)
+
+    # The chunks of a batch are cropped to the shortest one.
+    bunch = BaseBunch(ShardEgs(shards_dir, shuffle=False), batch_size=4)
+    for inputs, targets in bunch.train_loader:
+        num_frames = min([ len(chunks[int(target)]) for target in targets ])
+        assert inputs.shape == (4, 8, num_frames)
+
+
+@pytest.mark.parametrize("batch_size,drop_last", [(4, True), (3, True), (3, False)])
+def test_shards_loader_length(tmp_path, batch_size, drop_last):
+    egs_csv, chunks = write_variable_length_egs(tmp_path)
+    shards_dir = write_egs_shards(egs_csv, shard_size=0.01, use_index=False)
+
+    # Every worker batches its egs alone.
+    bunch = BaseBunch(ShardEgs(shards_dir, seed=1024), batch_size=batch_size, drop_last=drop_last, num_workers=2)
+    batches = list(bunch.train_loader)
+    assert len(bunch.train_loader) == len(batches) == bunch.num_batch_train
+
+    num_egs = sum([ len(targets) for _, targets in batches ])
+    assert num_egs == (len(chunks) // batch_size * batch_size if drop_last else len(chunks))
@@ -0,0 +1,281 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import os
+import struct
+import numpy as np
+import pytest
+
+import libs.support.kaldi_io as kaldi_io
+
+
+def write_mats(tmp_path, name="feats.ark", num_utts=4, dtype=np.float32):
+    """Write an ark of [rows, 5] matrices with different rows and return (ark_path, {key:mat}, {key:offset}).
+    """
+    rng = np.random.RandomState(0)
+    ark_path = str(tmp_path / name)
+    mats = {}
+    with open(ark_path, 'wb') as writer:
+        for i in range(num_utts):
+            key = "utt{0}".format(i)
+            mats[key] = rng.randn(30 + i * 7, 5).astype(dtype)
+            kaldi_io.write_mat(writer, mats[key], key=key)
+    return ark_path, mats, dict(kaldi_io.index_ark(ark_path))
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_mmap_reader(tmp_path, dtype):
+    ark_path, mats, offsets = write_mats(tmp_path, dtype=dtype)
+    reader = kaldi_io.MmapArkReader(max_open=1)
+
+    for key, offset in offsets.items():
+        expected = kaldi_io.read_mat("{0}:{1}".format(ark_path, offset))
+        np.testing.assert_array_equal(expected, mats[key])
+
+        mat = reader.read_mat("{0}:{1}".format(ark_path, offset))
+        assert mat.dtype == dtype
+        np.testing.assert_array_equal(mat, expected)
+
+        chunk = [3, 22]
+        np.testing.assert_array_equal(reader.read_mat_at(ark_path, offset, chunk=chunk),
+                                      kaldi_io.read_mat("{0}:{1}".format(ark_path, offset), chunk=chunk))
+        np.testing.assert_array_equal(kaldi_io.read_mat_at(ark_path, offset, chunk=chunk), expected[3:23])
+
+    with pytest.raises(ValueError):
+        reader.read_mat_at(ark_path, offsets["utt0"], chunk=[20, 30])
+
+
+def write_compressed_mat(writer, key, rows, cols, format, rng):
+    """Write a random compressed matrix of format 'CM ', 'CM2' or 'CM3' (see kaldi compressed-matrix.h) and
+    return its (globmin, globrange, col_headers, data) for the reference decoding.
+    """
+    globmin, globrange = np.float32(-3.5), np.float32(7.25)
+    writer.write("{0} \0B{1}".format(key, format).encode("latin1"))
+    if format != "CM ":
+        writer.write(b" ")
+    writer.write(struct.pack('<ffii', globmin, globrange, rows, cols))
+
+    col_headers = None
+    if format == "CM ":
+        col_headers = np.sort(rng.randint(0, 65536, size=(cols, 4)), axis=1).astype(np.uint16)
+        data = rng.randint(0, 256, size=(cols, rows)).astype(np.uint8)
+        writer.write(col_headers.tobytes())
+    elif format == "CM2":
+        data = rng.randint(0, 65536, size=(rows, cols)).astype(np.uint16)
+    else:
+        data = rng.randint(0, 256, size=(rows, cols)).astype(np.uint8)
+    writer.write(data.tobytes())
+    return globmin, globrange, col_headers, data
+
+
+def decode_compressed_mat(globmin, globrange, col_headers, data):
+    """The reference decoding by masks, i.e. CompressedMatrix::CopyToMat(...).
+    """
+    if col_headers is None:
+        scale = 65535. if data.dtype == np.uint16 else 255.
+        return globmin + globrange / scale * data.astype(np.float64)
+
+    percentiles = col_headers.astype(np.float64) * globrange * 1.52590218966964e-05 + globmin
+    p0, p25, p75, p100 = [ percentiles[:, i:i+1] for i in range(4) ]
+    data = data.astype(np.float64)
+    mat = np.where(data <= 64, p0 + (p25 - p0) / 64. * data,
+          np.where(data <= 192, p25 + (p75 - p25) / 128. * (data - 64), p75 + (p100 - p75) / 63. * (data - 192)))
+    return mat.T
+
+
+@pytest.mark.parametrize("format", ["CM ", "CM2", "CM3"])
+def test_compressed_mat(tmp_path, format):
+    rng = np.random.RandomState(0)
+    ark_path = str(tmp_path / "feats.ark")
+    expected = {}
+    with open(ark_path, 'wb') as writer:
+        for i in range(3):
+            key = "utt{0}".format(i)
+            expected[key] = decode_compressed_mat(*write_compressed_mat(writer, key, 40 + i, 6, format, rng))
+
+    reader = kaldi_io.MmapArkReader()
+    offsets = dict(kaldi_io.index_ark(ark_path))
+    assert list(offsets.keys()) == list(expected.keys())
+
+    for key, offset in offsets.items():
+        for chunk in [None, [5, 24]]:
+            mat = expected[key] if chunk is None else expected[key][chunk[0]:chunk[1]+1]
+            for decoded in [kaldi_io.read_mat("{0}:{1}".format(ark_path, offset), chunk=chunk),
+                            reader.read_mat_at(ark_path, offset, chunk=chunk)]:
+                assert decoded.dtype == np.float32 and decoded.shape == mat.shape
+                np.testing.assert_allclose(decoded, mat, rtol=1e-5, atol=1e-5)
+
+    # The ark is read sequentially as well.
+    for key, mat in kaldi_io.read_mat_ark(ark_path):
+        np.testing.assert_allclose(mat, expected[key], rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("max_gap", [0, 4096])
+def test_read_mats_batch(tmp_path, max_gap):
+    ark_paths, requests, expected = [], [], []
+    for name, dtype in [("a.ark", np.float32), ("b.ark", np.float64)]:
+        ark_path, mats, offsets = write_mats(tmp_path, name=name, dtype=dtype)
+        for key, offset in offsets.items():
+            for start in [0, 7, len(mats[key]) - 20]:
+                requests.append((ark_path, offset, start, start + 19))
+                expected.append(kaldi_io.read_mat("{0}:{1}".format(ark_path, offset), chunk=[start, start + 19]))
+
+    # A compressed matrix is read by read_mat_at.
+    with open(str(tmp_path / "c.ark"), 'wb') as writer:
+        write_compressed_mat(writer, "utt0", 30, 5, "CM ", np.random.RandomState(0))
+    requests.append((str(tmp_path / "c.ark"), 5, 2, 21))
+    expected.append(kaldi_io.read_mat_at(str(tmp_path / "c.ark"), 5, chunk=[2, 21]))
+
+    order = np.random.RandomState(1).permutation(len(requests))
+    requests = [ requests[i] for i in order ]
+    expected = np.stack([ expected[i] for i in order ]).astype(np.float32)
+
+    np.testing.assert_array_equal(kaldi_io.read_mats_batch(requests, max_gap=max_gap), expected)
+    out = np.zeros((len(requests), 5, 20), dtype=np.float32)
+    assert kaldi_io.read_mats_batch(requests, out=out, transpose=True, max_gap=max_gap) is out
+    np.testing.assert_array_equal(out, expected.transpose(0, 2, 1))
+
+    with pytest.raises(ValueError):
+        kaldi_io.read_mats_batch([requests[0][:2] + (0, 19), requests[1][:2] + (0, 9)])
+
+
+def test_pread_merged(tmp_path):
+    path = str(tmp_path / "bytes")
+    data = bytes(range(256)) * 8
+    with open(path, 'wb') as writer:
+        writer.write(data)
+
+    ranges = [(100, 120), (0, 10), (110, 130), (1500, 1600), (5, 6), (2000, 2048)]
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for max_gap in [0, 64, 4096]:
+            results = list(kaldi_io._pread_merged(fd, ranges, max_gap=max_gap))
+            assert [ begin for begin, _ in results ] == [ begin for begin, _ in ranges ]
+            assert [ bytes(buf) for _, buf in results ] == [ data[begin:end] for begin, end in ranges ]
+    finally:
+        os.close(fd)
+
+
+def test_index_ark(tmp_path):
+    """Index an ark of mixed objects, whose offsets are compared to a bytewise scan by read_mat_ark-like reading.
+    """
+    rng = np.random.RandomState(0)
+    ark_path = str(tmp_path / "mixed.ark")
+    with open(ark_path, 'wb') as writer:
+        kaldi_io.write_mat(writer, rng.randn(10, 3).astype(np.float32), key="fm")
+        kaldi_io.write_mat(writer, rng.randn(4, 2), key="dm")
+        write_compressed_mat(writer, "cm", 8, 3, "CM ", rng)
+        write_compressed_mat(writer, "cm2", 8, 3, "CM2", rng)
+        write_compressed_mat(writer, "cm3", 8, 3, "CM3", rng)
+        kaldi_io.write_vec_flt(writer, rng.randn(5).astype(np.float32), key="fv")
+        kaldi_io.write_vec_flt(writer, rng.randn(5), key="dv")
+        kaldi_io.write_vec_int(writer, np.arange(7, dtype=np.int32), key="int")
+        writer.write(b"ascii  [\n  1 2 3\n  4 5 6 ]\n")
+        kaldi_io.write_mat(writer, rng.randn(2, 3).astype(np.float32), key="last")
+
+    expected = []
+    with open(ark_path, 'rb') as fd:
+        key = kaldi_io._read_key_bytewise(fd)
+        while key:
+            offset = fd.tell()
+            if key in ["fv", "dv"]: kaldi_io.read_vec_flt(fd)
+            elif key == "int": kaldi_io.read_vec_int(fd)
+            else: kaldi_io.read_mat(fd)
+            expected.append((key, offset))
+            key = kaldi_io._read_key_bytewise(fd)
+
+    assert list(kaldi_io.index_ark(ark_path)) == expected
+    assert len(expected) == 10
+
+    scp_path = str(tmp_path / "mixed.scp")
+    kaldi_io.write_ark_scp(ark_path, scp_path)
+    with open(scp_path) as reader:
+        assert reader.read().split("\n")[:-1] == [ "{0} {1}:{2}".format(key, ark_path, offset) for key, offset in expected ]
+    np.testing.assert_array_equal(kaldi_io.read_mat("{0}:{1}".format(ark_path, expected[8][1])), [[1, 2, 3], [4, 5, 6]])
+
+
+def test_read_key(tmp_path):
+    # Longer than the buffer of reader, so the key is found across buffers.
+    keys = ["a" * 10000, "utt1", "b"]
+    ark_path = str(tmp_path / "keys.ark")
+    with open(ark_path, 'wb') as writer:
+        for key in keys:
+            kaldi_io.write_vec_flt(writer, np.ones(2, dtype=np.float32), key=key)
+
+    with open(ark_path, 'rb', buffering=4096) as fd:
+        assert [ key for key, vec in kaldi_io.read_vec_flt_ark(fd) ] == keys
+
+
+def write_vecs(tmp_path, name, num_utts=20, dim=6, dtype=np.float32, key_prefix="utt"):
+    rng = np.random.RandomState(len(name))
+    ark_path = str(tmp_path / name)
+    with open(ark_path, 'wb') as writer:
+        for i in range(num_utts):
+            kaldi_io.write_vec_flt(writer, rng.randn(dim).astype(dtype), key="{0}{1}".format(key_prefix, i))
+    return ark_path
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_load_vectors(tmp_path, dtype):
+    ark_paths = [write_vecs(tmp_path, "a.ark", dtype=dtype, key_prefix="a"), 
+                 write_vecs(tmp_path, "bb.ark", dtype=dtype, key_prefix="b")]
+    expected = [ (key, vec) for ark_path in ark_paths for key, vec in kaldi_io.read_vec_flt_ark(ark_path) ]
+
+    keys, mat = kaldi_io.load_vectors("ark:{0}".format(ark_paths[0]))
+    assert keys == [ key for key, _ in expected[:20] ]
+    np.testing.assert_array_equal(mat, np.stack([ vec for _, vec in expected[:20] ]))
+
+    # A scp of two arks in shuffled order.
+    order = np.random.RandomState(0).permutation(len(expected))
+    offsets = [ (ark_path, offset) for ark_path in ark_paths for _, offset in kaldi_io.index_ark(ark_path) ]
+    scp_path = str(tmp_path / "xvector.scp")
+    with open(scp_path, 'w') as writer:
+        for i in order:
+            writer.write("{0} {1}:{2}\n".format(expected[i][0], *offsets[i]))
+
+    for cache in [False, True, True]:
+        keys, mat = kaldi_io.load_vectors("scp:{0}".format(scp_path), num_threads=2, cache=cache)
+        assert keys == [ expected[i][0] for i in order ]
+        assert mat.dtype == dtype
+        np.testing.assert_array_equal(mat, np.stack([ expected[i][1] for i in order ]))
+    assert os.path.exists(scp_path + ".npy")
+
+
+def test_load_vectors_fallback(tmp_path):
+    # The vectors with different dims could not be located by the pattern of the first one.
+    ark_path = str(tmp_path / "xvector.ark")
+    with open(ark_path, 'wb') as writer:
+        kaldi_io.write_vec_flt(writer, np.ones(4, dtype=np.float32), key="a")
+        kaldi_io.write_vec_flt(writer, np.ones(5, dtype=np.float32), key="b")
+    assert kaldi_io._load_ark_vectors(ark_path) == (None, None)
+
+    ark_path = write_vecs(tmp_path, "c.ark")
+    keys, mat = kaldi_io.load_vectors("ark:cat {0} |".format(ark_path))
+    assert keys == [ key for key, _ in kaldi_io.read_vec_flt_ark(ark_path) ]
+    np.testing.assert_array_equal(mat, np.stack([ vec for _, vec in kaldi_io.read_vec_flt_ark(ark_path) ]))
+
+
+def test_pipe_cache(tmp_path):
+    ark_path, mats, _ = write_mats(tmp_path)
+    cache = kaldi_io.PipeCache(str(tmp_path / "cache"), log_interval=0)
+
+    # A pipe writes an ark (with key) or a single matrix.
+    for rxfile in ["cat {0} |".format(ark_path), "tail -c +6 {0} |".format(ark_path)]:
+        for i in range(2):
+            cache_path, offset = cache.get(rxfile)
+            assert offset == 0
+            np.testing.assert_array_equal(kaldi_io.read_mat_at(cache_path, offset), mats["utt0"])
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+@pytest.mark.parametrize("rxfile", ["cat {0}; exit 3 |", "kill -9 $$ |", "true |", "printf abc |"])
+def test_pipe_cache_failure(tmp_path, rxfile):
+    ark_path, _, _ = write_mats(tmp_path)
+    cache = kaldi_io.PipeCache(str(tmp_path / "cache"), log_interval=0)
+
+    # The output of a failed command is never cached.
+    for i in range(2):
+        with pytest.raises((kaldi_io.SubprocessFailed, kaldi_io.BadInputFormat)):
+            cache.get(rxfile.format(ark_path))
+    assert all([ len(files) == 0 for _, _, files in os.walk(str(tmp_path / "cache")) ])
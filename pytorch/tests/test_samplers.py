@@ -0,0 +1,153 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import numpy as np
+import pytest
+import torch
+
+import libs.egs.samplers as samplers
+from libs.egs.egs import BaseBunch
+
+
+def get_rank_samplers(monkeypatch, world_size, Sampler, *args, **kwargs):
+    """Create the sampler of every rank as a world_size-rank training does.
+    """
+    rank_samplers = []
+    for rank in range(world_size):
+        monkeypatch.setattr(samplers, "get_rank_and_world_size", lambda rank=rank: (rank, world_size))
+        rank_samplers.append(Sampler(*args, **kwargs))
+    return rank_samplers
+
+
+def check_resume(sampler, epoch, start):
+    """Resuming an epoch from start yields the remaining items of it.
+    """
+    sampler.set_epoch(epoch)
+    items = list(sampler)
+    sampler.set_epoch(epoch, start)
+    assert list(sampler) == items[start:]
+
+
+@pytest.mark.parametrize("num_samples", [12, 10])
+def test_seeded_sampler_ranks(monkeypatch, num_samples):
+    rank_samplers = get_rank_samplers(monkeypatch, 3, samplers.SeededSampler, num_samples, seed=1024)
+    for sampler in rank_samplers:
+        sampler.set_epoch(2)
+    indexes = [ list(sampler) for sampler in rank_samplers ]
+
+    # The ranks are padded to the same length like DistributedSampler and they are disjoint but the padding.
+    assert [ len(rank_indexes) for rank_indexes in indexes ] == [ 4 ] * 3
+    all_indexes = np.concatenate(indexes)
+    assert sorted(set(all_indexes.tolist())) == list(range(num_samples))
+    assert len(all_indexes) - len(set(all_indexes.tolist())) == 12 - num_samples
+
+    rank_samplers[0].set_epoch(3)
+    assert list(rank_samplers[0]) != indexes[0]
+
+    check_resume(rank_samplers[1], 2, 3)
+
+
+def test_bunch_resume_mid_epoch():
+    get_bunch = lambda: BaseBunch(torch.utils.data.TensorDataset(torch.arange(100)), batch_size=8, seed=7)
+
+    bunch = get_bunch()
+    bunch.set_epoch(1)
+    batches = [ batch[0].tolist() for batch in bunch.train_loader ]
+    assert len(batches) == len(bunch) == 12
+    # The state after the 5th batch of epoch 1.
+    state = bunch.state_dict(this_iter=4)
+
+    resumed_bunch = get_bunch()
+    resumed_bunch.load_state_dict(state)
+    resumed_bunch.set_epoch(1)
+    assert [ batch[0].tolist() for batch in resumed_bunch.train_loader ] == batches[5:]
+
+    # The next epoch starts from its beginning.
+    resumed_bunch.set_epoch(2)
+    assert len([ batch for batch in resumed_bunch.train_loader ]) == 12
+
+
+def test_online_chunk_sampler_ranks(monkeypatch):
+    random_state = np.random.RandomState(0)
+    num_frames = random_state.randint(150, 600, size=40)
+    num_frames[:3] = 100 # Shorter than chunk_size, so skipped.
+    labels = random_state.randint(0, 6, size=40)
+
+    rank_samplers = get_rank_samplers(monkeypatch, 2, samplers.OnlineChunkSampler, num_frames, labels, 200,
+                                      num_chunks_per_spk=10, seed=1024)
+    for sampler in rank_samplers:
+        sampler.set_epoch(3)
+    chunks = [ list(sampler) for sampler in rank_samplers ]
+
+    # Every rank gets its equal part of the chunks of the epoch and every speaker is balanced.
+    assert [ len(rank_chunks) for rank_chunks in chunks ] == [ len(rank_samplers[0]) ] * 2
+    all_chunks = rank_samplers[0].get_chunks(3)
+    assert len(all_chunks) == len(chunks[0]) * 2
+    for rank, rank_chunks in enumerate(chunks):
+        assert rank_chunks == [ tuple(chunk) for chunk in all_chunks[rank::2].tolist() ]
+
+    spk_counts = np.bincount(labels[all_chunks[:, 0]], minlength=labels.max() + 1)
+    assert (spk_counts[np.unique(labels[3:])] == 10).all()
+
+    for utt_index, start in chunks[0] + chunks[1]:
+        assert num_frames[utt_index] >= 200
+        assert 0 <= start <= num_frames[utt_index] - 200
+
+    # The chunks are drawn again in a new epoch.
+    rank_samplers[0].set_epoch(4)
+    assert list(rank_samplers[0]) != chunks[0]
+
+    check_resume(rank_samplers[1], 3, 7)
+
+
+def test_bucket_batch_sampler_ranks(monkeypatch):
+    lengths = np.random.RandomState(0).randint(100, 400, size=500)
+
+    rank_samplers = get_rank_samplers(monkeypatch, 2, samplers.BucketBatchSampler, lengths, 4000,
+                                      bucket_width=50, seed=1024)
+    for sampler in rank_samplers:
+        sampler.set_epoch(1)
+    batches = [ list(sampler) for sampler in rank_samplers ]
+
+    assert [ len(rank_batches) for rank_batches in batches ] == [ len(rank_samplers[0]) ] * 2
+    indexes = [ np.concatenate(rank_batches) for rank_batches in batches ]
+    assert len(np.intersect1d(indexes[0], indexes[1])) == 0
+    assert len(np.unique(np.concatenate(indexes))) == len(indexes[0]) + len(indexes[1])
+
+    for batch in batches[0] + batches[1]:
+        # A batch is in one bucket and capped by max_frames.
+        assert (lengths[batch] - lengths.min()).min() // 50 == (lengths[batch] - lengths.min()).max() // 50
+        assert len(batch) * lengths[batch].max() <= 4000
+
+    check_resume(rank_samplers[0], 1, 5)
+
+
+def test_speaker_batch_sampler_ranks(monkeypatch):
+    random_state = np.random.RandomState(0)
+    # 13 speakers with 3 ~ 20 chunks, so a speaker is dropped to balance 2 ranks.
+    labels = np.repeat(np.arange(13), random_state.randint(3, 21, size=13))
+    labels = labels[random_state.permutation(len(labels))]
+
+    rank_samplers = get_rank_samplers(monkeypatch, 2, samplers.SpeakerBatchSampler, labels, 4, 3, seed=1024)
+    for sampler in rank_samplers:
+        sampler.set_epoch(5)
+    batches = [ list(sampler) for sampler in rank_samplers ]
+
+    assert [ len(rank_batches) for rank_batches in batches ] == [ len(rank_samplers[0]) ] * 2
+    rank_spks = []
+    for rank_batches in batches:
+        spks = set()
+        for batch in rank_batches:
+            # P x K: 4 different speakers and 3 different chunks of every speaker.
+            assert len(set(batch)) == 12
+            spk_ids, counts = np.unique(labels[batch], return_counts=True)
+            assert len(spk_ids) == 4 and (counts == 3).all()
+            spks.update(spk_ids.tolist())
+        rank_spks.append(spks)
+
+    # The speakers are partitioned to the ranks.
+    assert len(rank_spks[0] & rank_spks[1]) == 0
+    assert len(rank_spks[0]) <= 6 and len(rank_spks[1]) <= 6
+
+    check_resume(rank_samplers[1], 5, 2)
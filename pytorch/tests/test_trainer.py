@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import queue
+import types
+import pandas as pd
+import pytest
+import torch
+
+import libs.support.utils as utils
+from libs.nnet.framework import TopVirtualNnet
+from libs.nnet.loss import SoftmaxLoss
+from libs.training.reporter import Reporter
+from libs.training.trainer import SimpleTrainer
+from libs.training.validator import AsyncValidator
+
+
+class LinearXvector(TopVirtualNnet):
+    def init(self, input_dim, num_targets):
+        self.linear = torch.nn.Linear(input_dim, 8)
+        self.loss = SoftmaxLoss(8, num_targets)
+
+    @utils.for_device_free
+    def forward(self, inputs):
+        return self.linear(inputs.mean(dim=2)).unsqueeze(2)
+
+    @utils.for_device_free
+    def get_loss(self, inputs, targets):
+        return self.loss(inputs, targets)
+
+
+def make_trainer(tmp_path, num_batch_train=40, **params):
+    torch.manual_seed(0)
+    model = LinearXvector(4, 3)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9, weight_decay=0.1)
+    data = types.SimpleNamespace(num_batch_train=num_batch_train)
+    params = dict({"model_dir":str(tmp_path), "model_blueprint":"model.py", "sync_free":True}, **params)
+    return SimpleTrainer(({"data":data, "model":model, "optimizer":optimizer}, params))
+
+
+@pytest.mark.parametrize("params,interval", [({"report_interval_iters":7}, 7), ({"report_times_every_epoch":4}, 10)])
+def test_sync_points(tmp_path, params, interval):
+    trainer = make_trainer(tmp_path, **params)
+    sync_iters = [ this_iter for this_iter in range(40) if trainer.is_sync_point((0, this_iter, 40)) ]
+    assert sync_iters == list(range(0, 40, interval)) + ([39] if 39 % interval != 0 else [])
+
+
+def test_sync_free_nan(tmp_path):
+    """The nan grads are zeroed and the optimizer steps in sync_free training, then the nan is raised by the next
+    sync point with its iter.
+    """
+    trainer = make_trainer(tmp_path)
+    targets = torch.tensor([0, 1, 2, 0])
+
+    for this_iter in range(3):
+        trainer.training_point = (0, this_iter, 40)
+        inputs = torch.randn(4, 4, 5)
+        if this_iter == 1:
+            inputs[0, 0, 0] = float("nan")
+        loss, acc = trainer.train_one_batch((inputs, targets), sync=False)
+        if this_iter == 1:
+            assert all([ (param.grad == 0).all() for param in trainer.elements["model"].parameters() ])
+        trainer.pending_records.append((trainer.training_point, trainer.get_current_lr(), loss, acc, trainer.grad_norm))
+
+    for param in trainer.elements["model"].parameters():
+        assert torch.isfinite(param).all()
+
+    with pytest.raises(RuntimeError, match="iter/epoch: 2/1"):
+        trainer.materialize_records()
+
+
+def test_async_validation_failed(tmp_path):
+    """A failed validation gives an empty result, which clears the pending valid of reporter, so the held records
+    are written.
+    """
+    trainer = make_trainer(tmp_path)
+    validator = AsyncValidator(trainer)
+
+    def broken_loader():
+        raise IOError("broken valid egs")
+        yield
+
+    assert validator.submit(broken_loader(), (0, 10, 40))
+    assert validator.get_result(wait=True) == ((0, 10, 40), None, None)
+
+    # A reporter without its progressbar and update process.
+    reporter = Reporter.__new__(Reporter)
+    reporter.device, reporter.queue, reporter.start_write_log = "cpu", queue.Queue(), False
+    reporter.record_file = "{0}/train.csv".format(tmp_path)
+    reporter.record_value = []
+
+    for valid_result in [((0, 10, 40), None, None), ((0, 10, 40), 0.5, None)]:
+        reporter.record_value.append({"epoch":1, "iter":11, "train_loss":"1.0", "valid_loss":None, "valid_acc":None})
+        assert reporter.has_pending_valid()
+        reporter.update_valid(*valid_result)
+        _, training_point, valid_dict = reporter.queue.get()
+        reporter.record_valid(valid_dict, training_point)
+        assert not reporter.has_pending_valid() and len(reporter.record_value) == 0
+
+    records = pd.read_csv(reporter.record_file, dtype=str, keep_default_na=False)
+    assert records["valid_loss"].tolist() == ["", "0.500000"]
+    assert records["valid_acc"].tolist() == ["", ""]
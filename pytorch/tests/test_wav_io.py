@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*-
+
+# Copyright xmuspeech
+
+import os
+import wave
+import numpy as np
+
+import libs.support.utils as utils
+import libs.support.wav_io as wav_io
+
+
+def write_wav_scp(tmp_path, num_wavs=3):
+    random_state = np.random.RandomState(0)
+    wavs = {}
+    with open("{0}/wav.scp".format(tmp_path), 'w') as writer:
+        for i in range(num_wavs):
+            samples = random_state.randint(-1000, 1000, size=1600 * (i + 1)).astype('<i2')
+            wav_path = "{0}/{1}.wav".format(tmp_path, i)
+            with wave.open(wav_path, 'wb') as wav_writer:
+                wav_writer.setnchannels(1)
+                wav_writer.setsampwidth(2)
+                wav_writer.setframerate(16000)
+                wav_writer.writeframes(samples.tobytes())
+            writer.write("utt{0} {1}\n".format(i, wav_path))
+            wavs["utt{0}".format(i)] = samples
+    return "{0}/wav.scp".format(tmp_path), wavs
+
+
+def test_load_wav_index(tmp_path):
+    wav_scp, wavs = write_wav_scp(tmp_path)
+
+    wav_index = wav_io.load_wav_index(wav_scp)
+    # The index is renamed from its temp dir.
+    assert sorted(os.listdir(tmp_path)) == sorted(["0.wav", "1.wav", "2.wav", "wav.scp", "wav.index"])
+
+    reader = wav_io.MmapWavReader()
+    for name, index in wav_index.get_name2index().items():
+        np.testing.assert_array_equal(reader.get_samples(wav_index, index), wavs[name])
+
+    # A newer wav.scp is indexed again.
+    with open(wav_scp, 'a') as writer:
+        writer.write("utt3 {0}/0.wav\n".format(tmp_path))
+    os.utime(wav_scp, (os.path.getmtime(wav_scp) + 10, os.path.getmtime(wav_scp) + 10))
+    assert len(wav_io.load_wav_index(wav_scp)) == 4
+
+
+def test_load_wav_index_other_ranks(tmp_path, monkeypatch):
+    """The other ranks wait at the barrier and load the index built by the main one.
+    """
+    wav_scp, wavs = write_wav_scp(tmp_path)
+    wav_io.load_wav_index(wav_scp)
+
+    barrier_calls = []
+    monkeypatch.setattr(utils, "is_main_training", lambda: False)
+    monkeypatch.setattr(utils, "barrier", lambda: barrier_calls.append(1))
+    monkeypatch.setattr(wav_io.WavIndex, "from_scp", None)
+
+    os.utime(wav_scp, (os.path.getmtime(wav_scp) + 10, os.path.getmtime(wav_scp) + 10))
+    assert len(wav_io.load_wav_index(wav_scp)) == 3
+    assert barrier_calls == [1]
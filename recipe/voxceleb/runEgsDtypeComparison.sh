@@ -0,0 +1,61 @@
+#!/bin/bash
+
+# Copyright xmuspeech (Author: Snowdar 2020-02-23)
+
+### Compare the EER of the standard x-vector trained on float32 chunk egs and on float32/float16/int8 shards of the
+### same egs (see stage 3 of subtools/pytorch/pipeline/preprocess_to_egs.sh). Run it after the data preparing of
+### runVoxceleb.sh. The shards of every dtype are written into a copy of the egsdir (only the csv and info are copied
+### and the arks are shared), so the chunks, the valid set and the seed are the same for all variants.
+
+stage=0
+endstage=3
+dtypes="float32 float16 int8"
+epochs="21"
+gpu_id=
+
+prefix=mfcc_23_pitch
+traindata=data/$prefix/voxceleb1_train_aug
+egsdir=exp/egs/${prefix}_voxceleb1_train_aug_speaker_balance # The default egsdir of runStandardXvector-voxceleb1.py.
+modeldir=exp/standard_voxceleb1
+
+. subtools/parse_options.sh
+. subtools/path.sh
+
+gpu_option=
+[ "$gpu_id" != "" ] && gpu_option="--gpu-id=$gpu_id"
+
+# Get the float32 chunk egs and the baseline model (stage 0 -> 4 of the launcher).
+if [[ $stage -le 0 && 0 -le $endstage ]];then
+    subtools/runPytorchLauncher.sh subtools/recipe/voxceleb/runStandardXvector-voxceleb1.py --stage=0 \
+        --egs-dir=$egsdir --model-dir=$modeldir $gpu_option || exit 1
+fi
+
+# Write the shards of every dtype.
+if [[ $stage -le 1 && 1 -le $endstage ]];then
+    for dtype in $dtypes;do
+        mkdir -p ${egsdir}_shard_$dtype
+        cp -r $egsdir/info $egsdir/train.egs.csv ${egsdir}_shard_$dtype/
+        [ -f $egsdir/valid.egs.csv ] && cp $egsdir/valid.egs.csv ${egsdir}_shard_$dtype/
+        sh subtools/pytorch/pipeline/preprocess_to_egs.sh --stage 3 --endstage 3 --shard-dtype $dtype \
+            $traindata ${egsdir}_shard_$dtype || exit 1
+    done
+fi
+
+# Train and extract xvectors from every shard variant.
+if [[ $stage -le 2 && 2 -le $endstage ]];then
+    for dtype in $dtypes;do
+        subtools/runPytorchLauncher.sh subtools/recipe/voxceleb/runStandardXvector-voxceleb1.py --stage=3 \
+            --egs-type=shard --egs-dir=${egsdir}_shard_$dtype --model-dir=${modeldir}_shard_$dtype $gpu_option || exit 1
+    done
+fi
+
+# Score all variants by the same back-end (lda256 -> norm -> PLDA) and compare the EER% with the baseline.
+if [[ $stage -le 3 && 3 -le $endstage ]];then
+    for vectordir in $modeldir $(for dtype in $dtypes;do echo ${modeldir}_shard_$dtype;done);do
+        echo "[ $vectordir ]"
+        subtools/recipe/voxceleb/gather_results_from_epochs.sh --prefix $prefix --vectordir $vectordir \
+                                                               --epochs "$epochs" --score plda --score-norm false
+    done
+fi
+
+exit 0
@@ -138,6 +138,20 @@ parser.add_argument("--run-lr-finder", type=str, action=kaldi_common.StrToBoolAc
 parser.add_argument("--sleep", type=int, default=0,
                     help="The waiting time to launch a launcher.")
 
+parser.add_argument("--use-amp", type=str, action=kaldi_common.StrToBoolAction,
+                    default=False, choices=["true", "false"],
+                    help="Mixed-precision training by autocast and GradScaler (CUDA only).")
+
+parser.add_argument("--egs-type", type=str, default="chunk",
+                    choices=["chunk", "shard"],
+                    help="Use shard after writing shards of egs by stage 3 of preprocess_to_egs.sh.")
+
+parser.add_argument("--egs-dir", type=str, default="",
+                    help="If NULL, use the default egsdir of this launcher.")
+
+parser.add_argument("--model-dir", type=str, default="",
+                    help="If NULL, use the default model_dir of this launcher.")
+
 parser.add_argument("--local_rank", type=int, default=0,
                     help="Do not delete it when using DDP-based multi-GPU training.\n"
                          "It is important for torch.distributed.launch.")
@@ -178,6 +192,7 @@ gpu_id = args.gpu_id # If NULL, then it will be auto-specified.
 run_lr_finder = args.run_lr_finder
 
 egs_params = {
+    "egs_type":args.egs_type, # chunk or shard.
     "aug":None, # None or specaugment. If use aug, you should close the aug_dropout which is in model_params.
     "aug_params":{"frequency":0.2, "frame":0.2, "rows":4, "cols":4, "random_rows":True,"random_rows":True}
 }
@@ -262,6 +277,10 @@ egs_dir="exp/egs/mfcc_23_pitch_voxceleb1_train_aug" + "_" + sample_type
 
 model_blueprint="subtools/pytorch/model/snowdar-xvector.py"
 model_dir="exp/standard_voxceleb1"
+
+# Override them to compare the variants of egs (e.g. float16/int8 shards, see runEgsDtypeComparison.sh).
+if args.egs_dir != "": egs_dir = args.egs_dir
+if args.model_dir != "": model_dir = args.model_dir
 ##--------------------------------------------------##
 ##
 ######################################################### START #########################################################
@@ -336,7 +355,8 @@ if stage <= 3 <= endstage:
             {"model_dir":model_dir, "model_blueprint":model_blueprint, "exist_model":exist_model, 
             "start_epoch":train_stage, "epochs":epochs, "use_gpu":use_gpu, "gpu_id":gpu_id, 
             "benchmark":benchmark, "suffix":suffix, "report_times_every_epoch":report_times_every_epoch,
-            "report_interval_iters":report_interval_iters, "record_file":"train.csv"})
+            "report_interval_iters":report_interval_iters, "record_file":"train.csv",
+            "use_amp":args.use_amp})
 
     trainer = trainer.SimpleTrainer(package, stop_early=stop_early)
 
@@ -115,4 +115,13 @@ subtools/recipe/voxceleb/gather_results_from_epochs.sh --vectordir exp/standard_
 
 # Scoring for other models could be done like above.
 
+# Compare the EER% of float32 chunk egs with float32/float16/int8 shards of the same egs (train -> extract -> score).
+#subtools/recipe/voxceleb/runEgsDtypeComparison.sh --dtypes "float32 float16 int8" --epochs "21"
+
+# Compare the mixed-precision (AMP) training with float32 (the baseline exp/standard_voxceleb1 above).
+# The step time of both could be measured by subtools/pytorch/bin/benchmark_trainer.py --modes=fp32,amp.
+#subtools/runPytorchLauncher.sh runStandardXvector-voxceleb1.py --stage=3 --use-amp=true --model-dir=exp/standard_voxceleb1_amp
+#subtools/recipe/voxceleb/gather_results_from_epochs.sh --vectordir exp/standard_voxceleb1_amp \
+#                                                       --epochs "21" --score plda --score-norm false
+
 ### All Done ###
\ No newline at end of file
@@ -118,7 +118,8 @@ def main():
     coral=CORAL()
     coral.plda_read(plda)
 
-    for _,vec in kaldi_io.read_vec_flt_auto(train_vecs_adapt):
+    _, vectors = kaldi_io.load_vectors(train_vecs_adapt)
+    for vec in vectors:
         coral.add_stats(1,vec)
     coral.update_plda()
 
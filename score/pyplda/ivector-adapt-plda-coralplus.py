@@ -133,7 +133,8 @@ def main():
     coralplus=CORALPlus()
     coralplus.plda_read(plda)
 
-    for _,vec in kaldi_io.read_vec_flt_auto(train_vecs_adapt):
+    _, vectors = kaldi_io.load_vectors(train_vecs_adapt)
+    for vec in vectors:
         coralplus.add_stats(1,vec)
     coralplus.update_plda()
 
@@ -27,7 +27,8 @@ def main():
     plda_new.get_output()
 
     aplda_model=PldaUnsupervisedAdaptor()
-    for _,vec in kaldi_io.read_vec(train_vecs_adapt):
+    _, vectors = kaldi_io.load_vectors(train_vecs_adapt)
+    for vec in vectors:
         aplda_model.add_stats(1,vec)
     aplda_model.update_plda(plda_new)
     plda_new.plda_trans_write(plda_adapt)
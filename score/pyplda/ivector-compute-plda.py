@@ -46,20 +46,15 @@ def main():
             for utt in temp_list:
                 utt2spk_dict[utt] = spk
 
-    spk2vectors = {}
-    for key,vector in kaldi_io.read_vec_flt_auto(ivectors_reader):
-        dim = vector.shape[0]
-        spk = utt2spk_dict[key]
-        try:
-            tmp_list = spk2vectors[spk]
-            tmp_list.append(vector)
-            spk2vectors[spk] = tmp_list
-        except KeyError:
-            spk2vectors[spk] = [vector]
+    keys, all_vectors = kaldi_io.load_vectors(ivectors_reader)
+    dim = all_vectors.shape[1]
+    spk2indexes = {}
+    for index, key in enumerate(keys):
+        spk2indexes.setdefault(utt2spk_dict[key], []).append(index)
 
     plda_stats=PldaStats(dim)
-    for key in spk2vectors.keys():
-        vectors = np.array(spk2vectors[key], dtype=float)
+    for key in spk2indexes.keys():
+        vectors = np.array(all_vectors[spk2indexes[key]], dtype=float)
         weight = 1.0
         plda_stats.add_samples(weight,vectors)
 